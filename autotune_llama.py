@@ -0,0 +1,156 @@
+"""Benchmark llama.cpp runtime settings on this host and save the best as its profile.
+
+Prefill (prompt evaluation) and decode (one token at a time) throughput are
+measured on the real few-shot prompt, in three stages so the search stays
+short: memory mapping (mmap / mlock / plain read), decode thread count, then
+batch size x prefill thread count. The result is written to the per-host
+profile that llm_provider.load_config() applies automatically.
+
+    python autotune_llama.py
+    python autotune_llama.py --threads 4 8 16 --batch-sizes 256 512 --dry-run
+"""
+import argparse
+import time
+
+import llama_cpp
+
+from llm_provider import (
+    PROFILE_KEYS,
+    current_model_id,
+    load_config,
+    load_llm,
+    save_host_profile,
+    thread_budget,
+)
+from natural_languange_to_CAD import build_prompt
+
+BENCH_REQUEST = "Make a 60x40x8 plate with four corner holes of radius 3 and a centered hole of radius 10."
+MEMORY_OPTIONS = [
+    {"use_mmap": True, "use_mlock": False},
+    {"use_mmap": True, "use_mlock": True},
+    {"use_mmap": False, "use_mlock": False},
+]
+
+
+def candidate_threads(limit):
+    """A spread of thread counts up to `limit` (the cores available to one worker)."""
+    counts = {1, 2, 4, limit // 4, limit // 2, (3 * limit) // 4, limit}
+    return sorted(n for n in counts if 1 <= n <= limit)
+
+
+def measure(llm, tokens, decode_tokens, repeat=1):
+    """Best-of-`repeat` (prefill tokens/s, decode tokens/s) for `tokens` on a loaded model."""
+    prefill, decode = 0.0, 0.0
+    for _ in range(repeat):
+        llm.reset()
+        start = time.perf_counter()
+        llm.eval(tokens)
+        prefill = max(prefill, len(tokens) / (time.perf_counter() - start))
+        start = time.perf_counter()
+        for i in range(decode_tokens):
+            llm.eval([tokens[i % len(tokens)]])
+        decode = max(decode, decode_tokens / (time.perf_counter() - start))
+    return prefill, decode
+
+
+def set_threads(llm, n_threads, n_threads_batch):
+    """Change the thread counts of a loaded model without reloading it."""
+    llama_cpp.llama_set_n_threads(llm.ctx, n_threads, n_threads_batch)
+
+
+def autotune(config, threads=None, batch_sizes=(128, 256, 512, 1024), decode_tokens=32, repeat=2):
+    """Run the three tuning stages. Returns (best settings, list of result rows)."""
+    prompt = build_prompt(BENCH_REQUEST)
+    limit = thread_budget(dict(config, n_threads=None))
+    threads = threads or candidate_threads(limit)
+    best = {key: config[key] for key in PROFILE_KEYS}
+    best["n_threads"] = best["n_threads"] or limit
+    best["n_threads_batch"] = best["n_threads_batch"] or limit
+    results = []
+
+    def load(**overrides):
+        settings = dict(config, **best)
+        settings.update(overrides)
+        llm = load_llm(settings)
+        tokens = llm.tokenize(prompt.encode("utf-8"), special=True)
+        if len(tokens) + decode_tokens >= llm.n_ctx():
+            raise SystemExit(f"❌ n_ctx={llm.n_ctx()} is too small for the {len(tokens)}-token prompt")
+        return llm, tokens
+
+    # Stage 1: how the weights are brought into memory (load time + first prefill)
+    print("🔧 Stage 1: memory mapping")
+    scores = []
+    # worker pools rely on mmap to share one copy of the weights
+    options = [o for o in MEMORY_OPTIONS if o["use_mmap"] or config["n_workers"] <= 1]
+    for option in options:
+        start = time.perf_counter()
+        try:
+            llm, tokens = load(**option)
+        except (ValueError, RuntimeError) as e:
+            print(f"  {option}: failed ({e})")
+            continue
+        load_s = time.perf_counter() - start
+        prefill, decode = measure(llm, tokens, decode_tokens, repeat=1)
+        del llm
+        results.append(dict(option, stage="memory", load_s=load_s, prefill_tps=prefill, decode_tps=decode))
+        print(f"  {option}: load {load_s:.2f}s, prefill {prefill:.1f} tok/s, decode {decode:.1f} tok/s")
+        scores.append((load_s + len(tokens) / prefill, option))
+    if not scores:
+        raise SystemExit(f"❌ The model at {config['model_path']} did not load with any memory option (see above)")
+    best.update(min(scores, key=lambda score: score[0])[1])
+
+    # Stage 2: decode threads (single-token evals are latency bound, more threads can hurt)
+    print("🔧 Stage 2: decode threads")
+    llm, tokens = load()
+    rates = []
+    for n in threads:
+        set_threads(llm, n, best["n_threads_batch"])
+        _, decode = measure(llm, tokens[:64], decode_tokens, repeat=repeat)
+        results.append({"stage": "decode", "n_threads": n, "decode_tps": decode})
+        print(f"  n_threads={n}: decode {decode:.1f} tok/s")
+        rates.append((decode, n))
+    best["n_threads"] = max(rates)[1]
+    del llm
+
+    # Stage 3: batch size x prefill threads (the batch size needs a reload)
+    print("🔧 Stage 3: prefill batch size and threads")
+    rates = []
+    for n_batch in batch_sizes:
+        llm, tokens = load(n_batch=n_batch)
+        for n in threads:
+            set_threads(llm, best["n_threads"], n)
+            prefill, _ = measure(llm, tokens, 0, repeat=repeat)
+            results.append({"stage": "prefill", "n_batch": n_batch, "n_threads_batch": n, "prefill_tps": prefill})
+            print(f"  n_batch={n_batch} n_threads_batch={n}: prefill {prefill:.1f} tok/s")
+            rates.append((prefill, n_batch, n))
+        del llm
+    _, best["n_batch"], best["n_threads_batch"] = max(rates)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune llama.cpp runtime settings for this host.")
+    parser.add_argument("--threads", type=int, nargs="+", help="thread counts to try (default: a spread up to the core share)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[128, 256, 512, 1024])
+    parser.add_argument("--decode-tokens", type=int, default=32, help="tokens per decode measurement")
+    parser.add_argument("--repeat", type=int, default=2, help="measurements per setting, best is kept")
+    parser.add_argument("--dry-run", action="store_true", help="print the result without saving the profile")
+    args = parser.parse_args()
+
+    config = load_config()
+    config["verbose"] = False
+    best, results = autotune(
+        config,
+        threads=args.threads,
+        batch_sizes=args.batch_sizes,
+        decode_tokens=args.decode_tokens,
+        repeat=args.repeat,
+    )
+    print("✅ Best settings:", best)
+    if not args.dry_run:
+        path = save_host_profile(best, n_workers=config["n_workers"], model_id=current_model_id(), results=results)
+        print(f"💾 Profile saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
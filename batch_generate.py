@@ -0,0 +1,165 @@
+"""Batch NL -> CAD over a JSONL file of prompts.
+
+The LLM stage runs in this process (one shared model), while parsing,
+validation, execute_dsl and export run in a process pool, so OpenCascade
+booleans of earlier items overlap with decoding of later ones. With
+n_parallel > 1 (batching scheduler) or n_workers > 1 (model worker pool) that
+many prompts decode at once.
+
+    python batch_generate.py prompts.jsonl -o results.jsonl --cad-workers 4
+    python batch_generate.py requests.jsonl --field body --id-field request_id
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import tracing
+from few_shot import add_example
+from llm_provider import load_config
+from natural_languange_to_CAD import execute_dsl_cached, parse_dsl, prompt_to_dsl, validate_dsl
+from shape_cache import store_shape
+
+
+def read_prompts(path, field="prompt", id_field="id"):
+    """Yield (item_id, prompt) for every non-empty line of a JSONL file."""
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            yield str(item.get(id_field, line_no)), item[field]
+
+
+def run_cad_stage(dsl, output_dir):
+    """Worker-side stage: parse, validate, build and export one DSL program.
+
+    The built solid is written to the shape cache, so previewing the result
+    from the parent process skips STEP parsing.
+    """
+    start = time.perf_counter()
+    cmds = parse_dsl(dsl)
+    valid, msg = validate_dsl(cmds)
+    if not valid:
+        return {"status": "invalid", "error": msg, "cad_s": time.perf_counter() - start}
+    try:
+        step_file, part = execute_dsl_cached(cmds, output_dir=output_dir, return_part=True)
+        if part is not None and step_file and step_file.lower().endswith((".step", ".stp")):
+            store_shape(step_file, part)
+    except Exception as e:
+        return {"status": "cad_error", "error": str(e), "cad_s": time.perf_counter() - start}
+    if not step_file or not os.path.exists(step_file):
+        return {"status": "no_export", "error": "the program exports no part", "cad_s": time.perf_counter() - start}
+    return {"status": "ok", "step_file": step_file, "cad_s": time.perf_counter() - start}
+
+
+def item_dirname(item_id):
+    """Directory name for an item id: path separators and dot-only names cannot escape output_dir."""
+    name = re.sub(r"[^\w.-]+", "_", str(item_id)).strip(".")
+    return name or "item"
+
+
+def run_cad_stage_job(dsl, output_dir):
+    """run_cad_stage for a worker process: the worker's metrics come back in
+    result["metrics"], for tracing.merge() in the process that serves /metrics.
+    """
+    result = run_cad_stage(dsl, output_dir)
+    result["metrics"] = tracing.collect()
+    return result
+
+
+def _finish(record, result, out):
+    tracing.merge(result.pop("metrics", None))
+    record.update(result)
+    if record["status"] == "ok" and os.path.exists(record["step_file"]):
+        add_example(record["prompt"], record["dsl"])
+    record["timings"] = {
+        "llm_s": round(record.pop("llm_s"), 4),
+        "cad_s": round(record.pop("cad_s", 0.0), 4),
+        "total_s": round(time.perf_counter() - record.pop("start"), 4),
+    }
+    out.write(json.dumps(record) + "\n")
+    out.flush()
+    print(f"[{record['id']}] {record['status']} {record['timings']}")
+
+
+def run_batch(items, output_path, output_dir="out/batch", cad_workers=None, max_attempts=2, use_cache=True):
+    """Run every (item_id, prompt) through the pipeline and write JSONL results.
+
+    Each item's files go to output_dir/<item_id>/ so equal EXPORT names do not collide.
+    An item whose LLM stage raises is written with status "llm_error" and the message.
+    Returns the number of items that produced a file.
+    """
+    ok = 0
+
+    def decode(item_id, prompt):
+        record = {"id": item_id, "prompt": prompt, "start": time.perf_counter()}
+        try:
+            record["dsl"] = prompt_to_dsl(prompt, max_attempts=max_attempts, use_cache=use_cache)
+        except Exception as e:
+            # one prompt the model cannot serve (context overflow, dead worker) must not end the batch
+            record["dsl"] = None
+            record["error"] = str(e)
+        record["llm_s"] = time.perf_counter() - record["start"]
+        return record
+
+    # spawn, not fork: the parent holds a loaded llama.cpp model and its threads
+    context = multiprocessing.get_context("spawn")
+    config = load_config()
+    n_decoders = max(config.get("n_parallel") or 1, config.get("n_workers") or 1)
+    with ProcessPoolExecutor(max_workers=cad_workers, mp_context=context) as pool, \
+            ThreadPoolExecutor(max_workers=n_decoders) as decoders, open(output_path, "w") as out:
+        pending = {}
+        decoding = [decoders.submit(decode, item_id, prompt) for item_id, prompt in items]
+        for decoded in as_completed(decoding):
+            record = decoded.result()
+            dsl = record["dsl"]
+            if "error" in record:
+                _finish(record, {"status": "llm_error"}, out)
+            elif dsl is None:
+                _finish(record, {"status": "llm_failed", "error": "no valid DSL after retries"}, out)
+            else:
+                item_dir = os.path.join(output_dir, item_dirname(record["id"]))
+                pending[pool.submit(run_cad_stage_job, dsl, item_dir)] = record
+
+            # Write whatever the CAD workers finished while we were decoding
+            for future in [f for f in pending if f.done()]:
+                ok += future.result()["status"] == "ok"
+                _finish(pending.pop(future), future.result(), out)
+
+        for future in as_completed(pending):
+            ok += future.result()["status"] == "ok"
+            _finish(pending[future], future.result(), out)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate CAD parts for a JSONL file of prompts.")
+    parser.add_argument("input", help="JSONL file, one object per line")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="JSONL results file")
+    parser.add_argument("--output-dir", default="out/batch", help="directory for exported parts")
+    parser.add_argument("--field", default="prompt", help="JSON field holding the prompt")
+    parser.add_argument("--id-field", default="id", help="JSON field holding the item id")
+    parser.add_argument("--cad-workers", type=int, default=None, help="CAD worker processes")
+    parser.add_argument("--max-attempts", type=int, default=2)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the result cache")
+    args = parser.parse_args()
+
+    items = read_prompts(args.input, field=args.field, id_field=args.id_field)
+    start = time.perf_counter()
+    ok = run_batch(
+        items,
+        args.output,
+        output_dir=args.output_dir,
+        cad_workers=args.cad_workers,
+        max_attempts=args.max_attempts,
+        use_cache=not args.no_cache,
+    )
+    print(f"✅ {ok} part(s) written in {time.perf_counter() - start:.1f}s, results in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
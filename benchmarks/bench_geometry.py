@@ -0,0 +1,75 @@
+"""Geometry half: parse, validate, build, export and import, no model needed."""
+import os
+import statistics
+import tempfile
+import time
+
+import cadquery as cq
+from cadquery import exporters
+
+from fixtures import corpus
+from natural_languange_to_CAD import build_dsl, clear_solid_cache, execute_dsl, parse_dsl, validate_dsl
+from part_export import export_part
+
+
+def median_time(fn, repeat):
+    """Median wall time of `repeat` calls, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_geometry(sizes=(1, 10, 100, 500), repeat=3, heavy_repeat=1, heavy_from=100, build_workers=0):
+    """Time every stage on every fixture. Solid memoization is cleared before each
+    build so builds are cold. Fixtures with at least `heavy_from` features run
+    `heavy_repeat` times. With `build_workers` > 1, cold builds are also timed with
+    parallel_build (its worker pool is started before timing).
+    Returns {"geometry.<stage>.<fixture>": seconds}.
+    """
+    results = {}
+    if build_workers > 1:
+        from parallel_build import build_dsl_parallel, get_build_pool
+
+        list(get_build_pool(build_workers).map(abs, range(build_workers)))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, dsl in corpus(sizes):
+            n = int(name.rsplit("_", 1)[1])
+            runs = heavy_repeat if n >= heavy_from else repeat
+            cmds = parse_dsl(dsl)
+            valid, msg = validate_dsl(cmds)
+            if not valid:
+                raise ValueError(f"fixture {name} is invalid: {msg}")
+
+            def cold_build():
+                clear_solid_cache()
+                return build_dsl(cmds)
+
+            def cold_execute():
+                # a fresh directory: an existing export of the part would be skipped
+                clear_solid_cache()
+                return execute_dsl(cmds, output_dir=tempfile.mkdtemp(dir=tmp))
+
+            results[f"geometry.parse.{name}"] = median_time(lambda: parse_dsl(dsl), max(repeat, 20))
+            results[f"geometry.validate.{name}"] = median_time(lambda: validate_dsl(cmds), max(repeat, 20))
+            results[f"geometry.build.{name}"] = median_time(cold_build, runs)
+            results[f"geometry.execute.{name}"] = median_time(cold_execute, runs)
+            if build_workers > 1:
+                def cold_parallel_build():
+                    clear_solid_cache()
+                    return build_dsl_parallel(cmds, build_workers)
+
+                results[f"geometry.build_parallel.{name}"] = median_time(cold_parallel_build, runs)
+
+            part, _ = build_dsl(cmds)
+            step = os.path.join(tmp, f"{name}.step")
+            stl = os.path.join(tmp, f"{name}.stl")
+            results[f"geometry.export_step.{name}"] = median_time(lambda: exporters.export(part, step), runs)
+            results[f"geometry.export_stl.{name}"] = median_time(lambda: exporters.export(part, stl), runs)
+            results[f"geometry.export_all.{name}"] = median_time(
+                lambda: export_part(part, cmds, "part.step", tempfile.mkdtemp(dir=tmp)), runs)
+            results[f"geometry.import_step.{name}"] = median_time(lambda: cq.importers.importStep(step), runs)
+            print(f"  {name}: build {results[f'geometry.build.{name}'] * 1000:.1f} ms")
+    return results
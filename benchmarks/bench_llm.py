@@ -0,0 +1,48 @@
+"""LLM half: prompt construction and the generate/validate/repair/retry loop on a
+scripted stand-in model, so only the pipeline's own overhead is measured.
+"""
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+
+import llm_provider
+from bench_geometry import median_time
+from mock_llama import GOOD, PROMPT, MockLlama
+from natural_languange_to_CAD import build_prompt, generate_dsl
+
+# A fillet that cannot fit: rejected by the geometry check, costs one LLM retry
+BAD_FILLET = "CREATE_BOX id=plate width=50 height=50 depth=10\nFILLET id=plate radius=8\n"
+# Duplicate id and no EXPORT: fixed by local repair, no retry
+NEEDS_REPAIR = (
+    "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+    "CREATE_CYLINDER id=holes radius=4 height=15\n"
+    "CREATE_CYLINDER id=holes radius=3 height=15\n"
+    "SUBTRACT target=plate tool=holes\n"
+)
+SCENARIOS = {
+    "clean": [GOOD],
+    "retry": [BAD_FILLET, GOOD[len("CREATE_BOX id=plate width=50 height=50 depth=10\n"):]],
+    "repair": [NEEDS_REPAIR],
+}
+
+
+def bench_llm(repeat=20):
+    """Returns {"llm.<stage>": seconds}."""
+    model_file = os.path.join(tempfile.mkdtemp(), "mock.gguf")
+    with open(model_file, "wb") as f:
+        f.write(b"mock model")
+    llm = MockLlama(model_file)
+    llm_provider.set_llm(llm)
+
+    results = {"llm.build_prompt": median_time(lambda: build_prompt(PROMPT), repeat)}
+    for name, responses in SCENARIOS.items():
+        def run():
+            llm.responses = list(responses)
+            with redirect_stdout(io.StringIO()):  # the pipeline's progress prints are not measured
+                dsl = generate_dsl(PROMPT, max_attempts=2)
+            if dsl is None:
+                raise RuntimeError(f"scenario {name} did not produce valid DSL")
+
+        results[f"llm.generate_dsl.{name}"] = median_time(run, repeat)
+    return results
@@ -0,0 +1,82 @@
+"""Compare plain and speculative decoding on the real model: same greedy output, decode speed.
+
+    python benchmarks/compare_decoding.py                       # off vs prompt_lookup
+    python benchmarks/compare_decoding.py --draft small.gguf    # also a draft model
+
+Exits 1 if a speculative mode changes the generated DSL.
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [BENCH_DIR, os.path.dirname(BENCH_DIR)]
+
+from dsl_spec import DSL_GBNF
+from llm_provider import get_grammar, load_config, load_llm, restore_prompt_prefix
+from natural_languange_to_CAD import SYSTEM_PROMPT, build_prompt
+
+PROMPTS = [
+    "Create a 50x50x10 square plate with four corner holes, radius 4mm, inset 8mm from edges.",
+    "Make a 120x40x8 bar with six holes of radius 3 spaced 18 mm apart along its length.",
+    "Make a round flange: cylinder radius 40 height 8 with eight bolt holes radius 3 on a 30 mm circle.",
+    "A 60x60x20 block with a 20x20 pocket 10 mm deep in the middle and all edges rounded by 1 mm.",
+]
+
+
+def run_mode(config, prompts):
+    """[(text, decode tokens, decode seconds)] per prompt, greedy, with the cached prefix."""
+    llm = load_llm(config)
+    grammar = get_grammar(DSL_GBNF)
+    runs = []
+    for prompt in prompts:
+        restore_prompt_prefix(llm, SYSTEM_PROMPT)
+        stream = llm(build_prompt(prompt), grammar=grammar, stream=True, temperature=0.0,
+                     max_tokens=300, stop=["User:", "\n\n"])
+        pieces = []
+        first = None
+        for chunk in stream:
+            first = first or time.perf_counter()
+            pieces.append(chunk["choices"][0]["text"])
+        elapsed = time.perf_counter() - first if first else 0.0
+        runs.append(("".join(pieces), len(pieces), elapsed))
+    del llm
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plain vs speculative decoding")
+    parser.add_argument("--draft", help="Draft GGUF (same vocabulary as the model) to compare as well")
+    parser.add_argument("--draft-tokens", type=int, default=None, help="Tokens drafted per step")
+    args = parser.parse_args()
+
+    base = dict(load_config(), verbose=False)
+    if args.draft_tokens:
+        base["draft_tokens"] = args.draft_tokens
+    modes = ["off", "prompt_lookup"] + (["draft"] if args.draft else [])
+
+    results = {}
+    for mode in modes:
+        config = dict(base, speculative=mode, draft_model_path=args.draft or base.get("draft_model_path"))
+        print(f"⏳ {mode} ...")
+        results[mode] = run_mode(config, PROMPTS)
+
+    plain = results["off"]
+    plain_rate = sum(n for _, n, _ in plain) / max(sum(t for _, _, t in plain), 1e-9)
+    mismatches = 0
+    for mode in modes:
+        runs = results[mode]
+        rate = sum(n for _, n, _ in runs) / max(sum(t for _, _, t in runs), 1e-9)
+        same = [text == ref for (text, _, _), (ref, _, _) in zip(runs, plain)]
+        mismatches += same.count(False)
+        print(f"{mode:>14}: {rate:7.1f} decode tok/s ({rate / plain_rate:.2f}x)  "
+              f"identical output {same.count(True)}/{len(same)}")
+    if mismatches:
+        print("❌ Speculative decoding changed the output")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""DSL fixtures for the geometry benchmarks, scaled by feature count."""
+import math
+
+
+def _grid(n, pitch):
+    """Centered positions of n features on a near-square grid."""
+    cols = math.ceil(math.sqrt(n))
+    rows = math.ceil(n / cols)
+    return [
+        ((i % cols - (cols - 1) / 2) * pitch, (i // cols - (rows - 1) / 2) * pitch)
+        for i in range(n)
+    ], cols, rows
+
+
+def plate_with_holes(n, pitch=10.0):
+    """One CREATE/TRANSLATE/SUBTRACT block per hole (exercises fused multi-tool cuts)."""
+    points, cols, rows = _grid(n, pitch)
+    lines = [f"CREATE_BOX id=plate width={cols * pitch + pitch:g} height={rows * pitch + pitch:g} depth=5"]
+    for i, (x, y) in enumerate(points):
+        lines += [
+            f"CREATE_CYLINDER id=h{i} radius=2 height=10",
+            f"TRANSLATE id=h{i} x={x:g} y={y:g} z=0",
+            f"SUBTRACT target=plate tool=h{i}",
+        ]
+    lines.append('EXPORT filename="plate.step"')
+    return "\n".join(lines)
+
+
+def plate_with_hole_grid(n, pitch=10.0):
+    """The same plate with a GRID_PATTERN instead of explicit holes (n rounded to a full grid)."""
+    _, cols, rows = _grid(n, pitch)
+    return "\n".join([
+        f"CREATE_BOX id=plate width={cols * pitch + pitch:g} height={rows * pitch + pitch:g} depth=5",
+        "CREATE_CYLINDER id=holes radius=2 height=10",
+        f"GRID_PATTERN id=holes nx={cols} ny={rows} dx={pitch:g} dy={pitch:g}",
+        "SUBTRACT target=plate tool=holes",
+        'EXPORT filename="plate_grid.step"',
+    ])
+
+
+def nested_subtractions(depth):
+    """Concentric rings: every box is cut by the next smaller one, which was cut before."""
+    lines = [
+        f"CREATE_BOX id=b{i} width={10 * (depth + 1 - i)} height={10 * (depth + 1 - i)} depth={10 + 2 * i}"
+        for i in range(depth + 1)
+    ]
+    for i in range(depth, 0, -1):
+        lines.append(f"SUBTRACT target=b{i - 1} tool=b{i}")
+    lines.append('EXPORT filename="nested.step"')
+    return "\n".join(lines)
+
+
+def filleted_plate(n, pitch=10.0):
+    """Plate with n holes, every edge (hole rims included) filleted."""
+    dsl = plate_with_hole_grid(n, pitch).splitlines()
+    return "\n".join(dsl[:-1] + ["FILLET id=plate radius=0.5", dsl[-1]])
+
+
+def corpus(sizes=(1, 10, 100, 500)):
+    """(name, dsl text) pairs of the benchmark corpus."""
+    items = []
+    for n in sizes:
+        items.append((f"holes_{n}", plate_with_holes(n)))
+        items.append((f"hole_grid_{n}", plate_with_hole_grid(n)))
+    for depth in (2, 8):
+        items.append((f"nested_{depth}", nested_subtractions(depth)))
+    for n in (1, 16):
+        items.append((f"fillet_{n}", filleted_plate(n)))
+    return items
@@ -0,0 +1,118 @@
+"""Run the benchmark suite, write JSON results and compare them to a stored baseline.
+
+    python benchmarks/run_benchmarks.py --quick --no-compare    # fast check, no baseline needed
+    python benchmarks/run_benchmarks.py --record                # record this machine's baseline
+    python benchmarks/run_benchmarks.py                         # compare; the first run records the baseline
+    python benchmarks/run_benchmarks.py --baseline old.json     # exits 1 on a regression, 2 if old.json is missing
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [BENCH_DIR, REPO_DIR, os.path.join(REPO_DIR, "tests")]  # tests/mock_llama.py for the LLM half
+
+# Keep benchmark runs away from the user's caches and learned examples; must be set before import
+_scratch = tempfile.mkdtemp(prefix="cad_agent_bench_")
+os.environ.setdefault("CAD_AGENT_CACHE_DIR", os.path.join(_scratch, "cache"))
+os.environ.setdefault("CAD_AGENT_SHAPE_CACHE_DIR", os.path.join(_scratch, "shapes"))
+os.environ.setdefault("CAD_AGENT_EXAMPLES", os.path.join(_scratch, "examples.jsonl"))
+os.environ["CAD_AGENT_FEW_SHOT_LEARN"] = "0"
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results.json")
+NOISE_FLOOR_S = 0.001  # differences below this are timer noise, never a regression
+
+
+def compare(results, baseline, tolerance):
+    """Names whose time grew by more than `tolerance` (fraction) and the noise floor."""
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if seconds > old * (1 + tolerance) and seconds - old > NOISE_FLOOR_S:
+            regressions.append((name, old, seconds))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CAD agent benchmarks")
+    parser.add_argument("--only", choices=["geometry", "llm"], help="Run one half of the suite")
+    parser.add_argument("--quick", action="store_true", help="Small fixtures only (1, 10, 50 holes)")
+    parser.add_argument("--build-workers", type=int, default=0, help="Also time parallel builds on N processes")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (median is kept)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--record", "--save-baseline", dest="save_baseline", action="store_true",
+                        help="Write the results as the new baseline")
+    parser.add_argument("--no-compare", action="store_true", help="Only measure; do not require a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown, as a fraction")
+    args = parser.parse_args()
+
+    import cadquery as cq
+
+    results = {}
+    if args.only in (None, "geometry"):
+        from bench_geometry import bench_geometry
+
+        print("📐 Geometry benchmarks")
+        sizes = (1, 10, 50) if args.quick else (1, 10, 100, 500)
+        results.update(bench_geometry(sizes, repeat=args.repeat, build_workers=args.build_workers))
+    if args.only in (None, "llm"):
+        from bench_llm import bench_llm
+
+        print("🧠 LLM pipeline benchmarks (mock model)")
+        results.update(bench_llm(repeat=max(args.repeat, 20)))
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "cadquery": getattr(cq, "__version__", "unknown"),
+            "quick": args.quick,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"✅ {len(results)} measurements written to {args.output}")
+
+    if args.no_compare and not args.save_baseline:
+        return 0
+    first_run = not os.path.exists(args.baseline) and args.baseline == DEFAULT_BASELINE
+    if args.save_baseline or first_run:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        if first_run and not args.save_baseline:
+            print(f"⚠️ No baseline yet: this run is recorded as {args.baseline}; later runs compare against it")
+        else:
+            print(f"💾 Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        # a baseline that was asked for but is missing must not pass as "no regressions"
+        print(f"❌ No baseline at {args.baseline}; run with --record to record one (or --no-compare)")
+        return 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("meta", {}).get("platform") != report["meta"]["platform"]:
+        print("⚠️ Baseline was recorded on a different platform; timings may not be comparable")
+
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    for name, old, new in regressions:
+        print(f"❌ REGRESSION {name}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms ({new / old - 1:+.0%})")
+    if regressions:
+        return 1
+    print(f"✅ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,130 +1,194 @@
-from natural_languange_to_CAD import generate_part_from_text
-import cadquery as cq
-import gradio as gr
-import tempfile
+import multiprocessing
 import os
-import base64
-
-OUTPUT_DIR = "out"
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 
+import gradio as gr
 
-def generate_step_file(nl_prompt):
-    """Generate a STEP file from the NL prompt and return the path.
+import tracing
+from batch_generate import run_cad_stage_job
+from edit_session import get_session
+from few_shot import add_example
+from llm_provider import LLM_STATS
+from natural_languange_to_CAD import prompt_to_dsl
+from part_export import EXPORT_LOD, export_files, step_export
+from preview_mesh import DEFAULT_LOD, LOD_TOLERANCES, write_preview
+from shape_cache import preview_cached
 
-    Returns (step_file_path or None)
+OUTPUT_DIR = "out"
+PREVIEW_DIR = os.path.join(OUTPUT_DIR, "preview")
+
+# --------------------------
+# Serving settings
+# --------------------------
+# Requests handled at once (they share the model unless n_workers or n_parallel > 1),
+# requests allowed to wait in the Gradio queue, and CAD worker processes
+UI_CONCURRENCY = int(os.environ.get("CAD_AGENT_UI_CONCURRENCY", "4"))
+UI_QUEUE_SIZE = int(os.environ.get("CAD_AGENT_UI_QUEUE_SIZE", "32"))
+CAD_WORKERS = int(os.environ.get("CAD_AGENT_CAD_WORKERS", "2"))
+
+_cad_pool = None
+_pool_lock = threading.Lock()
+_in_flight = [0]
+
+
+def get_cad_pool():
+    """Process pool for OpenCascade work, started on first use."""
+    global _cad_pool
+    with _pool_lock:
+        if _cad_pool is None:
+            # spawn, not fork: this process holds a loaded llama.cpp model and its threads
+            context = multiprocessing.get_context("spawn")
+            _cad_pool = ProcessPoolExecutor(max_workers=CAD_WORKERS, mp_context=context)
+    return _cad_pool
+
+
+def server_status(stage):
+    return (
+        f"{stage} · 🧵 {_in_flight[0]} request(s) in progress · "
+        f"⏳ {LLM_STATS['waiting']} waiting for the model "
+        f"(last wait {LLM_STATS['last_wait_s']:.1f}s)"
+    )
+
+
+def stream_step_file(nl_prompt):
+    """Generate a STEP file, yielding (dsl_so_far, step_file_path or None, status).
+
+    The DSL is decoded in a thread and streamed token by token; the CAD stage
+    runs in the worker pool, so neither blocks other requests' event handling.
+    Exports are content-addressed (part_export), so equal filenames do not collide.
     """
-    step_file = generate_part_from_text(nl_prompt, output_dir=OUTPUT_DIR)
-    return step_file
+    tokens = queue.Queue()
+    result = {}
+
+    def decode():
+        try:
+            result["dsl"] = prompt_to_dsl(nl_prompt, on_token=tokens.put)
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            tokens.put(None)
+
+    with _pool_lock:
+        _in_flight[0] += 1
+    try:
+        threading.Thread(target=decode, daemon=True).start()
+        text = ""
+        while True:
+            try:
+                token = tokens.get(timeout=0.5)
+            except queue.Empty:
+                yield text, None, server_status("🧠 Waiting for the model" if not text else "🧠 Generating DSL")
+                continue
+            if token is None:
+                break
+            text += token
+            yield text, None, server_status("🧠 Generating DSL")
+
+        dsl = result.get("dsl")
+        if dsl is None:
+            tracing.count("cad_agent_requests_total", status="llm_failed")
+            yield text, None, f"❌ No valid DSL: {result.get('error', 'all attempts failed')}"
+            return
+        text = dsl  # the validated program; also covers result-cache hits that streamed nothing
+
+        start = time.perf_counter()
+        future = get_cad_pool().submit(run_cad_stage_job, dsl, OUTPUT_DIR)
+        while not future.done():
+            yield text, None, server_status(f"🛠️ Building part ({time.perf_counter() - start:.1f}s)")
+            time.sleep(0.25)
+        cad = future.result()
+        tracing.merge(cad.pop("metrics"))
+        tracing.observe("cad_agent_cad_stage_seconds", cad["cad_s"], status=cad["status"])
+        tracing.count("cad_agent_requests_total", status=cad["status"])
+        if cad["status"] != "ok":
+            yield text, None, f"❌ {cad['status']}: {cad['error']}"
+            return
+        add_example(nl_prompt, dsl)
+        yield text, cad["step_file"], f"✅ Part built in {cad['cad_s']:.2f}s."
+    finally:
+        with _pool_lock:
+            _in_flight[0] -= 1
 
 
-def load_preview_from_step(step_file_path):
-    """Load a STEP file, export to STL, and return an iframe HTML (srcdoc) with Three.js viewer.
+def stream_edit(nl_prompt, session_id):
+    """Conversation mode: the first prompt generates a part, follow-ups edit it.
 
-    Returns an HTML string safe for Gradio's HTML component.
+    Yields (DSL or edit script so far, step_file_path or None, status, session id).
+    The session's program is rebuilt in this process so its solids are reused;
+    unlike stream_step_file it does not use the CAD worker pool.
     """
-    if not step_file_path or not os.path.exists(step_file_path):
-        return "<div style='padding:16px;color:#ddd;background:#111'>No STEP file available. Generate a part first.</div>"
+    session = get_session(session_id)
+    tokens = queue.Queue()
+    result = {}
+    editing = bool(session.lines)
 
+    def run():
+        try:
+            result.update(session.submit(nl_prompt, on_token=tokens.put))
+        except Exception as e:
+            result.update(status="failed", error=str(e))
+        finally:
+            tokens.put(None)
+
+    with _pool_lock:
+        _in_flight[0] += 1
     try:
-        part = cq.importers.importStep(step_file_path)
-    except Exception as e:
-        return f"<div style='padding:16px;color:#ddd;background:#111'>Failed to import STEP: {str(e)}</div>"
+        threading.Thread(target=run, daemon=True).start()
+        stage = "✏️ Editing the part" if editing else "🧠 Generating DSL"
+        text = ""
+        while True:
+            try:
+                token = tokens.get(timeout=0.5)
+            except queue.Empty:
+                yield text, None, server_status(stage), session.id
+                continue
+            if token is None:
+                break
+            text += token
+            yield text, None, server_status(stage), session.id
+
+        if result.get("status") != "ok":
+            yield session.dsl or text, session.step_file, f"❌ {result.get('error')}", session.id
+            return
+        done = f"{len(result['edits'])} edit(s) applied" if result["mode"] == "edit" else "Part built"
+        yield (result["dsl"], result["step_file"],
+               f"✅ {done}: LLM {result['llm_s']:.1f}s, CAD {result['cad_s']:.2f}s.", session.id)
+    finally:
+        with _pool_lock:
+            _in_flight[0] -= 1
 
-    # Export to temporary STL file
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".stl") as tmp_stl:
-            stl_file = tmp_stl.name
-        cq.exporters.export(part, stl_file)
 
-        with open(stl_file, "rb") as f:
-            stl_b64 = base64.b64encode(f.read()).decode("utf-8")
-    except Exception as e:
-        return f"<div style='padding:16px;color:#ddd;background:#111'>Failed to export STL: {str(e)}</div>"
-    finally:
-        try:
-            if os.path.exists(stl_file):
-                os.remove(stl_file)
-        except Exception:
-            pass
-
-    # Build improved viewer HTML
-    inner_html = f"""
-    <!doctype html>
-    <html lang="en">
-    <head>
-      <meta charset="utf-8">
-      <meta name="viewport" content="width=device-width,initial-scale=1">
-      <style>html,body{{height:100%;margin:0;background:#111;color:#fff}}#viewer{{width:100%;height:100%;}}</style>
-    </head>
-    <body>
-      <div id="viewer">Loading preview...</div>
-      <script src="https://cdnjs.cloudflare.com/ajax/libs/three.js/r148/three.min.js"></script>
-      <script src="https://cdn.jsdelivr.net/npm/three@0.148.0/examples/js/loaders/STLLoader.js"></script>
-      <script src="https://cdn.jsdelivr.net/npm/three@0.148.0/examples/js/controls/OrbitControls.js"></script>
-      <script>
-      (function(){{
-        const container = document.getElementById('viewer');
-        const scene = new THREE.Scene();
-        scene.background = new THREE.Color(0x202124);
-
-        const camera = new THREE.PerspectiveCamera(50, container.clientWidth/container.clientHeight, 0.1, 10000);
-        const renderer = new THREE.WebGLRenderer({antialias:true});
-        renderer.setSize(container.clientWidth, container.clientHeight);
-        renderer.setPixelRatio(window.devicePixelRatio || 1);
-        container.innerHTML = '';
-        container.appendChild(renderer.domElement);
-
-        const hemi = new THREE.HemisphereLight(0xffffff, 0x444444, 0.6);
-        scene.add(hemi);
-        const dir = new THREE.DirectionalLight(0xffffff, 0.8);
-        dir.position.set(5,10,7.5);
-        scene.add(dir);
-
-        const loader = new THREE.STLLoader();
-        const bytes = Uint8Array.from(atob("{stl_b64}"), c => c.charCodeAt(0));
-        const geometry = loader.parse(bytes.buffer);
-
-        // compute center and fit camera
-        geometry.computeBoundingBox();
-        const center = new THREE.Vector3();
-        geometry.boundingBox.getCenter(center);
-        const size = geometry.boundingBox.getSize(new THREE.Vector3()).length();
-
-        const material = new THREE.MeshStandardMaterial({color:0x9db3c9, metalness:0.2, roughness:0.4});
-        const mesh = new THREE.Mesh(geometry, material);
-        mesh.position.sub(center);
-        scene.add(mesh);
-
-        camera.position.copy(new THREE.Vector3(0, 0, size * 2.0));
-        camera.lookAt(new THREE.Vector3(0,0,0));
-
-        const controls = new THREE.OrbitControls(camera, renderer.domElement);
-        controls.target.set(0,0,0);
-        controls.update();
-
-        function onWindowResize(){{
-          camera.aspect = container.clientWidth / container.clientHeight;
-          camera.updateProjectionMatrix();
-          renderer.setSize(container.clientWidth, container.clientHeight);
-        }}
-        window.addEventListener('resize', onWindowResize);
-
-        function animate(){{
-          requestAnimationFrame(animate);
-          controls.update();
-          renderer.render(scene, camera);
-        }}
-        animate();
-      }})();
-      </script>
-    </body>
-    </html>
-    """
+def load_preview(step_file_path, part=None, lod=DEFAULT_LOD):
+    """Tessellate the part built by execute_dsl into a GLB file for gr.Model3D.
 
-    iframe_srcdoc = inner_html.replace('"', '&quot;')
-    iframe_html = f"<iframe srcdoc=\"{iframe_srcdoc}\" style=\"width:100%;height:60vh;border:0;border-radius:6px;overflow:hidden;\"></iframe>"
+    At EXPORT_LOD the GLB written next to the STEP file is used as is. Without
+    an in-memory part (e.g. the export came from the result cache or a CAD
+    worker) the STEP file, or the .step alias of an STL export, is previewed
+    through the content-addressed BREP/mesh cache, so repeat previews skip
+    STEP parsing and meshing.
+    Returns (glb_path or None, status message).
+    """
+    if part is None and (not step_file_path or not os.path.exists(step_file_path)):
+        return None, "No STEP file available. Generate a part first."
 
-    return iframe_html
+    exported = os.path.splitext(step_file_path or "")[0] + ".glb"
+    try:
+        if lod == EXPORT_LOD and os.path.exists(exported):
+            glb_file = exported
+        elif part is None:
+            if not step_export(step_file_path):
+                return None, "No STEP export of this part to preview."
+            glb_file = preview_cached(step_export(step_file_path), lod=lod)
+        else:
+            glb_file = write_preview(part, PREVIEW_DIR, lod=lod)
+    except Exception as e:
+        return None, f"Failed to build preview: {str(e)}"
+    if not glb_file:
+        return None, "The part has no faces to preview."
+    return glb_file, f"Preview at {lod} detail."
 
 
 def make_ui():
@@ -134,37 +198,68 @@ Type a natural language description of a part, get a STEP file and load the 3D p
 """)
 
         with gr.Row():
-            nl = gr.Textbox(lines=3, placeholder="Describe your CAD part here...", label="nl_prompt")
             with gr.Column():
-                step_file_out = gr.File(label="Download STEP")
+                nl = gr.Textbox(lines=3, placeholder="Describe your CAD part here...", label="nl_prompt")
+                # off by default: edit sessions build in this process (their solids live here),
+                # not in the CAD worker pool, and skip the result cache and the example store
+                edit_mode = gr.Checkbox(value=False, label="Follow-up prompts edit the current part")
+                dsl_out = gr.Textbox(lines=8, label="Generated DSL", interactive=False)
+                status = gr.Markdown()
+            with gr.Column():
+                step_file_out = gr.File(label="Download STEP / STL / GLB", file_count="multiple")
+                lod = gr.Radio(list(LOD_TOLERANCES), value=DEFAULT_LOD, label="Preview detail")
                 load_btn = gr.Button("Load Preview")
-                html_out = gr.HTML(label="3D Preview")
+                preview_out = gr.Model3D(label="3D Preview")
+                preview_status = gr.Markdown()
 
         state = gr.State(value=None)
+        session_state = gr.State(value=None)
 
-        def on_submit(prompt):
-            step = generate_step_file(prompt)
-            if not step:
-                return None, None
-            # return file path for download and keep step path in state
-            return step, step
+        def on_submit(prompt, editing, session_id):
+            # stream the DSL while it is generated; keep the step path in state
+            if editing:
+                for dsl, step, message, current_session in stream_edit(prompt, session_id):
+                    yield dsl, export_files(step), step, message, current_session
+                return
+            for dsl, step, message in stream_step_file(prompt):
+                yield dsl, export_files(step), step, message, session_id
 
         submit_btn = gr.Button("Submit", variant="primary")
         clear_btn = gr.Button("Clear")
 
-        submit_btn.click(on_submit, inputs=[nl], outputs=[step_file_out, state])
+        submit_btn.click(
+            on_submit,
+            inputs=[nl, edit_mode, session_state],
+            outputs=[dsl_out, step_file_out, state, status, session_state],
+            show_progress="minimal",
+        )
 
         def on_clear():
-            return "", None, "<div style='padding:12px;color:#ddd;background:#111'>Preview cleared.</div>"
+            # the next prompt starts a new conversation
+            return "", "", None, None, "", "Preview cleared.", None
+
+        clear_btn.click(
+            on_clear, inputs=None, outputs=[nl, dsl_out, state, preview_out, status, preview_status, session_state]
+        )
 
-        clear_btn.click(on_clear, inputs=None, outputs=[nl, state, html_out])
+        def on_preview(step, detail, session_id):
+            # an edit session still holds its part; otherwise use the BREP cache warmed by the CAD worker
+            session = get_session(session_id, create=False) if session_id else None
+            part = session.part if session is not None and session.step_file == step else None
+            return load_preview(step, part=part, lod=detail)
 
-        # Load preview from stored step path
-        load_btn.click(lambda s: load_preview_from_step(s), inputs=[state], outputs=[html_out])
+        load_btn.click(on_preview, inputs=[state, lod, session_state], outputs=[preview_out, preview_status])
 
     return demo
 
 
 if __name__ == "__main__":
     demo = make_ui()
+    # Gradio shows each waiting user their queue position; requests beyond max_size are rejected
+    demo.queue(default_concurrency_limit=UI_CONCURRENCY, max_size=UI_QUEUE_SIZE)
+    if tracing.ENABLED:
+        tracing.register_gauge("cad_agent_requests_in_progress", lambda: _in_flight[0], "UI requests being handled")
+        tracing.register_gauge("cad_agent_llm_waiting", lambda: LLM_STATS["waiting"], "callers waiting for the model")
+        tracing.register_gauge("cad_agent_llm_last_wait_seconds", lambda: LLM_STATS["last_wait_s"])
+        tracing.start_metrics_server()
     demo.launch(share=True)
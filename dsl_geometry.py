@@ -0,0 +1,172 @@
+from dsl_spec import DSL_COMMANDS, pattern_offsets
+
+# --------------------------
+# Analytic geometry pre-checks
+# --------------------------
+# Each solid is tracked as the primitives it is made of, placed the way
+# execute_dsl builds them: boxes and cylinders centered on the origin (cylinder
+# axis along Z), moved by TRANSLATE and copied by patterns. That is enough to
+# catch fillets that cannot fit, cuts that miss their target and holes that
+# end inside the part, without running an OpenCascade boolean.
+MIRROR_AXIS = {"XY": 2, "YZ": 0, "XZ": 1}
+AXES = "xyz"
+
+
+def _fmt(value):
+    return f"{value:g}"
+
+
+def _span(lo, hi):
+    return f"{_fmt(lo)}..{_fmt(hi)}"
+
+
+def primitive_bounds(prim):
+    """(min corner, max corner) of one placed primitive."""
+    cx, cy, cz = prim["center"]
+    if prim["kind"] == "box":
+        half = (prim["width"] / 2, prim["height"] / 2, prim["depth"] / 2)
+    else:
+        half = (prim["radius"], prim["radius"], prim["height"] / 2)
+    return (cx - half[0], cy - half[1], cz - half[2]), (cx + half[0], cy + half[1], cz + half[2])
+
+
+def solid_bounds(solid):
+    """Bounding box of all primitives of a tracked solid."""
+    boxes = [primitive_bounds(prim) for prim in solid["prims"]]
+    lo = tuple(min(box[0][axis] for box in boxes) for axis in range(3))
+    hi = tuple(max(box[1][axis] for box in boxes) for axis in range(3))
+    return lo, hi
+
+
+def _describe(bounds):
+    lo, hi = bounds
+    return ", ".join(f"{AXES[axis]} {_span(lo[axis], hi[axis])}" for axis in range(3))
+
+
+def _overlaps(a, b):
+    """True if two boxes share volume (touching faces do not count)."""
+    return all(a[0][axis] < b[1][axis] and b[0][axis] < a[1][axis] for axis in range(3))
+
+
+def _inside(a, b):
+    """True if box a lies strictly inside box b on every axis."""
+    return all(b[0][axis] < a[0][axis] and a[1][axis] < b[1][axis] for axis in range(3))
+
+
+def _numbers(cmd, args):
+    """The numeric arguments of a command, or an error message for a missing one."""
+    values = {}
+    for key, arg_type in DSL_COMMANDS.get(cmd, []):
+        if arg_type not in ("positive", "count", "float"):
+            continue
+        value = args.get(key, 0.0 if arg_type == "float" else None)
+        if not isinstance(value, float):
+            return None, f"Missing or non-numeric '{key}' in {cmd}"
+        values[key] = value
+    return values, None
+
+
+def _max_fillet(prim):
+    """Largest fillet radius the edges of one primitive can take, and why."""
+    if prim["kind"] == "box":
+        edge = min(prim["width"], prim["height"], prim["depth"])
+        return edge / 2, f"its smallest edge is {_fmt(edge)}"
+    limit = min(prim["radius"], prim["height"] / 2)
+    return limit, f"its radius is {_fmt(prim['radius'])} and height {_fmt(prim['height'])}"
+
+
+def check_command(entry, solids):
+    """Check one (already validated) command against the tracked solids.
+
+    Updates `solids` (id -> {"prims": [...], "cuts": [tool boxes]}) like validate_command
+    updates its id set, so a stream can be checked line by line.
+    Returns (ok, message); messages state the numbers needed to fix the line.
+    """
+    cmd = entry["cmd"].upper()
+    args = entry["args"]
+    values, error = _numbers(cmd, args)
+    if error:
+        return False, error
+
+    if cmd == "CREATE_BOX":
+        prim = dict(kind="box", center=(0.0, 0.0, 0.0), **values)
+        solids[args["id"]] = {"prims": [prim], "cuts": []}
+
+    elif cmd == "CREATE_CYLINDER":
+        prim = dict(kind="cylinder", center=(0.0, 0.0, 0.0), **values)
+        solids[args["id"]] = {"prims": [prim], "cuts": []}
+
+    elif cmd == "TRANSLATE":
+        offset = (values["x"], values["y"], values["z"])
+        for prim in solids[args["id"]]["prims"]:
+            prim["center"] = tuple(c + d for c, d in zip(prim["center"], offset))
+
+    elif cmd == "FILLET":
+        sid = args["id"]
+        radius = values["radius"]
+        for prim in solids[sid]["prims"]:
+            limit, reason = _max_fillet(prim)
+            if radius >= limit:
+                return False, (
+                    f"FILLET radius {_fmt(radius)} on '{sid}' is too large: {reason}, "
+                    f"so the radius must be below {_fmt(limit)}"
+                )
+
+    elif cmd == "MIRROR":
+        axis = MIRROR_AXIS[args["plane"].upper()]
+        solid = solids[args["id"]]
+        mirrored = []
+        for prim in solid["prims"]:
+            center = list(prim["center"])
+            center[axis] = -center[axis]
+            mirrored.append(dict(prim, center=tuple(center)))
+        solid["prims"] += mirrored
+
+    elif cmd in ("LINEAR_PATTERN", "GRID_PATTERN", "POLAR_PATTERN"):
+        solid = solids[args["id"]]
+        solid["prims"] = [
+            dict(prim, center=tuple(c + d for c, d in zip(prim["center"], offset)))
+            for offset in pattern_offsets(cmd, values)
+            for prim in solid["prims"]
+        ]
+
+    elif cmd == "SUBTRACT":
+        target, tool = args["target"], args["tool"]
+        if target == tool:
+            return False, f"SUBTRACT target and tool are both '{target}'"
+        target_boxes = [primitive_bounds(prim) for prim in solids[target]["prims"]]
+        target_bounds = solid_bounds(solids[target])
+        tool_prims = solids[tool]["prims"]
+        for n, prim in enumerate(tool_prims):
+            box = primitive_bounds(prim)
+            if len(tool_prims) == 1:
+                which, fix = f"tool '{tool}'", "TRANSLATE it into the target"
+            else:
+                which, fix = f"copy {n + 1} of tool '{tool}'", "reduce the pattern spacing so every copy lies in the target"
+            if not any(_overlaps(box, other) for other in target_boxes):
+                return False, (
+                    f"SUBTRACT {which} does not overlap target '{target}': the tool spans "
+                    f"{_describe(box)} but the target spans {_describe(target_bounds)}; {fix}"
+                )
+            # enclosed tools are fine when they meet an earlier cut (e.g. a cross hole)
+            opened = any(_overlaps(box, cut) for cut in solids[target]["cuts"])
+            if not opened and any(_inside(box, other) for other in target_boxes):
+                z_lo, z_hi = target_bounds[0][2], target_bounds[1][2]
+                return False, (
+                    f"SUBTRACT {which} ends inside target '{target}' and would leave a hidden cavity: "
+                    f"the tool spans z {_span(box[0][2], box[1][2])} but the target spans z {_span(z_lo, z_hi)}; "
+                    f"make the tool taller than {_fmt(z_hi - z_lo)} so the hole goes through"
+                )
+        solids[target]["cuts"] += [primitive_bounds(prim) for prim in tool_prims]
+
+    return True, "Valid geometry"
+
+
+def check_geometry(commands):
+    """Run check_command over a whole (validated) program. Returns (ok, message)."""
+    solids = {}
+    for entry in commands:
+        valid, msg = check_command(entry, solids)
+        if not valid:
+            return False, msg
+    return True, "Valid geometry"
@@ -0,0 +1,103 @@
+from dsl_spec import DSL_COMMANDS
+
+# --------------------------
+# Deterministic DSL repair
+# --------------------------
+# Mechanical faults are fixed locally instead of paying for an LLM retry.
+# Every fix is reported, so the caller can log what changed.
+DEFAULT_EXPORT = {"cmd": "EXPORT", "args": {"filename": "part.step"}}
+SIZE_KEYS = ("width", "height", "depth", "radius")
+
+
+def new_repair_state():
+    """Ids seen so far and renames applied, for repairing a stream line by line."""
+    return {"ids": set(), "renames": {}, "changes": []}
+
+
+def _format_value(value, arg_type=""):
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    if arg_type == "filename":
+        return f'"{value}"'
+    return str(value)
+
+
+def format_command(entry):
+    """DSL text of one parsed command, arguments in spec order."""
+    cmd = entry["cmd"].upper()
+    args = entry["args"]
+    spec = dict(DSL_COMMANDS.get(cmd, []))
+    keys = [key for key in spec if key in args] + [key for key in args if key not in spec]
+    return " ".join([cmd] + [f"{key}={_format_value(args[key], spec.get(key, ''))}" for key in keys])
+
+
+def format_dsl(commands):
+    return "\n".join(format_command(entry) for entry in commands)
+
+
+def repair_command(entry, state):
+    """Fix one command in place of the program built so far.
+
+    Returns the repaired command, or None if it has to be dropped. Changes are
+    appended to state["changes"] as readable messages.
+    """
+    cmd = entry["cmd"].upper()
+    args = dict(entry["args"])
+    changes = state["changes"]
+    ids, renames = state["ids"], state["renames"]
+
+    if cmd not in DSL_COMMANDS:
+        changes.append(f"dropped unknown command {cmd}")
+        return None
+
+    arg_types = dict(DSL_COMMANDS[cmd])
+    for key, value in args.items():
+        if not isinstance(value, float):
+            continue
+        if value < 0 and (arg_types.get(key) in ("positive", "count") or key in SIZE_KEYS):
+            args[key] = value = -value
+            changes.append(f"{cmd} {key} {_format_value(-value)} -> {_format_value(value)}")
+        if arg_types.get(key) == "count" and not value.is_integer() and value >= 0.5:
+            args[key] = float(round(value))
+            changes.append(f"{cmd} {key} {_format_value(value)} rounded to {_format_value(args[key])}")
+
+    # Point references at the latest solid of that name, drop lines using unknown ones
+    for key, arg_type in DSL_COMMANDS[cmd]:
+        if arg_type != "id" or cmd.startswith("CREATE_") or key not in args:
+            continue
+        args[key] = renames.get(args[key], args[key])
+        if args[key] not in ids:
+            changes.append(f"dropped {cmd} with unknown {key} '{args[key]}'")
+            return None
+
+    if cmd.startswith("CREATE_") and "id" in args:
+        sid = args["id"]
+        if sid in ids:
+            n = 2
+            while f"{sid}_{n}" in ids:
+                n += 1
+            renames[sid] = f"{sid}_{n}"
+            args["id"] = renames[sid]
+            changes.append(f"renamed duplicate id '{sid}' to '{args['id']}'")
+        else:
+            renames.pop(sid, None)
+        ids.add(args["id"])
+
+    return {"cmd": cmd, "args": args}
+
+
+def repair_dsl(commands):
+    """Apply repair_command to a whole program and append a missing EXPORT.
+
+    Returns (repaired commands, list of change messages).
+    """
+    state = new_repair_state()
+    repaired = []
+    for entry in commands:
+        fixed = repair_command(entry, state)
+        if fixed is not None:
+            repaired.append(fixed)
+    if not any(entry["cmd"] == "EXPORT" for entry in repaired):
+        repaired.append({"cmd": "EXPORT", "args": dict(DEFAULT_EXPORT["args"])})
+        state["changes"].append(f'appended EXPORT filename="{DEFAULT_EXPORT["args"]["filename"]}"')
+    return repaired, state["changes"]
@@ -0,0 +1,141 @@
+import math
+import os
+
+# --------------------------
+# DSL command specification
+# --------------------------
+# command -> ordered (argument, type) pairs, in the order the LLM is taught to emit them.
+# Types: "id" (solid name), "positive" (> 0), "float" (signed), "count" (integer >= 1),
+# "plane" (XY/YZ/XZ), "filename".
+DSL_COMMANDS = {
+    "CREATE_BOX": [("id", "id"), ("width", "positive"), ("height", "positive"), ("depth", "positive")],
+    "CREATE_CYLINDER": [("id", "id"), ("radius", "positive"), ("height", "positive")],
+    "TRANSLATE": [("id", "id"), ("x", "float"), ("y", "float"), ("z", "float")],
+    "SUBTRACT": [("target", "id"), ("tool", "id")],
+    "FILLET": [("id", "id"), ("radius", "positive")],
+    "LINEAR_PATTERN": [("id", "id"), ("count", "count"), ("dx", "float"), ("dy", "float"), ("dz", "float")],
+    "GRID_PATTERN": [("id", "id"), ("nx", "count"), ("ny", "count"), ("dx", "positive"), ("dy", "positive")],
+    "POLAR_PATTERN": [("id", "id"), ("count", "count"), ("radius", "positive")],
+    "MIRROR": [("id", "id"), ("plane", "plane")],
+    "EXPORT": [("filename", "filename")],
+}
+
+# Commands that replace an existing solid with copies of itself
+PATTERN_COMMANDS = ("LINEAR_PATTERN", "GRID_PATTERN", "POLAR_PATTERN", "MIRROR")
+MIRROR_PLANES = ("XY", "YZ", "XZ")
+
+# GBNF rules for the argument types
+GBNF_TYPES = {
+    "id": '[a-zA-Z_] [a-zA-Z0-9_]*',
+    "positive": '[1-9] [0-9]* ("." [0-9]+)? | "0." [0-9]* [1-9] [0-9]*',
+    "float": '"-"? [0-9]+ ("." [0-9]+)?',
+    "count": '[1-9] [0-9]*',
+    "plane": " | ".join(f'"{plane}"' for plane in MIRROR_PLANES),
+    "filename": '"\\"" [a-zA-Z0-9_-]+ "." ("step" | "stp" | "stl") "\\""',
+}
+
+
+def _rule_name(cmd):
+    return cmd.lower().replace("_", "-")
+
+
+def build_gbnf(commands=DSL_COMMANDS):
+    """Compile the command spec into a llama.cpp GBNF grammar.
+
+    A program is any number of non-EXPORT command lines followed by exactly one EXPORT line.
+    """
+    body = [cmd for cmd in commands if cmd != "EXPORT"]
+    rules = [
+        'root ::= (command "\\n")* export "\\n"?',
+        "command ::= " + " | ".join(_rule_name(cmd) for cmd in body),
+    ]
+    for cmd, spec in commands.items():
+        parts = [f'"{cmd}"']
+        for arg, arg_type in spec:
+            parts.append(f'" {arg}=" {arg_type}')
+        name = "export" if cmd == "EXPORT" else _rule_name(cmd)
+        rules.append(f"{name} ::= " + " ".join(parts))
+    used_types = {arg_type for spec in commands.values() for _, arg_type in spec}
+    for arg_type in sorted(used_types):
+        rules.append(f"{arg_type} ::= {GBNF_TYPES[arg_type]}")
+    return "\n".join(rules) + "\n"
+
+
+DSL_GBNF = build_gbnf()
+
+
+def build_edit_gbnf(commands=DSL_COMMANDS):
+    """Grammar for an edit script against a numbered program: one or more lines of
+    `SET <n>: <command>`, `INSERT <n>: <command>` or `DELETE <n>`.
+    """
+    rules = build_gbnf(commands).splitlines()[1:]  # every rule but the program root
+    return "\n".join([
+        'root ::= edit ("\\n" edit)* "\\n"?',
+        'edit ::= "SET " line-no ": " (command | export) | "INSERT " line-no ": " command | "DELETE " line-no',
+        "line-no ::= [0-9]+",
+    ] + rules) + "\n"
+
+
+DSL_EDIT_GBNF = build_edit_gbnf()
+
+
+def pattern_offsets(cmd, args):
+    """Offsets of every instance of a LINEAR/GRID/POLAR pattern, relative to the
+    solid's current position. Linear and grid patterns are centered on it.
+    """
+    if cmd == "LINEAR_PATTERN":
+        n = int(args["count"])
+        step = [float(args.get(key, 0)) for key in ("dx", "dy", "dz")]
+        return [tuple((i - (n - 1) / 2) * d for d in step) for i in range(n)]
+    if cmd == "GRID_PATTERN":
+        nx, ny = int(args["nx"]), int(args["ny"])
+        dx, dy = float(args["dx"]), float(args["dy"])
+        return [
+            ((i - (nx - 1) / 2) * dx, (j - (ny - 1) / 2) * dy, 0.0)
+            for j in range(ny)
+            for i in range(nx)
+        ]
+    if cmd == "POLAR_PATTERN":
+        n, r = int(args["count"]), float(args["radius"])
+        return [
+            (r * math.cos(2 * math.pi * i / n), r * math.sin(2 * math.pi * i / n), 0.0)
+            for i in range(n)
+        ]
+    raise ValueError(f"{cmd} is not an offset pattern")
+
+
+# --------------------------
+# Canonical form
+# --------------------------
+def _canonical_number(value):
+    value = round(float(value), 6)
+    return repr(value + 0.0)  # + 0.0 folds -0.0 into 0.0
+
+
+def canonical_dsl(commands):
+    """Canonical text of a parsed command list, for content hashing.
+
+    Solid ids are renamed in order of first appearance, numbers are rounded and
+    printed uniformly, omitted offsets default to 0 and the EXPORT filename is
+    reduced to its format, so programs that build the same part compare equal.
+    """
+    renamed = {}
+    lines = []
+    for entry in commands:
+        cmd = entry["cmd"].upper()
+        args = entry["args"]
+        spec = DSL_COMMANDS.get(cmd, [(key, "") for key in sorted(args)])
+        parts = [cmd]
+        for arg, arg_type in spec:
+            value = args.get(arg)
+            if arg_type == "id":
+                value = renamed.setdefault(value, f"s{len(renamed)}")
+            elif arg_type == "filename":
+                arg, value = "format", os.path.splitext(str(value))[1].lower().lstrip(".")
+            elif arg_type == "float" and value is None:
+                value = 0.0
+            if isinstance(value, float):
+                value = _canonical_number(value)
+            parts.append(f"{arg}={value}")
+        lines.append(" ".join(parts))
+    return "\n".join(lines)
@@ -0,0 +1,214 @@
+"""Conversational editing of a generated part.
+
+A session keeps the current DSL program and the solids built from it. The first
+request generates a program as usual; every follow-up ("make the holes 6 mm")
+asks the LLM only for a short edit script against the numbered program, applies
+it, and rebuilds just the operations downstream of the changed lines.
+
+    session = EditSession()
+    session.submit("Make a 40x20x5 plate with a centered hole of radius 3.")
+    session.submit("make the hole radius 5")
+"""
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from dsl_repair import format_dsl, repair_dsl
+from dsl_spec import DSL_EDIT_GBNF
+from llm_provider import stream_completion
+from natural_languange_to_CAD import SYSTEM_PROMPT, execute_dsl, parse_dsl, prompt_to_dsl, validate_dsl
+from tracing import count, span
+
+# --------------------------
+# Edit prompt
+# --------------------------
+# SYSTEM_PROMPT plus the edit instructions form the fixed, KV-cached prefix
+EDIT_PROMPT = SYSTEM_PROMPT + """
+    You now edit an existing program instead of writing a new one. Its lines are numbered.
+    Answer with ONLY edit commands, one per line:
+    SET <n>: <command>       replaces line n
+    INSERT <n>: <command>    inserts a command after line n (0: before the first line)
+    DELETE <n>               removes line n
+    Line numbers always refer to the program as shown. Change as few lines as possible.
+
+    Example:
+    Program:
+    1: CREATE_BOX id=plate width=40 height=20 depth=5
+    2: CREATE_CYLINDER id=hole1 radius=3 height=10
+    3: SUBTRACT target=plate tool=hole1
+    4: EXPORT filename="plate_with_hole.step"
+    User: make the hole radius 5 and round the plate edges by 1 mm
+    Edits:
+    SET 2: CREATE_CYLINDER id=hole1 radius=5 height=10
+    INSERT 3: FILLET id=plate radius=1
+    """
+
+EDIT_RE = re.compile(r"^(SET|INSERT|DELETE)\s+(\d+)\s*(?::\s*(.*))?$", re.IGNORECASE)
+MAX_SESSIONS = int(os.environ.get("CAD_AGENT_MAX_SESSIONS", "64"))
+
+
+def build_edit_prompt(lines, instruction):
+    numbered = "".join(f"{i}: {line}\n" for i, line in enumerate(lines, 1))
+    return EDIT_PROMPT + "\nProgram:\n" + numbered + "User: " + instruction + "\nEdits:\n"
+
+
+def parse_edits(text):
+    """[(op, line number, command text or None)] from an edit script; other lines are ignored."""
+    edits = []
+    for line in text.splitlines():
+        match = EDIT_RE.match(line.strip())
+        if match:
+            op, n, command = match.groups()
+            edits.append((op.upper(), int(n), (command or "").strip() or None))
+    return edits
+
+
+def apply_edits(lines, edits):
+    """Apply an edit script to the program `lines`. Line numbers refer to `lines`.
+
+    An EXPORT that no longer comes last is moved to the end. Returns (new lines, error).
+    """
+    replaced = {}
+    deleted = set()
+    inserted = {}
+    for op, n, command in edits:
+        if op == "INSERT" and 0 <= n <= len(lines) and command:
+            inserted.setdefault(n, []).append(command)
+        elif op == "SET" and 1 <= n <= len(lines) and command:
+            replaced[n] = command
+        elif op == "DELETE" and 1 <= n <= len(lines):
+            deleted.add(n)
+        else:
+            return lines, f"{op} {n} does not match the {len(lines)}-line program"
+    result = list(inserted.get(0, []))
+    for i, line in enumerate(lines, 1):
+        if i not in deleted:
+            result.append(replaced.get(i, line))
+        result += inserted.get(i, [])
+    exports = [line for line in result if line.upper().startswith("EXPORT")]
+    return [line for line in result if not line.upper().startswith("EXPORT")] + exports[-1:], None
+
+
+# --------------------------
+# Sessions
+# --------------------------
+class EditSession:
+    """The current program of one conversation, its built solids and its exports."""
+
+    def __init__(self, session_id=None, output_dir=None):
+        self.id = session_id or uuid.uuid4().hex[:12]
+        self.output_dir = output_dir or "out"  # exports are content-addressed, see part_export
+        self.lines = []
+        self.memo = {}  # node key -> solid of the current program (see build_dsl)
+        self.step_file = None
+        self.part = None
+        self.history = []
+        self.lock = threading.Lock()
+
+    @property
+    def dsl(self):
+        return "\n".join(self.lines)
+
+    def reset(self):
+        with self.lock:
+            self.lines, self.memo, self.step_file, self.part, self.history = [], {}, None, None, []
+
+    def submit(self, text, on_token=None, max_attempts=2):
+        """Generate a part from `text`, or edit the current one if there is one.
+
+        Returns a result dict: status ("ok", "llm_failed" or "no_export"), mode
+        ("generate" or "edit"), dsl (the current program, unchanged on failure),
+        step_file, part, edits, error, llm_s, cad_s.
+        """
+        with self.lock, span("session", mode="edit" if self.lines else "generate") as s:
+            previous = list(self.lines)
+            if self.lines:
+                result = self._edit(text, on_token, max_attempts)
+            else:
+                result = self._generate(text, on_token, max_attempts)
+            result = {"step_file": None, "part": None, "cad_s": 0.0, **result, "dsl": self.dsl}
+            if result["status"] == "ok":
+                try:
+                    result.update(self._build())
+                except Exception:
+                    self.lines = previous  # keep the last program that built
+                    raise
+            s["status"] = result["status"]
+            self.history.append((text, result["mode"], result["status"]))
+        count("cad_agent_session_requests_total", mode=result["mode"], status=result["status"])
+        return result
+
+    def _generate(self, text, on_token, max_attempts):
+        start = time.perf_counter()
+        dsl = prompt_to_dsl(text, max_attempts=max_attempts, on_token=on_token)
+        result = {"mode": "generate", "edits": [], "error": None, "llm_s": time.perf_counter() - start}
+        if dsl is None:
+            return dict(result, status="llm_failed", error="no valid DSL after retries")
+        self.lines = dsl.splitlines()
+        return dict(result, status="ok")
+
+    def _edit(self, text, on_token, max_attempts):
+        start = time.perf_counter()
+        instruction = text
+        msg = "no edits"
+        for attempt in range(max_attempts):
+            if on_token and attempt:
+                on_token(f"\n# retrying after: {msg}\n")
+            with span("session.edit", attempt=attempt + 1) as s:
+                script = ""
+                for piece in stream_completion(build_edit_prompt(self.lines, instruction), prefix=EDIT_PROMPT,
+                                               gbnf=DSL_EDIT_GBNF, max_tokens=200, stop=["User:", "\n\n"]):
+                    script += piece
+                    if on_token:
+                        on_token(piece)
+                edits = parse_edits(script)
+                s["edits"] = len(edits)
+            lines, msg = apply_edits(self.lines, edits) if edits else (self.lines, "no edits")
+            if msg is None:
+                repaired, changes = repair_dsl(parse_dsl("\n".join(lines)))
+                valid, msg = validate_dsl(repaired)
+                if valid:
+                    if changes:
+                        print("🔧 Repaired:", "; ".join(changes))
+                    print(f"✏️ {len(edits)} edit(s):\n", script.strip())
+                    self.lines = format_dsl(repaired).splitlines()
+                    return {"mode": "edit", "status": "ok", "edits": edits, "error": None,
+                            "llm_s": time.perf_counter() - start}
+            print("⚠️ Edit rejected:", msg)
+            instruction = f"{text}. Fix the following issue: {msg}"
+        return {"mode": "edit", "status": "llm_failed", "edits": [], "error": msg,
+                "llm_s": time.perf_counter() - start}
+
+    def _build(self):
+        """Re-execute the program; unchanged operations come from the session's memo."""
+        start = time.perf_counter()
+        path, part = execute_dsl(parse_dsl(self.dsl), self.output_dir, return_part=True, memo=self.memo)
+        cad_s = time.perf_counter() - start
+        if path is None:
+            return {"status": "no_export", "error": "program has no EXPORT", "cad_s": cad_s}
+        self.step_file, self.part = path, part
+        return {"step_file": path, "part": part, "cad_s": cad_s}
+
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def get_session(session_id=None, create=True):
+    """The session with this id, created if new (None without `create`); the
+    least recently used beyond MAX_SESSIONS are dropped with their solids.
+    """
+    with _sessions_lock:
+        if session_id in _sessions:
+            _sessions.move_to_end(session_id)
+            return _sessions[session_id]
+        if not create:
+            return None
+        session = EditSession(session_id)
+        _sessions[session.id] = session
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+        return session
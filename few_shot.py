@@ -0,0 +1,177 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from llm_provider import CACHE_DIR
+from result_cache import normalize_prompt
+
+# --------------------------
+# Few-shot example store
+# --------------------------
+# The hand-written examples are always available; validated generations are
+# appended to a JSONL store and become candidates for later requests.
+EXAMPLE_STORE_PATH = os.environ.get("CAD_AGENT_EXAMPLES", os.path.join(CACHE_DIR, "examples.jsonl"))
+FEW_SHOT_K = int(os.environ.get("CAD_AGENT_FEW_SHOT_K", "3"))
+FEW_SHOT_LEARN = os.environ.get("CAD_AGENT_FEW_SHOT_LEARN", "1") != "0"
+
+SEED_EXAMPLES = [
+    {
+        "prompt": "Make a 30x20x10 box.",
+        "dsl": 'CREATE_BOX id=box1 width=30 height=20 depth=10\nEXPORT filename="box1.step"',
+    },
+    {
+        "prompt": "Make a 40x20x5 plate with a centered hole of radius 3.",
+        "dsl": "CREATE_BOX id=plate width=40 height=20 depth=5\n"
+        "CREATE_CYLINDER id=hole1 radius=3 height=10\n"
+        "SUBTRACT target=plate tool=hole1\n"
+        'EXPORT filename="plate_with_hole.step"',
+    },
+    {
+        "prompt": "Make a block 60x30x15 mm with two holes of radius 5 mm spaced 40 mm apart.",
+        "dsl": "CREATE_BOX id=block width=60 height=30 depth=15\n"
+        "CREATE_CYLINDER id=holes radius=5 height=20\n"
+        "LINEAR_PATTERN id=holes count=2 dx=40 dy=0 dz=0\n"
+        "SUBTRACT target=block tool=holes\n"
+        'EXPORT filename="block_with_holes.step"',
+    },
+    {
+        "prompt": "Create a 50x50x10 square plate with four corner holes, radius 4mm, inset 8mm from edges.",
+        "dsl": "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+        "CREATE_CYLINDER id=holes radius=4 height=15\n"
+        "GRID_PATTERN id=holes nx=2 ny=2 dx=34 dy=34\n"
+        "SUBTRACT target=plate tool=holes\n"
+        'EXPORT filename="plate_corner_holes.step"',
+    },
+    {
+        "prompt": "Make a disc of radius 40 mm, 8 mm thick, with six holes of radius 3 mm on a 30 mm radius bolt circle.",
+        "dsl": "CREATE_CYLINDER id=disc radius=40 height=8\n"
+        "CREATE_CYLINDER id=holes radius=3 height=12\n"
+        "POLAR_PATTERN id=holes count=6 radius=30\n"
+        "SUBTRACT target=disc tool=holes\n"
+        'EXPORT filename="disc_bolt_circle.step"',
+    },
+    {
+        "prompt": "Make a cylinder radius 10 mm and height 30 mm with rounded edges.",
+        "dsl": "CREATE_CYLINDER id=cyl1 radius=10 height=30\n"
+        "FILLET id=cyl1 radius=2\n"
+        'EXPORT filename="rounded_cylinder.step"',
+    },
+    {
+        "prompt": "Create a 100x50x20 base with a 30x30x40 tower centered on top.",
+        "dsl": "CREATE_BOX id=base width=100 height=50 depth=20\n"
+        "CREATE_BOX id=tower width=30 height=30 depth=40\n"
+        "TRANSLATE id=tower x=0 y=0 z=30\n"
+        'EXPORT filename="base_with_tower.step"',
+    },
+    {
+        "prompt": "Make a 80x40x12 plate with a slot 50mm long, 8mm wide through the center.",
+        "dsl": "CREATE_BOX id=plate width=80 height=40 depth=12\n"
+        "CREATE_BOX id=slot width=50 height=8 depth=20\n"
+        "SUBTRACT target=plate tool=slot\n"
+        'EXPORT filename="plate_with_slot.step"',
+    },
+]
+
+_examples = None
+_index = None
+_store_lock = threading.Lock()
+
+STOPWORDS = {
+    "a", "an", "the", "with", "of", "and", "on", "in", "to", "from", "by", "at", "for",
+    "mm", "make", "create", "is", "it", "its", "each", "that", "x",
+}
+
+
+def _terms(text):
+    """Lower-case word terms with numbers and stopwords dropped and a crude plural strip."""
+    terms = []
+    for word in re.findall(r"[a-z]+", text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def load_examples():
+    """Seed examples followed by the stored validated generations."""
+    global _examples, _index
+    with _store_lock:
+        if _examples is None:
+            examples = list(SEED_EXAMPLES)
+            if os.path.exists(EXAMPLE_STORE_PATH):
+                with open(EXAMPLE_STORE_PATH) as f:
+                    examples += [json.loads(line) for line in f if line.strip()]
+            _examples, _index = examples, None
+        return _examples
+
+
+def _get_index():
+    """BM25 statistics over the example prompts, rebuilt after the store changes."""
+    global _index
+    examples = load_examples()
+    if _index is None:
+        docs = [_terms(example["prompt"]) for example in examples]
+        df = Counter(term for doc in docs for term in set(doc))
+        avgdl = sum(len(doc) for doc in docs) / max(len(docs), 1)
+        _index = (docs, df, avgdl)
+    return _index
+
+
+def bm25_scores(query, k1=1.5, b=0.75):
+    """BM25 score of every stored example's prompt against `query`."""
+    docs, df, avgdl = _get_index()
+    n = len(docs)
+    scores = []
+    for doc in docs:
+        tf = Counter(doc)
+        score = 0.0
+        for term in set(_terms(query)):
+            if term in tf:
+                idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * len(doc) / avgdl))
+        scores.append(score)
+    return scores
+
+
+def select_examples(query, k=FEW_SHOT_K):
+    """The k examples most relevant to `query`, least relevant first so the best
+    match sits right before the request. Falls back to the first seed example.
+    """
+    examples = load_examples()
+    ranked = sorted(zip(bm25_scores(query), range(len(examples))), key=lambda s: (-s[0], s[1]))
+    chosen, seen = [], set()
+    for score, i in ranked:
+        if score <= 0 or len(chosen) == k:
+            break
+        if examples[i]["dsl"] not in seen:
+            seen.add(examples[i]["dsl"])
+            chosen.append(examples[i])
+    return list(reversed(chosen)) or [SEED_EXAMPLES[0]]
+
+
+def format_examples(examples):
+    return "".join(f"User: {e['prompt']}\nAssistant:\n{e['dsl']}\n\n" for e in examples)
+
+
+def add_example(prompt, dsl):
+    """Store a validated generation as a future example (skipped if the prompt is known)."""
+    if not FEW_SHOT_LEARN:
+        return False
+    global _index
+    examples = load_examples()
+    key = normalize_prompt(prompt)
+    with _store_lock:
+        if any(normalize_prompt(e["prompt"]) == key for e in examples):
+            return False
+        example = {"prompt": prompt, "dsl": dsl}
+        os.makedirs(os.path.dirname(os.path.abspath(EXAMPLE_STORE_PATH)), exist_ok=True)
+        with open(EXAMPLE_STORE_PATH, "a") as f:
+            f.write(json.dumps(example) + "\n")
+        examples.append(example)
+        _index = None
+    return True
@@ -0,0 +1,544 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import tracing
+
+# --------------------------
+# Model configuration
+# --------------------------
+DEFAULT_REPO_ID = "TheBloke/Mistral-7B-Instruct-v0.2-GGUF"
+DEFAULT_FILENAME = "mistral-7b-instruct-v0.2.Q4_K_M.gguf"
+CONFIG_PATH = os.environ.get("CAD_AGENT_CONFIG", "cad_agent_config.json")
+CACHE_DIR = os.environ.get(
+    "CAD_AGENT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "cad_agent")
+)
+
+# n_threads / n_threads_batch None: split the machine's cores evenly between the model workers
+DEFAULT_CONFIG = {
+    "model_path": None,
+    "n_ctx": 2048,
+    "n_threads": None,
+    "n_threads_batch": None,
+    "n_batch": 512,
+    "use_mmap": True,
+    "use_mlock": False,
+    "n_workers": 1,
+    "n_parallel": 1,
+    "verbose": True,
+    # Speculative decoding: "off", "prompt_lookup" (n-gram drafts from the prompt and
+    # the output so far) or "draft" (a small GGUF with the same vocabulary)
+    "speculative": "off",
+    "draft_model_path": None,
+    "draft_tokens": 10,
+    "draft_ngram": 3,
+}
+
+# config key -> (environment variable, type)
+ENV_OVERRIDES = {
+    "model_path": ("CAD_AGENT_MODEL_PATH", str),
+    "n_ctx": ("CAD_AGENT_N_CTX", int),
+    "n_threads": ("CAD_AGENT_N_THREADS", int),
+    "n_threads_batch": ("CAD_AGENT_N_THREADS_BATCH", int),
+    "n_batch": ("CAD_AGENT_N_BATCH", int),
+    "n_workers": ("CAD_AGENT_N_WORKERS", int),
+    "n_parallel": ("CAD_AGENT_N_PARALLEL", int),
+    "speculative": ("CAD_AGENT_SPECULATIVE", str),
+    "draft_model_path": ("CAD_AGENT_DRAFT_MODEL", str),
+    "draft_tokens": ("CAD_AGENT_DRAFT_TOKENS", int),
+}
+
+# Runtime settings measured by autotune_llama.py, saved per host
+PROFILE_KEYS = ("n_threads", "n_threads_batch", "n_batch", "use_mmap", "use_mlock")
+PROFILE_PATH = os.environ.get(
+    "CAD_AGENT_PROFILE",
+    os.path.join(CACHE_DIR, "profiles", f"{platform.node() or 'host'}-{os.cpu_count()}cpu.json"),
+)
+
+_llm = None
+_llm_lock = threading.Lock()
+_pool = None
+_scheduler = None
+_use_lock = threading.Lock()
+_stats_lock = threading.Lock()
+LLM_STATS = {"waiting": 0, "last_wait_s": 0.0}
+_fingerprints = {}
+_prefix_states = {}
+_grammars = {}
+
+
+def load_config():
+    """Return the model settings: defaults, then this host's autotune profile,
+    then the JSON config file, then env vars.
+
+    The profile only applies when it was tuned for the configured number of workers.
+    """
+    explicit = {}
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH) as f:
+            explicit.update(json.load(f))
+    for key, (env_name, cast) in ENV_OVERRIDES.items():
+        if os.environ.get(env_name):
+            explicit[key] = cast(os.environ[env_name])
+
+    config = dict(DEFAULT_CONFIG)
+    profile = load_host_profile()
+    if profile and profile.get("n_workers", 1) == explicit.get("n_workers", config["n_workers"]):
+        config.update(profile["settings"])
+    config.update(explicit)
+    return config
+
+
+def load_host_profile():
+    """The autotune profile saved for this host, or None."""
+    if not os.path.exists(PROFILE_PATH):
+        return None
+    with open(PROFILE_PATH) as f:
+        return json.load(f)
+
+
+def save_host_profile(settings, n_workers=1, model_id=None, results=None):
+    """Store tuned runtime settings for this host; load_config() picks them up."""
+    profile = {
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "model": model_id,
+        "n_workers": n_workers,
+        "settings": {key: settings[key] for key in PROFILE_KEYS if key in settings},
+        "results": results or [],
+    }
+    os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+    with open(PROFILE_PATH + ".tmp", "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(PROFILE_PATH + ".tmp", PROFILE_PATH)
+    return PROFILE_PATH
+
+
+def resolve_model_path(config):
+    """Return the GGUF path from the config, or fetch it from the Hugging Face cache."""
+    if config.get("model_path"):
+        return config["model_path"]
+    from huggingface_hub import hf_hub_download, try_to_load_from_cache
+
+    cached = try_to_load_from_cache(repo_id=DEFAULT_REPO_ID, filename=DEFAULT_FILENAME)
+    if isinstance(cached, str):
+        return cached
+    return hf_hub_download(repo_id=DEFAULT_REPO_ID, filename=DEFAULT_FILENAME)
+
+
+def thread_budget(config, key="n_threads"):
+    """Threads per model instance: the configured value of `key`, or an even share of the cores."""
+    if config.get(key):
+        return config[key]
+    return max(1, (os.cpu_count() or 1) // max(1, config.get("n_workers") or 1))
+
+
+def load_llm(config=None):
+    """Build a new Llama instance. Prefer get_llm() to share the loaded model."""
+    from llama_cpp import Llama
+
+    config = config or load_config()
+    draft_model = load_draft_model(config)
+    llm = Llama(
+        model_path=resolve_model_path(config),
+        n_ctx=config["n_ctx"],
+        n_threads=thread_budget(config),
+        n_threads_batch=thread_budget(config, "n_threads_batch"),
+        n_batch=config["n_batch"],
+        use_mmap=config["use_mmap"],
+        use_mlock=config["use_mlock"],
+        draft_model=draft_model,
+        verbose=config["verbose"],
+    )
+    if isinstance(draft_model, GGUFDraftModel) and draft_model.llm.n_vocab() != llm.n_vocab():
+        raise ValueError(
+            f"draft model vocabulary ({draft_model.llm.n_vocab()}) differs from the model's ({llm.n_vocab()})"
+        )
+    return llm
+
+
+# --------------------------
+# Speculative decoding
+# --------------------------
+# llama-cpp-python evaluates the drafted tokens in one batch and keeps them only as long
+# as they match what the model samples itself, so the output is unchanged.
+def load_draft_model(config):
+    """The draft model for config["speculative"], or None when it is "off"."""
+    mode = (config.get("speculative") or "off").lower()
+    if mode == "off":
+        return None
+    if mode == "prompt_lookup":
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        # DSL lines repeat the examples and earlier lines almost verbatim
+        return LlamaPromptLookupDecoding(max_ngram_size=config["draft_ngram"], num_pred_tokens=config["draft_tokens"])
+    if mode == "draft":
+        if not config.get("draft_model_path"):
+            raise ValueError("speculative='draft' needs draft_model_path (CAD_AGENT_DRAFT_MODEL)")
+        return GGUFDraftModel(config["draft_model_path"], config["draft_tokens"], n_ctx=config["n_ctx"],
+                              n_threads=thread_budget(config))
+    raise ValueError(f"unknown speculative mode '{mode}' (off, prompt_lookup or draft)")
+
+
+class GGUFDraftModel:
+    """Greedy drafts from a small GGUF model with the main model's vocabulary.
+
+    Called by llama-cpp-python with the token ids so far; keeps its own KV cache
+    and only evaluates what changed since the last call.
+    """
+
+    def __init__(self, model_path, num_pred_tokens=10, n_ctx=2048, n_threads=None):
+        from llama_cpp import Llama
+
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+
+    def __call__(self, input_ids, **kwargs):
+        import numpy as np
+
+        llm = self.llm
+        ids = input_ids.tolist()
+        if len(ids) + self.num_pred_tokens > llm.n_ctx():
+            return np.array([], dtype=np.intc)
+        # Keep the cached tokens shared with `ids`, but always evaluate at least one
+        n = 0
+        cached = llm.input_ids[: llm.n_tokens].tolist()
+        while n < min(len(cached), len(ids) - 1) and cached[n] == ids[n]:
+            n += 1
+        llm.n_tokens = n
+        llm.eval(ids[n:])
+        draft = []
+        for i in range(self.num_pred_tokens):
+            token = int(np.argmax(llm.scores[llm.n_tokens - 1]))
+            if token == llm.token_eos():
+                break
+            draft.append(token)
+            if i + 1 < self.num_pred_tokens:
+                llm.eval([token])
+        return np.array(draft, dtype=np.intc)
+
+
+def get_llm():
+    """Return the process-wide Llama instance, loading it on first use."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = load_llm()
+    return _llm
+
+
+def _timed_wait(acquire):
+    """Call a blocking `acquire()`, counting the caller in LLM_STATS while it waits."""
+    start = time.perf_counter()
+    with _stats_lock:
+        LLM_STATS["waiting"] += 1
+    try:
+        return acquire()
+    finally:
+        with _stats_lock:
+            LLM_STATS["waiting"] -= 1
+            LLM_STATS["last_wait_s"] = time.perf_counter() - start
+
+
+def set_llm(llm):
+    """Use `llm` as the process-wide model, e.g. a stand-in for tests and benchmarks.
+
+    Any object with the Llama methods used here works; the worker pool and the
+    batching scheduler are disabled.
+    """
+    global _llm, _pool, _scheduler
+    _llm, _pool, _scheduler = llm, False, False
+
+
+@contextmanager
+def locked_llm():
+    """Exclusive use of the shared model: a llama.cpp context must not run two
+    generations at once. LLM_STATS tracks how many callers wait and for how long.
+    """
+    _timed_wait(_use_lock.acquire)
+    try:
+        yield get_llm()
+    finally:
+        _use_lock.release()
+
+
+def get_grammar(gbnf):
+    """Return a compiled LlamaGrammar for the GBNF text, compiled once per process."""
+    if gbnf not in _grammars:
+        from llama_cpp import LlamaGrammar
+
+        _grammars[gbnf] = LlamaGrammar.from_string(gbnf, verbose=False)
+    return _grammars[gbnf]
+
+
+# --------------------------
+# Prompt-prefix KV cache
+# --------------------------
+def model_fingerprint(model_path):
+    """Cheap content hash of a GGUF file: its size plus the first and last MiB."""
+    if model_path not in _fingerprints:
+        chunk = 1 << 20
+        size = os.path.getsize(model_path)
+        h = hashlib.sha256(str(size).encode())
+        with open(model_path, "rb") as f:
+            h.update(f.read(chunk))
+            f.seek(max(size - chunk, 0))
+            h.update(f.read(chunk))
+        _fingerprints[model_path] = h.hexdigest()[:16]
+    return _fingerprints[model_path]
+
+
+def current_model_id():
+    """Fingerprint of the model in use, without loading it if it is not loaded yet."""
+    model_path = _llm.model_path if _llm is not None else resolve_model_path(load_config())
+    return model_fingerprint(model_path)
+
+
+def prefix_cache_key(llm, prefix):
+    """Key for the evaluated state of `prefix`: model hash, prompt hash and context size.
+
+    States of a context that keeps all logits (speculative decoding) are stored separately.
+    """
+    prompt_hash = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+    key = f"{model_fingerprint(llm.model_path)}-{prompt_hash}-{llm.n_ctx()}"
+    if getattr(llm, "draft_model", None) is not None:
+        key += "-spec"
+    return key
+
+
+def restore_prompt_prefix(llm, prefix):
+    """Load the evaluated KV state of `prefix` into `llm` so a following
+    completion whose prompt starts with `prefix` only prefills the rest.
+
+    The state is computed once with llm.eval(), saved with llm.save_state()
+    and kept both in memory and on disk under CACHE_DIR.
+    """
+    tokens = llm.tokenize(prefix.encode("utf-8"), special=True)
+    n = len(tokens)
+    if llm.n_tokens >= n and llm.input_ids[:n].tolist() == tokens:
+        return
+
+    key = prefix_cache_key(llm, prefix)
+    with tracing.span("llm.prefix_restore", prefix_tokens=n) as s:
+        state = _prefix_states.get(key)
+        s["source"] = "memory"
+        if state is None:
+            path = os.path.join(CACHE_DIR, f"prefix-{key}.state")
+            if os.path.exists(path):
+                s["source"] = "disk"
+                with open(path, "rb") as f:
+                    state = pickle.load(f)
+            else:
+                s["source"] = "eval"
+                llm.reset()
+                llm.eval(tokens)
+                state = llm.save_state()
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    pickle.dump(state, f)
+                os.replace(path + ".tmp", path)
+            _prefix_states[key] = state
+        llm.load_state(state)
+
+
+# --------------------------
+# Generation entry points
+# --------------------------
+def stream_completion(prompt, prefix=None, gbnf=None, finish=None, **kwargs):
+    """Yield the completion of `prompt` as text chunks.
+
+    `prefix` is the fixed start of the prompt whose KV state is cached, `gbnf`
+    an optional grammar text. Runs on the model worker pool when n_workers > 1,
+    in the batching scheduler when n_parallel > 1, otherwise on the process-wide
+    model. Closing the generator stops decoding. A `finish` dict receives
+    "reason": "length" when max_tokens cut the completion off, "stop" otherwise.
+    """
+    start = time.perf_counter()
+    first = None
+    n_tokens = 0
+    attrs = {"prompt_chars": len(prompt)}
+    try:
+        pool = get_worker_pool() or get_scheduler()
+        if pool is not None:
+            for text in pool.stream(prompt, prefix=prefix, gbnf=gbnf, finish=finish, **kwargs):
+                first = first or time.perf_counter()
+                n_tokens += 1
+                yield text
+            return
+        grammar = get_grammar(gbnf) if gbnf else None
+        with locked_llm() as llm:
+            if prefix:
+                restore_prompt_prefix(llm, prefix)
+            if tracing.ENABLED:
+                attrs["prompt_tokens"] = len(llm.tokenize(prompt.encode("utf-8"), special=True))
+            stream = llm(prompt, grammar=grammar, stream=True, **kwargs)
+            try:
+                for chunk in stream:
+                    first = first or time.perf_counter()
+                    n_tokens += 1
+                    if finish is not None:
+                        finish["reason"] = chunk["choices"][0].get("finish_reason") or "stop"
+                    yield chunk["choices"][0]["text"]
+            finally:
+                stream.close()
+    finally:
+        # Prefill ends with the first token (model wait included), decode runs from there
+        end = time.perf_counter()
+        first = first or end
+        tracing.record_span("llm.prefill", first - start, **attrs)
+        tracing.record_span("llm.decode", end - first, completion_tokens=n_tokens)
+        tracing.count("cad_agent_completion_tokens_total", n_tokens)
+
+
+def complete(prompt, prefix=None, gbnf=None, **kwargs):
+    """Whole completion text of `prompt`; see stream_completion."""
+    return "".join(stream_completion(prompt, prefix=prefix, gbnf=gbnf, **kwargs))
+
+
+def complete_candidates(prompt, n, prefix=None, gbnf=None, **kwargs):
+    """Yield `n` sampled completions of `prompt`, each as soon as it is finished.
+
+    With the batching scheduler all of them decode at once from one prefill;
+    otherwise they are generated one after another. Stop iterating to skip the rest.
+    """
+    scheduler = get_scheduler() if not get_worker_pool() else None
+    if scheduler is not None:
+        yield from scheduler.complete_candidates(prompt, n, prefix=prefix, gbnf=gbnf, **kwargs)
+        return
+    for _ in range(n):
+        yield complete(prompt, prefix=prefix, gbnf=gbnf, **kwargs)
+
+
+# --------------------------
+# Model worker pool
+# --------------------------
+def _worker_main(conn, config):
+    """Generation worker: owns one Llama context and serves jobs from `conn`.
+
+    Sends ("token", text) per chunk, then ("done", finish reason) or ("error", message).
+    A "stop" received mid-generation ends the job early.
+    """
+    llm = load_llm(config)
+    conn.send(("ready", None))
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        if job == "stop":  # arrived after the job had already finished
+            continue
+        prompt, prefix, gbnf, kwargs = job
+        try:
+            if prefix:
+                restore_prompt_prefix(llm, prefix)
+            grammar = get_grammar(gbnf) if gbnf else None
+            stream = llm(prompt, grammar=grammar, stream=True, **kwargs)
+            reason = "stop"
+            try:
+                for chunk in stream:
+                    reason = chunk["choices"][0].get("finish_reason") or reason
+                    conn.send(("token", chunk["choices"][0]["text"]))
+                    if conn.poll() and conn.recv() == "stop":
+                        break
+            finally:
+                stream.close()
+            conn.send(("done", reason))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class ModelWorkerPool:
+    """N generation processes, each with its own llama.cpp context and thread budget.
+
+    Every worker maps the same GGUF file with mmap (use_mmap), so the weight pages are shared
+    read-only through the page cache and resident memory stays near one model copy
+    plus one KV cache per worker. Requests go to whichever worker is idle.
+    """
+
+    def __init__(self, n_workers, config=None):
+        config = dict(config or load_config())
+        config["n_workers"] = n_workers
+        config["n_threads"] = thread_budget(config)
+        config["n_threads_batch"] = thread_budget(config, "n_threads_batch")
+        config["model_path"] = resolve_model_path(config)
+        # spawn, not fork: forking a process with running llama.cpp/ggml or server
+        # threads is unsafe, and the mmap'd weights are shared either way
+        context = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._workers = []
+        for _ in range(n_workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker_main, args=(child, config), daemon=True)
+            process.start()
+            self._workers.append((process, parent))
+        for process, conn in self._workers:
+            conn.recv()  # wait until the model is loaded
+            self._idle.put(conn)
+
+    def stream(self, prompt, prefix=None, gbnf=None, finish=None, **kwargs):
+        """Yield completion chunks from an idle worker, waiting for one if all are busy."""
+        conn = _timed_wait(self._idle.get)
+        try:
+            conn.send((prompt, prefix, gbnf, kwargs))
+            finished = False
+            try:
+                while True:
+                    kind, value = conn.recv()
+                    if kind == "token":
+                        yield value
+                        continue
+                    finished = True
+                    if kind == "error":
+                        raise RuntimeError(f"model worker failed: {value}")
+                    if finish is not None:
+                        finish["reason"] = value
+                    return
+            finally:
+                if not finished:
+                    # the caller stopped early: cancel and drain the rest of the job
+                    conn.send("stop")
+                    while conn.recv()[0] == "token":
+                        pass
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for process, conn in self._workers:
+            conn.send(None)
+        for process, conn in self._workers:
+            process.join(timeout=10)
+
+
+def get_worker_pool():
+    """Return the process-wide ModelWorkerPool when n_workers > 1, else None."""
+    global _pool
+    if _pool is None:
+        with _llm_lock:
+            if _pool is None:
+                n_workers = load_config().get("n_workers") or 1
+                _pool = ModelWorkerPool(n_workers) if n_workers > 1 else False
+    return _pool or None
+
+
+def get_scheduler():
+    """Return the process-wide GenerationScheduler when n_parallel > 1, else None."""
+    global _scheduler
+    if _scheduler is None:
+        with _llm_lock:
+            if _scheduler is None:
+                config = load_config()
+                n_parallel = config.get("n_parallel") or 1
+                if n_parallel > 1:
+                    from llm_scheduler import GenerationScheduler
+
+                    _scheduler = GenerationScheduler(n_parallel, config)
+                else:
+                    _scheduler = False
+    return _scheduler or None
@@ -0,0 +1,358 @@
+import codecs
+import queue
+import threading
+
+import tracing
+from llm_provider import LLM_STATS, _stats_lock, get_grammar, load_llm
+
+# --------------------------
+# Continuous batching
+# --------------------------
+# One llama.cpp context decodes many sequences at once, each under its own KV
+# sequence id. Every step puts one token per running sequence and the next chunk
+# of waiting prompts into a single batch, so requests join and leave between
+# steps instead of waiting for each other. The fixed prompt prefix lives in
+# sequence 0 and is shared with every request that starts with it.
+PREFIX_SEQ = 0
+HISTORY_TOKENS = 64  # tokens seen by the repetition penalty, as in Llama
+
+
+class _Sequence:
+    """One generated continuation: its KV sequence id, sampler and output text."""
+
+    def __init__(self, seq_id, index, request, grammar):
+        from llama_cpp._internals import _LlamaSamplingContext
+
+        self.seq_id = seq_id
+        self.index = index
+        self.request = request
+        self.sampling = _LlamaSamplingContext(params=request.params, grammar=grammar)
+        self.sampling.prev = request.tokens[-HISTORY_TOKENS:]
+        self.tokens = []
+        self.n_past = len(request.tokens)
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.text = ""
+        self.sent = 0
+        self.done = False
+        self.reason = "stop"  # "length" when max_tokens ended it
+
+
+class _Request:
+    """A prompt waiting for or in prefill, and the sequences sampled from it."""
+
+    def __init__(self, tokens, prefix_tokens, gbnf, n, params, max_tokens, stop):
+        self.tokens = tokens
+        self.prefix_tokens = prefix_tokens
+        self.gbnf = gbnf
+        self.n = n
+        self.params = params
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.events = queue.Queue()
+        self.sequences = []
+        self.pos = 0  # next prompt token to prefill
+        self.shared = False
+        self.cancelled = False
+
+    def kv_budget(self):
+        """KV cells this request may use beyond the shared prefix."""
+        start = len(self.prefix_tokens) if self.shared else 0
+        return len(self.tokens) - start + self.n * self.max_tokens
+
+
+def _sampling_params(kwargs):
+    """Llama.__call__ sampling arguments as llama-cpp-python sampling params."""
+    from llama_cpp._internals import _LlamaSamplingParams
+
+    return _LlamaSamplingParams(
+        temp=kwargs.get("temperature", 0.8),
+        top_k=kwargs.get("top_k", 40),
+        top_p=kwargs.get("top_p", 0.95),
+        min_p=kwargs.get("min_p", 0.05),
+        typical_p=kwargs.get("typical_p", 1.0),
+        tfs_z=kwargs.get("tfs_z", 1.0),
+        penalty_last_n=HISTORY_TOKENS,
+        penalty_repeat=kwargs.get("repeat_penalty", 1.0),
+        penalty_freq=kwargs.get("frequency_penalty", 0.0),
+        penalty_present=kwargs.get("presence_penalty", 0.0),
+    )
+
+
+class GenerationScheduler:
+    """Continuous-batching generation on one model context with `n_parallel` sequences.
+
+    The context holds n_ctx tokens per sequence, so every request has the room it
+    would have alone. A background thread runs the decode loop; callers stream
+    from stream() or complete_candidates() like from llm_provider.stream_completion().
+    """
+
+    def __init__(self, n_parallel, config):
+        import llama_cpp
+
+        self._llama_cpp = llama_cpp
+        config = dict(config, n_ctx=config["n_ctx"] * n_parallel, speculative="off")
+        self.llm = load_llm(config)
+        self.ctx = self.llm._ctx.ctx
+        self.n_parallel = n_parallel
+        self.n_batch = config["n_batch"]
+        self.capacity = self.llm.n_ctx()
+        self._batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+        self._free_ids = list(range(1, n_parallel + 1))
+        self._waiting = []
+        self._prefilling = []
+        self._running = []
+        self._prefix_tokens = []
+        self._prefix_users = 0
+        self._kv_used = 0
+        self._dead = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    # ---- caller side ----
+    def _submit(self, prompt, prefix, gbnf, n, kwargs):
+        """Queue up to `n` sequences of `prompt`: no more than n_parallel and than
+        fit in the context. Only a prompt whose single sequence does not fit is rejected.
+        """
+        tokens = self.llm.tokenize(prompt.encode("utf-8"), special=True)
+        prefix_tokens = self.llm.tokenize(prefix.encode("utf-8"), special=True) if prefix else []
+        if tokens[: len(prefix_tokens)] != prefix_tokens:
+            prefix_tokens = []
+        max_tokens = kwargs.get("max_tokens") or 256
+        fit = (self.capacity - len(prefix_tokens) - len(tokens)) // max_tokens
+        if fit < 1:
+            raise ValueError(f"request needs {len(tokens) + max_tokens} KV cells, "
+                             f"the scheduler has {self.capacity - len(prefix_tokens)}")
+        request = _Request(tokens, prefix_tokens, gbnf, min(n, self.n_parallel, fit), _sampling_params(kwargs),
+                           max_tokens, list(kwargs.get("stop") or []))
+        with self._cond:
+            if self._dead:
+                raise RuntimeError(f"generation scheduler failed: {self._dead}")
+            self._waiting.append(request)
+            self._cond.notify()
+        return request
+
+    def _events(self, request):
+        """(candidate index, text or None when finished) until every sequence is done."""
+        remaining = request.n
+        try:
+            while remaining:
+                kind, index, value = request.events.get()
+                if kind == "error":
+                    raise RuntimeError(f"generation scheduler failed: {value}")
+                if kind == "done":
+                    remaining -= 1
+                yield index, value
+        finally:
+            if remaining:
+                request.cancelled = True  # the loop frees its sequences at the next step
+
+    def stream(self, prompt, prefix=None, gbnf=None, finish=None, **kwargs):
+        """Yield the completion of `prompt` as text chunks; closing it cancels the request."""
+        request = self._submit(prompt, prefix, gbnf, 1, kwargs)
+        for _, text in self._events(request):
+            if text:
+                yield text
+        if finish is not None:
+            finish["reason"] = request.sequences[0].reason
+
+    def complete_candidates(self, prompt, n, prefix=None, gbnf=None, **kwargs):
+        """Sample `n` completions of `prompt` together and yield each full text as
+        it finishes. The prompt is prefilled once and its KV cells are shared; more
+        candidates than sequences fit are sampled in rounds.
+        """
+        while n > 0:
+            request = self._submit(prompt, prefix, gbnf, n, kwargs)
+            texts = [""] * request.n
+            for index, text in self._events(request):
+                if text is None:
+                    yield texts[index]
+                else:
+                    texts[index] += text
+            n -= request.n
+
+    # ---- decode loop ----
+    def _loop(self):
+        try:
+            while True:
+                with self._cond:
+                    while not (self._waiting or self._prefilling or self._running):
+                        self._cond.wait()
+                    self._admit()
+                try:
+                    self._step()
+                except Exception as e:
+                    self._fail_all(str(e))
+        except Exception as e:
+            # admitting failed (e.g. the shared prefix did not decode): this thread is gone,
+            # so fail every caller now and every later _submit instead of leaving them waiting
+            with self._cond:
+                self._dead = str(e)
+                self._fail_all(self._dead, waiting=True)
+
+    def _admit(self):
+        """Move waiting requests into prefill while sequence ids and KV cells last."""
+        while self._waiting:
+            request = self._waiting[0]
+            if request.cancelled:
+                self._waiting.pop(0)
+                continue
+            if len(self._free_ids) < request.n:
+                break
+            if request.prefix_tokens and request.prefix_tokens != self._prefix_tokens and not self._prefix_users:
+                self._load_prefix(request.prefix_tokens)
+            request.shared = bool(request.prefix_tokens) and request.prefix_tokens == self._prefix_tokens
+            prefix_cells = len(self._prefix_tokens)
+            if self._kv_used + request.kv_budget() + prefix_cells > self.capacity:
+                break
+            self._waiting.pop(0)
+            self._kv_used += request.kv_budget()
+            grammar = get_grammar(request.gbnf) if request.gbnf else None
+            for index in range(request.n):
+                # a fresh grammar state per sequence, from the parsed grammar
+                seq_grammar = type(grammar)(grammar.parse_state) if grammar else None
+                request.sequences.append(_Sequence(self._free_ids.pop(0), index, request, seq_grammar))
+            if request.shared:
+                self._prefix_users += 1
+                request.pos = len(request.prefix_tokens)
+                self._llama_cpp.llama_kv_cache_seq_cp(self.ctx, PREFIX_SEQ, request.sequences[0].seq_id, -1, -1)
+            self._prefilling.append(request)
+        with _stats_lock:
+            LLM_STATS["waiting"] = len(self._waiting)
+
+    def _load_prefix(self, tokens):
+        """Evaluate a new shared prefix into sequence 0."""
+        self._llama_cpp.llama_kv_cache_seq_rm(self.ctx, PREFIX_SEQ, -1, -1)
+        with tracing.span("llm.prefix_restore", prefix_tokens=len(tokens), source="eval"):
+            for start in range(0, len(tokens), self.n_batch):
+                self._batch.n_tokens = 0
+                for pos in range(start, min(start + self.n_batch, len(tokens))):
+                    self._add(tokens[pos], pos, PREFIX_SEQ, False)
+                self._decode()
+        self._prefix_tokens = tokens
+
+    def _add(self, token, pos, seq_id, logits):
+        batch = self._batch
+        i = batch.n_tokens
+        batch.token[i] = token
+        batch.pos[i] = pos
+        batch.n_seq_id[i] = 1
+        batch.seq_id[i][0] = seq_id
+        batch.logits[i] = logits
+        batch.n_tokens += 1
+        return i
+
+    def _decode(self):
+        status = self._llama_cpp.llama_decode(self.ctx, self._batch)
+        if status != 0:
+            raise RuntimeError(f"llama_decode returned {status}")
+
+    def _step(self):
+        """One batch: the last token of every running sequence, then prompt chunks."""
+        for request in [r for r in self._prefilling if r.cancelled]:
+            self._prefilling.remove(request)
+            self._release(request)
+        for seq in [s for s in self._running if s.request.cancelled]:
+            self._finish(seq, cancelled=True)
+
+        self._batch.n_tokens = 0
+        sample_at = []
+        for seq in self._running:
+            sample_at.append((self._add(seq.tokens[-1], seq.n_past, seq.seq_id, True), [seq]))
+            seq.n_past += 1
+        finished_prefill = []
+        for request in self._prefilling:
+            room = self.n_batch - self._batch.n_tokens
+            if room <= 0:
+                break
+            seq_id = request.sequences[0].seq_id
+            end = min(request.pos + room, len(request.tokens))
+            for pos in range(request.pos, end):
+                i = self._add(request.tokens[pos], pos, seq_id, pos == len(request.tokens) - 1)
+            request.pos = end
+            if end == len(request.tokens):
+                finished_prefill.append(request)
+                sample_at.append((i, request.sequences))
+        if not self._batch.n_tokens:
+            return
+        self._decode()
+        tracing.count("cad_agent_batched_tokens_total", self._batch.n_tokens)
+
+        for request in finished_prefill:
+            self._prefilling.remove(request)
+            first = request.sequences[0]
+            for seq in request.sequences[1:]:
+                # candidates share the prompt's KV cells instead of prefilling again
+                self._llama_cpp.llama_kv_cache_seq_cp(self.ctx, first.seq_id, seq.seq_id, -1, -1)
+            self._running.extend(request.sequences)
+        for i, seqs in sample_at:
+            for seq in seqs:
+                self._sample(seq, i)
+
+    def _sample(self, seq, i):
+        token = seq.sampling.sample(ctx_main=self.llm._ctx, idx=i)
+        seq.sampling.accept(ctx_main=self.llm._ctx, id=token, apply_grammar=seq.sampling.grammar is not None)
+        if token == self.llm.token_eos():
+            self._finish(seq)
+            return
+        piece = self.llm.detokenize([token], prev_tokens=seq.request.tokens + seq.tokens)
+        seq.tokens.append(token)
+        seq.text += seq.decoder.decode(piece)
+        request = seq.request
+
+        hits = [seq.text.find(s) for s in request.stop if s in seq.text]
+        if hits:
+            seq.text = seq.text[: min(hits)]
+            self._finish(seq)
+            return
+        if len(seq.tokens) >= request.max_tokens:
+            seq.reason = "length"
+            self._finish(seq)
+            return
+        # hold back a tail that could still grow into a stop string
+        hold = max([k for s in request.stop for k in range(1, len(s)) if seq.text.endswith(s[:k])] or [0])
+        self._send(seq, len(seq.text) - hold)
+
+    def _send(self, seq, end):
+        if end > seq.sent:
+            seq.request.events.put(("token", seq.index, seq.text[seq.sent:end]))
+            seq.sent = end
+
+    def _finish(self, seq, cancelled=False):
+        if seq.done:
+            return
+        seq.done = True
+        if not cancelled:
+            self._send(seq, len(seq.text))
+            seq.request.events.put(("done", seq.index, None))
+        if seq in self._running:
+            self._running.remove(seq)
+        self._llama_cpp.llama_kv_cache_seq_rm(self.ctx, seq.seq_id, -1, -1)
+        self._free_ids.append(seq.seq_id)
+        if all(s.done for s in seq.request.sequences):
+            self._release(seq.request, free_ids=False)
+
+    def _release(self, request, free_ids=True):
+        """Return a request's KV budget (and, when it never ran, its sequence ids)."""
+        if free_ids:
+            for seq in request.sequences:
+                seq.done = True
+                self._llama_cpp.llama_kv_cache_seq_rm(self.ctx, seq.seq_id, -1, -1)
+                self._free_ids.append(seq.seq_id)
+        self._kv_used -= request.kv_budget()
+        if request.shared:
+            self._prefix_users -= 1
+
+    def _fail_all(self, message, waiting=False):
+        """Report a decode failure to every running caller (and queued ones with
+        `waiting`) and start over with an empty context.
+        """
+        requests = self._prefilling + list({id(s.request): s.request for s in self._running}.values())
+        if waiting:
+            requests, self._waiting = requests + self._waiting, []
+        for request in requests:
+            request.events.put(("error", None, message))
+        self._prefilling, self._running = [], []
+        self._llama_cpp.llama_kv_cache_clear(self.ctx)
+        self._free_ids = list(range(1, self.n_parallel + 1))
+        self._prefix_tokens, self._prefix_users, self._kv_used = [], 0, 0
@@ -1,16 +1,33 @@
-from llama_cpp import Llama
+import hashlib
 import re
+import threading
+from collections import OrderedDict
+
 import cadquery as cq
-from cadquery import exporters
 import os
 
-MODEL_PATH = "/home/bacchus/.cache/huggingface/hub/models--TheBloke--Mistral-7B-Instruct-v0.2-GGUF/snapshots/3a6fbf4a41a1d52e415a4958cde6856d34b2db93/mistral-7b-instruct-v0.2.Q4_K_M.gguf"
-llm = Llama(model_path=MODEL_PATH, n_ctx=2048, n_threads=8)
+from dsl_geometry import check_command
+from dsl_repair import format_command, format_dsl, new_repair_state, repair_command, repair_dsl
+from dsl_spec import DSL_COMMANDS, DSL_GBNF, MIRROR_PLANES, PATTERN_COMMANDS, pattern_offsets
+from few_shot import SEED_EXAMPLES, add_example, format_examples, select_examples
+from llm_provider import complete, complete_candidates, current_model_id, stream_completion
+from part_export import export_part, file_format, find_export, step_export, store_export
+from tracing import count, event, reason_label, span
+from result_cache import (
+    cache_stats,
+    get_cached_dsl,
+    get_cached_export,
+    put_cached_dsl,
+    put_cached_export,
+)
 
 # --------------------------
 # DSL Parser
 # --------------------------
+NUMBER_RE = re.compile(r"^([+-]?(?:\d+\.?\d*|\.\d+))\s*(?:mm)?$", re.IGNORECASE)
+
 def parse_dsl(dsl_text):
+    """Parse DSL text into [{"cmd", "args"}]. Numbers may be quoted or carry an mm suffix."""
     commands = []
     for line in dsl_text.strip().splitlines():
         line = line.strip()
@@ -22,9 +39,10 @@ def parse_dsl(dsl_text):
         for p in parts[1:]:
             if "=" in p:
                 k, v = p.split("=", 1)
-                v = v.strip('"')
-                if re.match(r"^-?\d+(\.\d+)?$", v):
-                    v = float(v)
+                v = v.strip("\"'")
+                number = NUMBER_RE.match(v)
+                if number:
+                    v = float(number.group(1))
                 args[k] = v
         commands.append({"cmd": cmd, "args": args})
     return commands
@@ -32,94 +50,307 @@ def parse_dsl(dsl_text):
 # --------------------------
 # DSL Validator
 # --------------------------
+def validate_command(entry, available_ids):
+    """Check one parsed command against the ids created so far.
+
+    Adds newly created ids to `available_ids`, so a stream of commands can be
+    validated line by line. Returns (ok, message).
+    """
+    cmd = entry["cmd"].upper()
+    args = entry["args"]
+
+    # Validate IDs
+    if cmd.startswith("CREATE_") or cmd in ["TRANSLATE", "FILLET", *PATTERN_COMMANDS]:
+        sid = args.get("id")
+        if not sid:
+            return False, f"Missing 'id' in {cmd}"
+        if cmd.startswith("CREATE_"):
+            if sid in available_ids:
+                return False, f"Duplicate id '{sid}'"
+            available_ids.add(sid)
+        else:
+            if sid not in available_ids:
+                return False, f"Unknown id '{sid}' in {cmd}"
+
+    # Validate references
+    if cmd == "SUBTRACT":
+        if args.get("target") not in available_ids:
+            return False, f"Unknown target '{args.get('target')}'"
+        if args.get("tool") not in available_ids:
+            return False, f"Unknown tool '{args.get('tool')}'"
+
+    # Validate positive numbers, integer counts and mirror planes
+    arg_types = dict(DSL_COMMANDS.get(cmd, []))
+    for key, val in args.items():
+        if isinstance(val, float) and val <= 0:
+            if key in ["width", "height", "depth", "radius"] or arg_types.get(key) in ["positive", "count"]:
+                return False, f"{key} must be positive in {cmd}"
+        if arg_types.get(key) == "count" and not (isinstance(val, float) and val.is_integer()):
+            return False, f"{key} must be a whole number in {cmd}"
+    for key, arg_type in arg_types.items():
+        if arg_type in ["count", "positive"] and cmd in PATTERN_COMMANDS and key not in args:
+            return False, f"Missing '{key}' in {cmd}"
+    if cmd == "MIRROR" and str(args.get("plane", "")).upper() not in MIRROR_PLANES:
+        return False, f"plane must be one of {', '.join(MIRROR_PLANES)} in MIRROR"
+
+    return True, "Valid command"
+
 def validate_dsl(commands):
-    ids = set()
+    """Check ids, arguments and (analytically) geometry of a whole program.
+
+    Returns (ok, message); the message is phrased to go into a retry prompt.
+    """
     available_ids = set()
+    solids = {}
     for entry in commands:
-        cmd = entry["cmd"].upper()
-        args = entry["args"]
-
-        # Validate IDs
-        if cmd.startswith("CREATE_") or cmd in ["TRANSLATE", "FILLET"]:
-            sid = args.get("id")
-            if not sid:
-                return False, f"Missing 'id' in {cmd}"
-            if cmd.startswith("CREATE_"):
-                if sid in ids:
-                    return False, f"Duplicate id '{sid}'"
-                ids.add(sid)
-                available_ids.add(sid)
-            else:
-                if sid not in available_ids:
-                    return False, f"Unknown id '{sid}' in {cmd}"
-
-        # Validate references
-        if cmd == "SUBTRACT":
-            if args.get("target") not in available_ids:
-                return False, f"Unknown target '{args.get('target')}'"
-            if args.get("tool") not in available_ids:
-                return False, f"Unknown tool '{args.get('tool')}'"
-
-        # Validate positive numbers
-        for key, val in args.items():
-            if isinstance(val, float) and val <= 0:
-                if key in ["width", "height", "depth", "radius"]:
-                    return False, f"{key} must be positive in {cmd}"
-
+        valid, msg = validate_command(entry, available_ids)
+        if valid:
+            valid, msg = check_command(entry, solids)
+        if not valid:
+            return False, msg
+    if not any(entry["cmd"].upper().startswith("CREATE_") for entry in commands):
+        return False, "No solid is created; start with CREATE_BOX or CREATE_CYLINDER"
+    if not any(entry["cmd"].upper() == "EXPORT" for entry in commands):
+        return False, "Missing EXPORT command"
     return True, "Valid DSL"
 
 # --------------------------
 # DSL -> CadQuery executor
 # --------------------------
-def execute_dsl(commands, output_dir="out"):
-    solids = {}
+def cut_all(target, tools):
+    """Cut every tool from target in a single multi-tool boolean."""
+    if len(tools) == 1:
+        return target.cut(tools[0])
+    compound = cq.Workplane("XY").newObject([val for tool in tools for val in tool.vals()])
+    return target.cut(compound)
+
+def pattern_solid(solid, cmd, args):
+    """Replace a solid by all instances of a pattern (or itself plus its mirror image)."""
+    shapes = solid.vals()
+    if cmd == "MIRROR":
+        plane = args["plane"].upper()
+        return solid.newObject(shapes + [shape.mirror(plane) for shape in shapes])
+    # Place every instance in one pushPoints pass; the copies share the source geometry
+    compound = cq.Compound.makeCompound(shapes)
+    return cq.Workplane("XY").pushPoints(pattern_offsets(cmd, args)).eachpoint(
+        lambda loc: compound.moved(loc), True
+    )
+
+def compile_dsl(commands):
+    """Compile a command list into a dependency DAG of solid operations.
+
+    Each node is {"cmd", "args", "inputs", "sid", "lines"}: `inputs` are the
+    indices of the nodes it consumes and `lines` the command indices it covers.
+    While compiling, consecutive TRANSLATEs of a solid are folded into one
+    offset, and SUBTRACTs on a target nothing else has read in between are
+    fused into one multi-tool cut.
+
+    Returns (nodes, root, export_args): root is the node of the exported part
+    (the first created solid, in its final state), or None without an EXPORT.
+    """
+    nodes = []
+    consumers = []
+    current = {}
     main_part = None
-    for entry in commands:
+
+    def add(entry, cmd, sid, inputs, line_no):
+        for i in inputs:
+            consumers[i] += 1
+        nodes.append({"cmd": cmd, "args": dict(entry["args"]), "inputs": inputs, "sid": sid, "lines": [line_no]})
+        consumers.append(0)
+        current[sid] = len(nodes) - 1
+
+    for line_no, entry in enumerate(commands):
         cmd = entry["cmd"].upper()
         args = entry["args"]
 
-        if cmd == "CREATE_BOX":
-            solids[args["id"]] = cq.Workplane("XY").box(
-                args["width"], args["height"], args["depth"]
-            )
-            if main_part is None:
-                main_part = args["id"]
-
-        elif cmd == "CREATE_CYLINDER":
-            solids[args["id"]] = cq.Workplane("XY").cylinder(
-                args["height"], args["radius"]
-            )
+        if cmd.startswith("CREATE_"):
+            add(entry, cmd, args["id"], [], line_no)
             if main_part is None:
                 main_part = args["id"]
 
         elif cmd == "TRANSLATE":
-            sid = args["id"]
-            x, y, z = float(args.get("x", 0)), float(args.get("y", 0)), float(args.get("z", 0))
-            solids[sid] = solids[sid].translate((x, y, z))
+            prev = current[args["id"]]
+            if nodes[prev]["cmd"] == "TRANSLATE" and consumers[prev] == 0:
+                # Fold into the previous offset: both are pure translations
+                for axis in ("x", "y", "z"):
+                    nodes[prev]["args"][axis] = float(nodes[prev]["args"].get(axis, 0)) + float(args.get(axis, 0))
+                nodes[prev]["lines"].append(line_no)
+                continue
+            add(entry, cmd, args["id"], [prev], line_no)
 
         elif cmd == "SUBTRACT":
-            target = solids[args["target"]]
-            tool = solids[args["tool"]]
-            solids[args["target"]] = target.cut(tool)
+            prev = current[args["target"]]
+            tool = current[args["tool"]]
+            if nodes[prev]["cmd"] == "SUBTRACT" and consumers[prev] == 0 and tool != prev:
+                nodes[prev]["inputs"].append(tool)
+                nodes[prev]["lines"].append(line_no)
+                consumers[tool] += 1
+                continue
+            add(entry, cmd, args["target"], [prev, tool], line_no)
 
-        elif cmd == "FILLET":
-            sid = args["id"]
-            solids[sid] = solids[sid].edges().fillet(args["radius"])
+        elif cmd == "FILLET" or cmd in PATTERN_COMMANDS:
+            add(entry, cmd, args["id"], [current[args["id"]]], line_no)
 
         elif cmd == "EXPORT":
-            os.makedirs(output_dir, exist_ok=True)
-            filename = args["filename"]
-            export_part = main_part if main_part else list(solids.keys())[-1]
-            exporters.export(solids[export_part], os.path.join(output_dir, filename))
-            return os.path.join(output_dir, filename)
+            root = current.get(main_part)
+            return nodes, root, (args if root is not None else None)
 
-    return None
+    return nodes, None, None
+
+def topological_order(nodes, root):
+    """Indices of the nodes `root` depends on (itself included), inputs first."""
+    order = []
+    visited = set()
+    stack = [(root, False)]
+    while stack:
+        idx, expanded = stack.pop()
+        if expanded:
+            order.append(idx)
+            continue
+        if idx in visited:
+            continue
+        visited.add(idx)
+        stack.append((idx, True))
+        for i in reversed(nodes[idx]["inputs"]):
+            if i not in visited:
+                stack.append((i, False))
+    return order
+
+def evaluate_node(node, inputs):
+    """Build the solid of one DAG node from the solids of its inputs."""
+    cmd = node["cmd"]
+    args = node["args"]
+
+    if cmd == "CREATE_BOX":
+        return cq.Workplane("XY").box(args["width"], args["height"], args["depth"])
+
+    if cmd == "CREATE_CYLINDER":
+        return cq.Workplane("XY").cylinder(args["height"], args["radius"])
+
+    if cmd == "TRANSLATE":
+        x, y, z = float(args.get("x", 0)), float(args.get("y", 0)), float(args.get("z", 0))
+        return inputs[0].translate((x, y, z))
+
+    if cmd == "SUBTRACT":
+        return cut_all(inputs[0], inputs[1:])
+
+    if cmd == "FILLET":
+        return inputs[0].edges().fillet(args["radius"])
+
+    if cmd in PATTERN_COMMANDS:
+        return pattern_solid(inputs[0], cmd, args)
+
+    raise ValueError(f"Unknown command '{cmd}'")
+
+SOLID_CACHE_SIZE = int(os.environ.get("CAD_AGENT_SOLID_CACHE_SIZE", "256"))
+# Processes building independent tool chains in parallel (parallel_build.py); 0/1: serial
+BUILD_WORKERS = int(os.environ.get("CAD_AGENT_BUILD_WORKERS", "0"))
+_solid_cache = OrderedDict()
+_solid_cache_lock = threading.Lock()
+
+def node_key(node, input_keys):
+    """Hash of a node's operation and arguments plus the keys of its inputs.
+
+    The solid's name is left out, so renaming an id does not invalidate it.
+    """
+    args = {k: v for k, v in node["args"].items() if k not in ("id", "target", "tool")}
+    h = hashlib.sha256(node["cmd"].encode())
+    h.update(repr(sorted(args.items())).encode())
+    for key in input_keys:
+        h.update(key.encode())
+    return h.hexdigest()
+
+def evaluate_node_cached(node, inputs, key):
+    """evaluate_node, memoized in a bounded in-memory LRU keyed by node_key."""
+    with _solid_cache_lock:
+        if key in _solid_cache:
+            _solid_cache.move_to_end(key)
+            return _solid_cache[key]
+    solid = evaluate_node(node, inputs)
+    with _solid_cache_lock:
+        _solid_cache[key] = solid
+        while len(_solid_cache) > SOLID_CACHE_SIZE:
+            _solid_cache.popitem(last=False)
+    return solid
+
+def clear_solid_cache():
+    """Drop all memoized solids, e.g. to time cold builds."""
+    with _solid_cache_lock:
+        _solid_cache.clear()
+
+def build_dsl(commands, memo=None):
+    """Build the exported solid in memory.
+
+    Only the operations the exported solid depends on are evaluated; skipped
+    commands are reported as a warning. `memo` is an optional private {node key:
+    solid} dict (e.g. of an edit session) consulted before the shared LRU and
+    left holding exactly this build's solids. Returns (part, export_args), or
+    (None, None) when there is nothing to export.
+    """
+    nodes, root, export = compile_dsl(commands)
+    if root is None:
+        return None, None
+
+    order = topological_order(nodes, root)
+    reachable = set(order)
+    dropped = [
+        line_no
+        for idx, node in enumerate(nodes) if idx not in reachable
+        for line_no in node["lines"]
+    ]
+    if dropped:
+        skipped = ", ".join(
+            f"{commands[i]['cmd']} {commands[i]['args'].get('id', commands[i]['args'].get('target'))}"
+            for i in sorted(dropped)
+        )
+        print(f"⚠️ Skipped {len(dropped)} command(s) that do not reach the exported part: {skipped}")
+
+    # Memoized per node: after a small edit only the nodes downstream of it are rebuilt
+    solids = {}
+    keys = {}
+    for idx in order:
+        node = nodes[idx]
+        keys[idx] = node_key(node, [keys[i] for i in node["inputs"]])
+        with span("cad.node", cmd=node["cmd"], sid=node["sid"], lines=node["lines"]) as s:
+            if memo is not None and keys[idx] in memo:
+                s["cached"] = True
+                solids[idx] = memo[keys[idx]]
+                continue
+            s["cached"] = keys[idx] in _solid_cache
+            solids[idx] = evaluate_node_cached(node, [solids[i] for i in node["inputs"]], keys[idx])
+    if memo is not None:
+        memo.clear()
+        memo.update((keys[idx], solids[idx]) for idx in order)
+    return solids[root], export
+
+def execute_dsl(commands, output_dir="out", return_part=False, memo=None):
+    """Build the exported part and write it to output_dir (see part_export).
+
+    Returns the path of the file in the EXPORT's format (None if there is no
+    EXPORT), or (path, part) with return_part so callers such as the preview can
+    reuse the in-memory solid. The other formats are written next to it.
+    `memo` is passed to build_dsl; builds with a memo stay serial.
+    """
+    with span("cad.build", commands=len(commands)):
+        if memo is not None:
+            part, export = build_dsl(commands, memo=memo)
+        elif BUILD_WORKERS > 1:
+            from parallel_build import build_dsl_parallel
+
+            part, export = build_dsl_parallel(commands, BUILD_WORKERS)
+        else:
+            part, export = build_dsl(commands)
+    path = None
+    if part is not None:
+        paths = export_part(part, commands, export["filename"], output_dir)
+        path = next(iter(paths.values()))  # the EXPORT's own format comes first
+    return (path, part) if return_part else path
 
 # --------------------------
 # NL -> DSL via LLM
 # --------------------------
-def nl_to_dsl(user_prompt):
-    system_prompt = """
+SYSTEM_PROMPT = """
     You are a CAD design assistant.
     You receive a natural language request describing a simple 3D part.
     You must output ONLY valid DSL commands, EXACTLY following this grammar:
@@ -130,6 +361,10 @@ def nl_to_dsl(user_prompt):
     TRANSLATE id=<id> x=<float> y=<float> z=<float>
     SUBTRACT target=<id> tool=<id>
     FILLET id=<id> radius=<float>
+    LINEAR_PATTERN id=<id> count=<int> dx=<float> dy=<float> dz=<float>
+    GRID_PATTERN id=<id> nx=<int> ny=<int> dx=<float> dy=<float>
+    POLAR_PATTERN id=<id> count=<int> radius=<float>
+    MIRROR id=<id> plane=<XY|YZ|XZ>
     EXPORT filename="<filename>"
 
     Rules:
@@ -139,101 +374,259 @@ def nl_to_dsl(user_prompt):
     - All dimensions are in millimeters.
     - Cylinder height should be larger than the part depth when creating holes.
     - When positioning holes or cylinders, use TRANSLATE with x, y, z offsets.
-    - For multiple subtractions, each hole must be a separate CREATE + TRANSLATE + SUBTRACT sequence.
+    - For repeated features (several equal holes), create ONE solid and copy it with a pattern, then SUBTRACT it once.
+    - LINEAR_PATTERN and GRID_PATTERN copies are centered on the solid's current position; dx, dy, dz are the spacings.
+    - POLAR_PATTERN places count copies on a circle of the given radius around the solid's current position.
+    - MIRROR adds a mirrored copy of the solid across a plane through the origin.
     - The final command must always be EXPORT with a descriptive filename.
     - Do NOT include any comments, explanations, or extra text.
     - Output ONLY the DSL commands.
+    """
 
-    Examples:
-
-    User: Make a 30x20x10 box.
-    Assistant:
-    CREATE_BOX id=box1 width=30 height=20 depth=10
-    EXPORT filename="box1.step"
-
-    User: Make a 40x20x5 plate with a centered hole of radius 3.
-    Assistant:
-    CREATE_BOX id=plate width=40 height=20 depth=5
-    CREATE_CYLINDER id=hole1 radius=3 height=10
-    SUBTRACT target=plate tool=hole1
-    EXPORT filename="plate_with_hole.step"
-
-    User: Make a block 60x30x15 mm with two holes of radius 5 mm spaced 40 mm apart.
-    Assistant:
-    CREATE_BOX id=block width=60 height=30 depth=15
-    CREATE_CYLINDER id=hole1 radius=5 height=20
-    TRANSLATE id=hole1 x=-20 y=0 z=0
-    CREATE_CYLINDER id=hole2 radius=5 height=20
-    TRANSLATE id=hole2 x=20 y=0 z=0
-    SUBTRACT target=block tool=hole1
-    SUBTRACT target=block tool=hole2
-    EXPORT filename="block_with_holes.step"
-
-    User: Create a 50x50x10 square plate with four corner holes, radius 4mm, inset 8mm from edges.
-    Assistant:
-    CREATE_BOX id=plate width=50 height=50 depth=10
-    CREATE_CYLINDER id=hole1 radius=4 height=15
-    TRANSLATE id=hole1 x=-17 y=-17 z=0
-    CREATE_CYLINDER id=hole2 radius=4 height=15
-    TRANSLATE id=hole2 x=17 y=-17 z=0
-    CREATE_CYLINDER id=hole3 radius=4 height=15
-    TRANSLATE id=hole3 x=-17 y=17 z=0
-    CREATE_CYLINDER id=hole4 radius=4 height=15
-    TRANSLATE id=hole4 x=17 y=17 z=0
-    SUBTRACT target=plate tool=hole1
-    SUBTRACT target=plate tool=hole2
-    SUBTRACT target=plate tool=hole3
-    SUBTRACT target=plate tool=hole4
-    EXPORT filename="plate_corner_holes.step"
-
-    User: Make a cylinder radius 10 mm and height 30 mm with rounded edges.
-    Assistant:
-    CREATE_CYLINDER id=cyl1 radius=10 height=30
-    FILLET id=cyl1 radius=2
-    EXPORT filename="rounded_cylinder.step"
-
-    User: Create a 100x50x20 base with a 30x30x40 tower centered on top.
-    Assistant:
-    CREATE_BOX id=base width=100 height=50 depth=20
-    CREATE_BOX id=tower width=30 height=30 depth=40
-    TRANSLATE id=tower x=0 y=0 z=30
-    EXPORT filename="base_with_tower.step"
-
-    User: Make a 80x40x12 plate with a slot 50mm long, 8mm wide through the center.
-    Assistant:
-    CREATE_BOX id=plate width=80 height=40 depth=12
-    CREATE_BOX id=slot width=50 height=8 depth=20
-    SUBTRACT target=plate tool=slot
-    EXPORT filename="plate_with_slot.step"
-
-    Now respond to the user's request with ONLY DSL commands.
+def build_prompt(user_prompt, accepted_lines=(), examples_for=None):
+    """SYSTEM_PROMPT, the few-shot examples most relevant to the request and the
+    request itself. Only SYSTEM_PROMPT is fixed, so it is the cached KV prefix.
+    `examples_for` is the text used for retrieval (default: the request).
     """
-    prompt = system_prompt + "\nUser: " + user_prompt + "\nAssistant:\n"
-    output = llm(prompt, max_tokens=300, stop=["User:", "\n\n"])
-    return output["choices"][0]["text"].strip()
+    examples = select_examples(examples_for or user_prompt)
+    prompt = SYSTEM_PROMPT + "\nExamples:\n\n" + format_examples(examples)
+    prompt += "Now respond to the user's request with ONLY DSL commands.\n"
+    prompt += "\nUser: " + user_prompt + "\nAssistant:\n"
+    return prompt + "".join(line + "\n" for line in accepted_lines)
+
+def nl_to_dsl(user_prompt, use_grammar=True):
+    """Ask the LLM for DSL. With use_grammar, sampling is constrained by DSL_GBNF
+    so every emitted line is a syntactically valid command ending in EXPORT.
+    """
+    prompt = build_prompt(user_prompt)
+    gbnf = DSL_GBNF if use_grammar else None
+    output = complete(prompt, prefix=SYSTEM_PROMPT, gbnf=gbnf, max_tokens=300, stop=["User:", "\n\n"])
+    return output.strip()
+
+def _new_line_state():
+    """Ids, tracked geometry and repair renames of the lines accepted so far."""
+    return {"ids": set(), "solids": {}, "repair": new_repair_state()}
+
+def _accept_line(line, lines, state):
+    """Parse, repair and validate one finished DSL line, including the geometry
+    checks; append it (in repaired form) to `lines` if valid.
+
+    Returns None on success (or for blank and dropped lines), otherwise the
+    validation error.
+    """
+    line = line.strip()
+    commands = parse_dsl(line)
+    if not commands:
+        return None
+    entry = repair_command(commands[0], state["repair"])
+    if entry is None:
+        return None
+    valid, msg = validate_command(entry, state["ids"])
+    if valid:
+        valid, msg = check_command(entry, state["solids"])
+    if not valid:
+        return f"{msg} (line: '{line}')"
+    lines.append(format_command(entry))
+    return None
+
+def nl_to_dsl_streaming(user_prompt, accepted_lines=(), use_grammar=True, on_token=None, examples_for=None):
+    """Stream DSL from the LLM, validating each line as soon as it is complete.
+
+    Mechanical faults are repaired locally (dsl_repair) as lines arrive;
+    generation stops at the first line that stays invalid. `accepted_lines` are placed in
+    the assistant turn so the model resumes after them instead of starting over.
+    `on_token` is called with every generated text piece.
+    `examples_for` overrides the text few-shot examples are retrieved for.
+
+    Returns (lines, error): all valid lines so far and the first error, or None.
+    A completion cut off by max_tokens before EXPORT is an error; its last,
+    possibly partial line is dropped so the retry resumes after the complete ones.
+    """
+    lines = []
+    state = _new_line_state()
+    for line in accepted_lines:
+        _accept_line(line, lines, state)
+
+    prompt = build_prompt(user_prompt, accepted_lines=lines, examples_for=examples_for)
+    gbnf = DSL_GBNF if use_grammar else None
+    finish = {}
+    stream = stream_completion(prompt, prefix=SYSTEM_PROMPT, gbnf=gbnf, finish=finish, max_tokens=300,
+                               stop=["User:", "\n\n"])
+
+    buffer = ""
+    try:
+        for text in stream:
+            if on_token:
+                on_token(text)
+            buffer += text
+            while "\n" in buffer:
+                line, buffer = buffer.split("\n", 1)
+                error = _accept_line(line, lines, state)
+                if error:
+                    return lines, error
+                if lines and lines[-1].upper().startswith("EXPORT"):
+                    return lines, None
+        if finish.get("reason") == "length":
+            return lines, f"The output was cut off after {len(lines)} lines, before EXPORT"
+        return lines, _accept_line(buffer, lines, state)
+    finally:
+        # Closing the generator stops llama.cpp from decoding any further tokens
+        stream.close()
+        if state["repair"]["changes"]:
+            print("🔧 Repaired:", "; ".join(state["repair"]["changes"]))
+            count("cad_agent_repairs_total", len(state["repair"]["changes"]))
 
 # --------------------------
 # Full pipeline with validation & feedback
 # --------------------------
-def generate_part_from_text(user_prompt, output_dir="out", max_attempts=2):
+# Programs sampled at once for the first attempt; needs n_parallel > 1 to run in parallel
+N_CANDIDATES = int(os.environ.get("CAD_AGENT_CANDIDATES", "1"))
+
+def first_valid_candidate(user_prompt, k):
+    """Sample k programs together and return the first to finish that validates
+    (after local repair) as (dsl, None), or (None, last error) if none does.
+    """
+    prompt = build_prompt(user_prompt)
+    msg = "no candidate produced DSL"
+    candidates = complete_candidates(prompt, k, prefix=SYSTEM_PROMPT, gbnf=DSL_GBNF, max_tokens=300, stop=["User:", "\n\n"])
+    try:
+        for i, text in enumerate(candidates):
+            repaired, changes = repair_dsl(parse_dsl(text))
+            valid, msg = validate_dsl(repaired)
+            if not any(e["cmd"].upper() == "EXPORT" for e in parse_dsl(text)):
+                # the grammar ends every finished program with EXPORT: this one was cut off
+                valid, msg = False, "The output was cut off before EXPORT"
+            if valid:
+                print(f"🎯 Candidate {i + 1}/{k} is valid")
+                count("cad_agent_repairs_total", len(changes))
+                return format_dsl(repaired), None
+            print(f"⚠️ Candidate {i + 1}/{k}: {msg}")
+    finally:
+        # Stops decoding the candidates that have not finished yet
+        candidates.close()
+    return None, msg
+
+def generate_dsl(user_prompt, max_attempts=2, on_token=None, candidates=N_CANDIDATES):
+    """Generate validated DSL text for a prompt, retrying with error feedback.
+
+    `on_token` receives the generated text as it streams, plus a comment line
+    announcing each retry. With `candidates` > 1 the first attempt samples that
+    many programs at once and keeps the first valid one (streamed to `on_token`
+    when done). Returns the DSL text, or None if no attempt produced a valid program.
+    """
+    accepted_lines = []
+    request = user_prompt
+    if candidates > 1:
+        print(f"\n💡 Sampling {candidates} candidates: '{user_prompt}'")
+        with span("nl_to_dsl.candidates", k=candidates) as s:
+            dsl, msg = first_valid_candidate(user_prompt, candidates)
+            s["ok"] = dsl is not None
+        if dsl is not None:
+            if on_token:
+                on_token(dsl + "\n")
+            return dsl
+        count("cad_agent_validation_failures_total", reason=reason_label(msg))
+        event("dsl.validation_failed", attempt=0, reason=msg)
+        user_prompt = f"{user_prompt}. Fix the following issue: {msg}"
+        max_attempts -= 1
     for attempt in range(max_attempts):
         print(f"\n💡 Attempt {attempt+1}: '{user_prompt}'")
-        dsl = nl_to_dsl(user_prompt)
+        if on_token and attempt:
+            on_token(f"\n# retrying after: {msg}\n" + "".join(line + "\n" for line in accepted_lines))
+        if attempt:
+            count("cad_agent_dsl_retries_total")
+        with span("nl_to_dsl", attempt=attempt + 1, resumed_lines=len(accepted_lines)) as s:
+            lines, error = nl_to_dsl_streaming(
+                user_prompt, accepted_lines=accepted_lines, on_token=on_token, examples_for=request
+            )
+            s["lines"] = len(lines)
+        dsl = "\n".join(lines)
         print("📝 Generated DSL:\n", dsl)
-        cmds = parse_dsl(dsl)
-        valid, msg = validate_dsl(cmds)
+        with span("dsl.validate") as s:
+            valid, msg = (False, error) if error else validate_dsl(parse_dsl(dsl))
+            s["ok"] = valid
         if valid:
-            step_file = execute_dsl(cmds, output_dir=output_dir)
-            print("✅ STEP file created at:", step_file)
-            return step_file
-        else:
-            print("⚠️ DSL Validation Error:", msg)
-            # Optionally, modify user_prompt to include error and retry
-            user_prompt = f"{user_prompt}. Fix the following issue: {msg}"
-
-    print("❌ Failed to generate valid CAD after retries")
+            return dsl
+        if not error:
+            # Whole-program faults (e.g. no EXPORT) are fixed locally before asking the LLM again
+            with span("dsl.repair") as s:
+                repaired, changes = repair_dsl(parse_dsl(dsl))
+                s["changes"] = changes
+            count("cad_agent_repairs_total", len(changes))
+            if changes and validate_dsl(repaired)[0]:
+                print("🔧 Repaired:", "; ".join(changes))
+                return format_dsl(repaired)
+        print("⚠️ DSL Validation Error:", msg)
+        count("cad_agent_validation_failures_total", reason=reason_label(msg))
+        event("dsl.validation_failed", attempt=attempt + 1, reason=msg)
+        # Retry from the last valid line, with the error added to the request
+        accepted_lines = lines
+        user_prompt = f"{user_prompt}. Fix the following issue: {msg}"
     return None
 
+def execute_dsl_cached(commands, output_dir="out", return_part=False):
+    """execute_dsl, skipped when an equivalent program was exported before,
+    to output_dir or to the result cache.
+
+    On a hit no solid is built, so the returned part is None.
+    """
+    filename = next(e["args"].get("filename") for e in commands if e["cmd"].upper() == "EXPORT")
+    path = find_export(commands, filename, output_dir)
+    files = get_cached_export(commands) if path is None else None
+    if files is not None:
+        path = store_export(commands, filename, output_dir, files)
+    if path is not None:
+        return (path, None) if return_part else path
+    path, part = execute_dsl(commands, output_dir=output_dir, return_part=True)
+    if path:
+        # the STEP travels with any other format, so a cache hit can still be previewed
+        files = {}
+        for export in dict.fromkeys([path, step_export(path)]):
+            if export:
+                with open(export, "rb") as f:
+                    files[file_format(export)] = f.read()
+        put_cached_export(commands, files)
+    return (path, part) if return_part else path
+
+def prompt_to_dsl(user_prompt, max_attempts=2, use_cache=True, on_token=None, candidates=N_CANDIDATES):
+    """generate_dsl behind the prompt -> DSL level of the result cache."""
+    template = SYSTEM_PROMPT + format_examples(SEED_EXAMPLES) + DSL_GBNF
+    model_id = current_model_id() if use_cache else None
+    dsl = get_cached_dsl(user_prompt, model_id, template) if use_cache else None
+    count("cad_agent_dsl_cache_total", result="hit" if dsl is not None else "miss")
+    if dsl is not None:
+        print("♻️ Cached DSL:\n", dsl)
+        return dsl
+    dsl = generate_dsl(user_prompt, max_attempts=max_attempts, on_token=on_token, candidates=candidates)
+    if dsl is not None and use_cache:
+        put_cached_dsl(user_prompt, model_id, template, dsl)
+    return dsl
+
+def generate_part_from_text(user_prompt, output_dir="out", max_attempts=2, use_cache=True, return_part=False,
+                            candidates=N_CANDIDATES):
+    """Prompt -> STEP file path. With return_part, returns (path, part); part is
+    the in-memory solid, or None when the export came from the result cache.
+    `candidates` > 1 samples that many programs at once instead of retrying serially.
+    """
+    with span("pipeline") as trace:
+        dsl = prompt_to_dsl(user_prompt, max_attempts=max_attempts, use_cache=use_cache, candidates=candidates)
+        if dsl is None:
+            print("❌ Failed to generate valid CAD after retries")
+            count("cad_agent_requests_total", status="llm_failed")
+            return (None, None) if return_part else None
+
+        with span("dsl.parse"):
+            cmds = parse_dsl(dsl)
+        execute = execute_dsl_cached if use_cache else execute_dsl
+        step_file, part = execute(cmds, output_dir, return_part=True)
+        trace["status"] = "ok" if step_file else "no_export"
+    count("cad_agent_requests_total", status="ok" if step_file else "no_export")
+    if step_file:
+        add_example(user_prompt, dsl)
+    print("✅ STEP file created at:", step_file)
+    print("📊 Cache:", cache_stats())
+    return (step_file, part) if return_part else step_file
+
 # --------------------------
 # Test
 # --------------------------
@@ -7,10 +7,27 @@ import sys
 import os
 from OCC.Core.STEPControl import STEPControl_Reader
 from OCC.Core.IFSelect import IFSelect_RetDone
+from OCC.Core.BinTools import bintools
+from OCC.Core.TopoDS import TopoDS_Shape
 from OCC.Display.SimpleGui import init_display
 
+# The BREP cache is the one shape_cache.py keeps for the pipeline
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from part_export import atomic_write
+from shape_cache import evict, shape_cache_dir, step_digest
+
+def cached_brep_path(filename):
+    """Binary BREP cache entry for a STEP file, shared with shape_cache.py"""
+    return os.path.join(shape_cache_dir(filename), step_digest(filename) + ".brep")
+
 def load_step_file(filename):
-    """Load a STEP file and return the shape"""
+    """Load a STEP file and return the shape, reusing the cached binary BREP if present"""
+    brep_file = cached_brep_path(filename)
+    if os.path.exists(brep_file):
+        shape = TopoDS_Shape()
+        if bintools.Read(shape, brep_file):
+            return shape
+
     # Create a STEP reader
     step_reader = STEPControl_Reader()
 
@@ -24,6 +41,11 @@ def load_step_file(filename):
     step_reader.TransferRoot()
     shape = step_reader.Shape()
 
+    # Store the native binary BREP so the next run skips STEP parsing
+    os.makedirs(os.path.dirname(brep_file), exist_ok=True)
+    atomic_write(brep_file, lambda tmp: bintools.Write(shape, tmp))
+    evict(os.path.dirname(brep_file))
+
     return shape
 
 def main():
@@ -0,0 +1,158 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import cadquery as cq
+
+from natural_languange_to_CAD import (
+    _solid_cache,
+    _solid_cache_lock,
+    build_dsl,
+    compile_dsl,
+    evaluate_node_cached,
+    node_key,
+    topological_order,
+)
+from tracing import span
+
+# --------------------------
+# Parallel DSL evaluation
+# --------------------------
+# The tools of a SUBTRACT (hole1..holeN, a slot, a pattern) are built from
+# independent CREATE/TRANSLATE/pattern chains. Those chains are split into one
+# group per worker and built in a process pool; each worker merges its tools
+# into one compound and sends it back as binary BREP bytes. The parent then
+# runs the cut and everything else on the exported part's own chain.
+# Small parts are built serially: below PARALLEL_MIN_NODES the transfer costs more.
+PARALLEL_MIN_NODES = int(os.environ.get("CAD_AGENT_PARALLEL_MIN_NODES", "64"))
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_build_pool(workers):
+    """Process pool for tool chains, started on first use."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            # spawn, not fork: OpenCascade and llama.cpp threads may be running
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+    return _pool
+
+
+def to_brep(shape):
+    buffer = io.BytesIO()
+    shape.exportBin(buffer)
+    return buffer.getvalue()
+
+
+def from_brep(data):
+    return cq.Shape.importBin(io.BytesIO(data))
+
+
+def build_group(nodes, outputs):
+    """Worker side: build `nodes` ([(idx, node, key)], inputs first) and return the
+    solids of `outputs` merged into one compound, as BREP bytes.
+    """
+    solids = {}
+    for idx, node, key in nodes:
+        solids[idx] = evaluate_node_cached(node, [solids[i] for i in node["inputs"]], key)
+    shapes = [val for idx in outputs for val in solids[idx].vals()]
+    return to_brep(cq.Compound.makeCompound(shapes))
+
+
+def _memoized(key):
+    with _solid_cache_lock:
+        return _solid_cache.get(key)
+
+
+def _spine(nodes, root, keys):
+    """Nodes on the exported part's own chain (built in the parent) and, per
+    SUBTRACT on it, the tool inputs to build in workers. Memoized nodes end the walk.
+    """
+    spine = set()
+    cuts = {}
+    stack = [root]
+    while stack:
+        idx = stack.pop()
+        if idx in spine:
+            continue
+        spine.add(idx)
+        node = nodes[idx]
+        if keys[idx] in _solid_cache:
+            continue
+        if node["cmd"] == "SUBTRACT":
+            stack.append(node["inputs"][0])
+            cuts[idx] = node["inputs"][1:]
+        else:
+            stack.extend(node["inputs"])
+    return spine, cuts
+
+
+def build_dsl_parallel(commands, workers):
+    """build_dsl with the tool chains of every SUBTRACT built across `workers` processes.
+
+    The solids are the same as build_dsl's: tools reach the cut as the same list of
+    shapes, only built elsewhere. Falls back to build_dsl for small parts, a single
+    worker, or when already running inside a worker process, which covers every
+    build of the Gradio app and batch_generate.py: only in-process callers get here.
+    """
+    if workers <= 1 or multiprocessing.parent_process() is not None:
+        return build_dsl(commands)
+    nodes, root, export = compile_dsl(commands)
+    if root is None:
+        return None, None
+
+    order = topological_order(nodes, root)
+    keys = {}
+    for idx in order:
+        keys[idx] = node_key(nodes[idx], [keys[i] for i in nodes[idx]["inputs"]])
+    spine, cuts = _spine(nodes, root, keys)
+    tool_nodes = {idx for tools in cuts.values() for t in tools for idx in topological_order(nodes, t)}
+    if len(tool_nodes - spine) < PARALLEL_MIN_NODES:
+        return build_dsl(commands)
+
+    pool = get_build_pool(workers)
+    jobs = {}
+    with span("cad.parallel", workers=workers) as s:
+        for cut, tools in cuts.items():
+            # one group per worker, in order, so the tools keep their sequence
+            size = -(-len(tools) // workers)
+            for start in range(0, len(tools), size):
+                group = tools[start:start + size]
+                group_order, seen = [], set()
+                for t in group:
+                    new = [i for i in topological_order(nodes, t) if i not in seen]
+                    group_order += new
+                    seen.update(new)
+                payload = [(i, nodes[i], keys[i]) for i in group_order]
+                jobs.setdefault(cut, []).append(pool.submit(build_group, payload, group))
+        s["jobs"] = sum(len(futures) for futures in jobs.values())
+
+        solids = {}
+        for idx in order:
+            if idx not in spine:
+                continue
+            node = nodes[idx]
+            solid = _memoized(keys[idx])
+            if solid is not None:
+                solids[idx] = solid
+                continue
+            needed = node["inputs"][:1] if idx in cuts else node["inputs"]
+            if any(i not in solids for i in needed):
+                # memoized when planned, evicted since by another build
+                return build_dsl(commands)
+            if idx in jobs:
+                tools = [cq.Workplane("XY").newObject(list(from_brep(f.result()))) for f in jobs[idx]]
+                inputs = [solids[node["inputs"][0]]] + tools
+            else:
+                inputs = [solids[i] for i in node["inputs"]]
+            with span("cad.node", cmd=node["cmd"], sid=node["sid"], lines=node["lines"], cached=False):
+                solids[idx] = evaluate_node_cached(node, inputs, keys[idx])
+    return solids[root], export
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cadquery import exporters
+
+from dsl_spec import canonical_dsl
+from preview_mesh import DEFAULT_LOD, as_shape, mesh_to_glb, tessellate
+from tracing import count, span
+
+# --------------------------
+# Content-addressed export
+# --------------------------
+# Every part is written once per output_dir, under the hash of its canonical
+# program (ids, number formatting and the EXPORT filename do not matter):
+#   <output_dir>/parts/<digest>/part.step|part.stl|part.glb   the content
+#   <output_dir>/parts/<digest>/<name>.<ext>                  aliases named after the EXPORT filename
+# Files appear atomically (temp file + rename), so concurrent requests for the
+# same part never see half-written output and different parts never share a path.
+# The STL is meshed at cadquery's export tolerances (relative linear deflection
+# per edge, angular deflection in rad), the GLB at EXPORT_LOD, so the preview at
+# that detail is the exported GLB. Both meshings change the shape's triangulation
+# and run one after the other; the STEP writer runs concurrently on a copy.
+EXPORT_FORMATS = [f.strip().lower() for f in os.environ.get("CAD_AGENT_EXPORT_FORMATS", "step,stl,glb").split(",")
+                  if f.strip()]
+EXPORT_LOD = os.environ.get("CAD_AGENT_EXPORT_LOD", DEFAULT_LOD)
+STL_TOLERANCE = float(os.environ.get("CAD_AGENT_STL_TOLERANCE", "0.1"))
+STL_ANGULAR_TOLERANCE = float(os.environ.get("CAD_AGENT_STL_ANGULAR_TOLERANCE", "0.1"))
+PARTS_DIR = "parts"
+FORMAT_ALIASES = {"stp": "step"}
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("CAD_AGENT_EXPORT_THREADS", "4")))
+_dir_locks = {}
+_dir_locks_lock = threading.Lock()
+
+
+def part_digest(commands):
+    """Hash of the geometry a program builds; EXPORT lines are left out."""
+    geometry = [entry for entry in commands if entry["cmd"].upper() != "EXPORT"]
+    return hashlib.sha256(canonical_dsl(geometry).encode("utf-8")).hexdigest()[:16]
+
+
+def part_dir(commands, output_dir):
+    return os.path.join(output_dir, PARTS_DIR, part_digest(commands))
+
+
+def file_format(filename):
+    ext = os.path.splitext(filename)[1].lower().lstrip(".")
+    return FORMAT_ALIASES.get(ext, ext)
+
+
+def atomic_write(path, write):
+    """Create `path` with `write(tmp_path)`; readers see the old file or the whole new one."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _write_bytes(data):
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            f.write(data)
+
+    return write
+
+
+def _link(content, alias):
+    """Point `alias` at `content`: a hard link, or a copy where links are not supported."""
+    if os.path.exists(alias) and os.path.samefile(content, alias):
+        return
+
+    def write(tmp):
+        try:
+            os.link(content, tmp)
+        except OSError:
+            shutil.copyfile(content, tmp)
+
+    atomic_write(alias, write)
+
+
+def _dir_lock(directory):
+    with _dir_locks_lock:
+        return _dir_locks.setdefault(directory, threading.Lock())
+
+
+def _aliases(directory, filename, formats):
+    """Link `filename`'s stem to the content of `formats`; returns {format: alias path}."""
+    requested = file_format(filename)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    paths = {}
+    for fmt in formats:
+        content = os.path.join(directory, "part." + fmt)
+        if os.path.exists(content):
+            ext = os.path.splitext(filename)[1] if fmt == requested else "." + fmt
+            paths[fmt] = os.path.join(directory, stem + ext)
+            _link(content, paths[fmt])
+    return paths
+
+
+def find_export(commands, filename, output_dir):
+    """Path of an earlier export of the same part in `filename`'s format, or None."""
+    directory = part_dir(commands, output_dir)
+    if not os.path.exists(os.path.join(directory, "part." + file_format(filename))):
+        return None
+    return _aliases(directory, filename, [file_format(filename)] + EXPORT_FORMATS)[file_format(filename)]
+
+
+def store_export(commands, filename, output_dir, files):
+    """Write already exported {format: bytes} (e.g. from the result cache) into the
+    layout; returns the alias in `filename`'s format.
+    """
+    directory = part_dir(commands, output_dir)
+    os.makedirs(directory, exist_ok=True)
+    for fmt, data in files.items():
+        content = os.path.join(directory, "part." + fmt)
+        if not os.path.exists(content):
+            atomic_write(content, _write_bytes(data))
+    return _aliases(directory, filename, [file_format(filename)] + EXPORT_FORMATS)[file_format(filename)]
+
+
+def export_part(part, commands, filename, output_dir, formats=None):
+    """Write `part` in every format (EXPORT_FORMATS plus the one of `filename`).
+
+    Formats already on disk for this part are not written again. Returns
+    {format: alias path}, the EXPORT's format first; the aliases share `filename`'s stem.
+    """
+    formats = list(dict.fromkeys([file_format(filename)] + list(formats or EXPORT_FORMATS)))
+    directory = part_dir(commands, output_dir)
+    os.makedirs(directory, exist_ok=True)
+    content = {fmt: os.path.join(directory, "part." + fmt) for fmt in formats}
+    unknown = [fmt for fmt in formats if fmt not in ("step", "stl", "glb")]
+    if unknown:
+        raise ValueError(f"Unsupported export format(s): {', '.join(unknown)}")
+
+    # one writer per part in this process; other processes at worst write the same bytes again
+    with _dir_lock(directory):
+        missing = [fmt for fmt in formats if not os.path.exists(content[fmt])]
+        count("cad_agent_exports_total", result="written" if missing else "skipped")
+        if missing:
+            _write_formats(part, content, missing)
+    return _aliases(directory, filename, formats)
+
+
+def _write_meshes(part, content, missing):
+    """STL, then GLB: meshing the same shape from two threads at once is not safe.
+
+    The STL goes first so it never reuses a finer mesh; tessellate() clears the
+    shape's mesh before meshing at its own level of detail.
+    """
+    if "stl" in missing:
+        atomic_write(content["stl"], lambda tmp: exporters.export(
+            part, tmp, exportType="STL", tolerance=STL_TOLERANCE, angularTolerance=STL_ANGULAR_TOLERANCE))
+    if "glb" in missing:
+        positions, triangles = tessellate(part, lod=EXPORT_LOD)
+        atomic_write(content["glb"], _write_bytes(mesh_to_glb(positions, triangles)))
+
+
+def _write_formats(part, content, missing):
+    """Write the `missing` formats; the STEP writer runs concurrently with the meshing,
+    on a copy of the shape, since meshing modifies the shape it runs on.
+    """
+    with span("cad.export", formats=",".join(missing)) as s:
+        jobs = []
+        if "step" in missing:
+            step_part = as_shape(part).copy()
+            jobs.append(_executor.submit(
+                atomic_write, content["step"], lambda tmp: exporters.export(step_part, tmp, exportType="STEP")))
+        _write_meshes(part, content, missing)
+        for job in jobs:
+            job.result()
+        s["bytes"] = sum(os.path.getsize(content[fmt]) for fmt in missing)
+
+
+def step_export(path):
+    """The STEP file of the part exported at `path` (`path` itself or its .step alias), or None."""
+    if not path or file_format(path) == "step":
+        return path
+    step = os.path.splitext(path)[0] + ".step"
+    return step if os.path.exists(step) else None
+
+
+def export_files(path):
+    """The exported files next to `path` (its aliases in every format), `path` first."""
+    if not path:
+        return []
+    stem = os.path.splitext(path)[0]
+    others = [f"{stem}.{fmt}" for fmt in EXPORT_FORMATS if fmt != file_format(path)]
+    return [path] + [p for p in others if os.path.exists(p)]
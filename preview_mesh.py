@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import struct
+
+import cadquery as cq
+from OCP.BRepTools import BRepTools
+
+from tracing import span
+
+# --------------------------
+# Tessellation
+# --------------------------
+# Level of detail -> (linear tolerance as a fraction of the bounding-box diagonal, angular tolerance in rad)
+LOD_TOLERANCES = {
+    "low": (0.01, 0.5),
+    "medium": (0.002, 0.2),
+    "high": (0.0005, 0.1),
+}
+DEFAULT_LOD = os.environ.get("CAD_AGENT_PREVIEW_LOD", "medium")
+
+
+def as_shape(part):
+    """Single CadQuery Shape for a Workplane (all objects on its stack) or a Shape."""
+    if isinstance(part, cq.Workplane):
+        shapes = [val for val in part.vals() if isinstance(val, cq.Shape)]
+        return shapes[0] if len(shapes) == 1 else cq.Compound.makeCompound(shapes)
+    return part
+
+
+def tessellate(part, lod=DEFAULT_LOD, tolerance=None, angular_tolerance=None):
+    """Mesh a solid in memory. Explicit tolerances override the level of detail.
+
+    Returns (positions, triangles): a list of (x, y, z) tuples and a list of index triples.
+    """
+    shape = as_shape(part)
+    rel_tolerance, lod_angular = LOD_TOLERANCES[lod]
+    with span("preview.tessellate", lod=lod) as s:
+        if tolerance is None:
+            tolerance = rel_tolerance * max(shape.BoundingBox().DiagonalLength, 1e-6)
+        # Drop any mesh a previous preview left on this (possibly memoized) shape so the
+        # requested level of detail is honoured instead of reusing a coarser one
+        BRepTools.Clean_s(shape.wrapped)
+        vertices, triangles = shape.tessellate(tolerance, angular_tolerance or lod_angular)
+        s["triangles"] = len(triangles)
+    return [v.toTuple() for v in vertices], triangles
+
+
+# --------------------------
+# Binary glTF (GLB) writer
+# --------------------------
+def _pad(data, fill):
+    return data + fill * (-len(data) % 4)
+
+
+def mesh_to_glb(positions, triangles):
+    """Encode a triangle mesh as GLB with 16-bit quantized positions.
+
+    Positions are stored as unsigned shorts (KHR_mesh_quantization) and mapped
+    back to model units by the node's scale and translation; indices are 16-bit
+    when the vertex count allows. Normals are omitted, so viewers shade flat.
+    """
+    lo = [min(p[axis] for p in positions) for axis in range(3)]
+    hi = [max(p[axis] for p in positions) for axis in range(3)]
+    scale = [(h - l) / 65535 if h > l else 1.0 for l, h in zip(lo, hi)]
+
+    # 8-byte stride: vertex attributes must be 4-byte aligned
+    quantized = [tuple(round((p[axis] - lo[axis]) / scale[axis]) for axis in range(3)) for p in positions]
+    position_bytes = b"".join(struct.pack("<HHHxx", *q) for q in quantized)
+
+    flat = [i for tri in triangles for i in tri]
+    wide = len(positions) > 65535
+    index_bytes = _pad(struct.pack(f"<{len(flat)}{'I' if wide else 'H'}", *flat), b"\0")
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "cad_agent preview_mesh"},
+        "extensionsUsed": ["KHR_mesh_quantization"],
+        "extensionsRequired": ["KHR_mesh_quantization"],
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0, "translation": lo, "scale": scale}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": 1, "mode": 4}]}],
+        "buffers": [{"byteLength": len(position_bytes) + len(index_bytes)}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": 0, "byteLength": len(position_bytes), "byteStride": 8, "target": 34962},
+            {"buffer": 0, "byteOffset": len(position_bytes), "byteLength": len(index_bytes), "target": 34963},
+        ],
+        "accessors": [
+            {
+                "bufferView": 0,
+                "componentType": 5123,
+                "count": len(positions),
+                "type": "VEC3",
+                "min": [min(q[axis] for q in quantized) for axis in range(3)],
+                "max": [max(q[axis] for q in quantized) for axis in range(3)],
+            },
+            {
+                "bufferView": 1,
+                "componentType": 5125 if wide else 5123,
+                "count": len(flat),
+                "type": "SCALAR",
+            },
+        ],
+    }
+    json_chunk = _pad(json.dumps(gltf, separators=(",", ":")).encode("utf-8"), b" ")
+    bin_chunk = position_bytes + index_bytes
+    return b"".join(
+        [
+            struct.pack("<III", 0x46546C67, 2, 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)),
+            struct.pack("<II", len(json_chunk), 0x4E4F534A),
+            json_chunk,
+            struct.pack("<II", len(bin_chunk), 0x004E4942),
+            bin_chunk,
+        ]
+    )
+
+
+def write_preview(part, output_dir="out/preview", lod=DEFAULT_LOD, tolerance=None):
+    """Tessellate a solid and write it as a GLB named by its content hash.
+
+    Returns the file path, to be served as a file (e.g. by gr.Model3D).
+    """
+    positions, triangles = tessellate(part, lod=lod, tolerance=tolerance)
+    if not triangles:
+        return None
+    with span("preview.encode") as s:
+        glb = mesh_to_glb(positions, triangles)
+        s["bytes"] = len(glb)
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, hashlib.sha256(glb).hexdigest()[:16] + ".glb")
+    if not os.path.exists(path):
+        with open(path + ".tmp", "wb") as f:
+            f.write(glb)
+        os.replace(path + ".tmp", path)
+    return path
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import re
+import threading
+
+from dsl_spec import canonical_dsl
+from llm_provider import CACHE_DIR
+
+# --------------------------
+# Persistent two-level result cache
+# --------------------------
+# Level 1: normalized prompt + model + prompt template -> DSL text
+# Level 2: canonical DSL -> {format: bytes} of the export, with the STEP for previews
+RESULT_CACHE_DIR = os.environ.get("CAD_AGENT_RESULT_CACHE_DIR", os.path.join(CACHE_DIR, "results"))
+RESULT_CACHE_SIZE_MB = int(os.environ.get("CAD_AGENT_RESULT_CACHE_MB", "512"))
+
+STATS = {"dsl_hits": 0, "dsl_misses": 0, "step_hits": 0, "step_misses": 0}
+
+_cache = None
+_cache_lock = threading.Lock()
+_stats_lock = threading.Lock()  # Gradio and batch threads count concurrently
+
+
+def _get_cache():
+    """Open the on-disk LRU store on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from diskcache import Cache
+
+                _cache = Cache(
+                    RESULT_CACHE_DIR,
+                    size_limit=RESULT_CACHE_SIZE_MB * 1024 * 1024,
+                    eviction_policy="least-recently-used",
+                )
+    return _cache
+
+
+def _count(key):
+    with _stats_lock:
+        STATS[key] += 1
+
+
+def _hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def normalize_prompt(prompt):
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    prompt = re.sub(r"\s+", " ", prompt.lower())
+    prompt = re.sub(r"(?<=\d)\s*[x×]\s*(?=\d)", "x", prompt)  # "50 x 50" -> "50x50"
+    return prompt.strip(" .!?")
+
+
+def get_cached_dsl(prompt, model_id, template):
+    key = "dsl:" + _hash(normalize_prompt(prompt), model_id, template)
+    dsl = _get_cache().get(key)
+    _count("dsl_hits" if dsl is not None else "dsl_misses")
+    return dsl
+
+
+def put_cached_dsl(prompt, model_id, template, dsl):
+    _get_cache().set("dsl:" + _hash(normalize_prompt(prompt), model_id, template), dsl)
+
+
+def get_cached_export(commands):
+    """Return the exported files ({format: bytes}) for an equivalent command list, or None."""
+    files = _get_cache().get("export:" + _hash(canonical_dsl(commands)))
+    _count("step_hits" if files is not None else "step_misses")
+    return files
+
+
+def put_cached_export(commands, files):
+    _get_cache().set("export:" + _hash(canonical_dsl(commands)), files)
+
+
+def cache_stats():
+    """Hit/miss counters of both levels for this process."""
+    with _stats_lock:
+        return dict(STATS)
@@ -0,0 +1,116 @@
+import hashlib
+import os
+
+import cadquery as cq
+
+from part_export import PARTS_DIR, atomic_write
+from preview_mesh import DEFAULT_LOD, as_shape, mesh_to_glb, tessellate
+from tracing import count
+
+# --------------------------
+# Content-addressed BREP / mesh cache
+# --------------------------
+# One per output tree unless overridden: <output_dir>/.shape_cache/ for exports in
+# <output_dir>/parts/<digest>/ (see part_export), else next to the STEP file:
+#   <sha>.brep             native binary BREP of the STEP content
+#   <sha>-<detail>.glb     preview mesh at a level of detail or tolerance
+SHAPE_CACHE_DIR = os.environ.get("CAD_AGENT_SHAPE_CACHE_DIR")
+SHAPE_CACHE_MB = int(os.environ.get("CAD_AGENT_SHAPE_CACHE_MB", "256"))
+
+
+def shape_cache_dir(step_path):
+    if SHAPE_CACHE_DIR:
+        return SHAPE_CACHE_DIR
+    directory = os.path.dirname(os.path.abspath(step_path))
+    if os.path.basename(os.path.dirname(directory)) == PARTS_DIR:
+        directory = os.path.dirname(os.path.dirname(directory))
+    return os.path.join(directory, ".shape_cache")
+
+
+def step_digest(step_path):
+    """Hash of the STEP bytes; reading them is cheap next to parsing them."""
+    h = hashlib.sha256()
+    with open(step_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:32]
+
+
+def _hit(path):
+    """True if `path` is cached; refreshes its mtime, which eviction uses as last access."""
+    if os.path.exists(path):
+        os.utime(path)
+        return True
+    return False
+
+
+def _store(path, write):
+    """Write a cache entry atomically with `write(tmp_path)`, then enforce the size bound."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, write)
+    evict(os.path.dirname(path))
+
+
+def evict(cache_dir, limit_mb=SHAPE_CACHE_MB):
+    """Delete least recently used entries until the directory fits in `limit_mb`."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith((".brep", ".glb")):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_step_cached(step_path):
+    """Load a STEP file as a CadQuery Shape, from the binary BREP cache when possible."""
+    brep = os.path.join(shape_cache_dir(step_path), step_digest(step_path) + ".brep")
+    if _hit(brep):
+        count("cad_agent_shape_cache_total", kind="brep", result="hit")
+        return cq.Shape.importBin(brep)
+    count("cad_agent_shape_cache_total", kind="brep", result="miss")
+    shape = as_shape(cq.importers.importStep(step_path))
+    _store(brep, shape.exportBin)
+    return shape
+
+
+def store_shape(step_path, part):
+    """Seed the BREP cache for a freshly exported STEP file from the solid in memory,
+    so a later preview in another process does not re-parse the STEP file.
+    """
+    brep = os.path.join(shape_cache_dir(step_path), step_digest(step_path) + ".brep")
+    if not _hit(brep):
+        _store(brep, as_shape(part).exportBin)
+
+
+def preview_cached(step_path, lod=DEFAULT_LOD, tolerance=None):
+    """GLB preview of a STEP file; repeat calls skip STEP parsing and meshing.
+
+    Returns the path of the cached GLB, or None if the part has no faces.
+    """
+    detail = lod if tolerance is None else f"tol{tolerance:g}"
+    digest = step_digest(step_path)
+    glb = os.path.join(shape_cache_dir(step_path), f"{digest}-{detail}.glb")
+    if _hit(glb):
+        count("cad_agent_shape_cache_total", kind="glb", result="hit")
+        return glb
+    count("cad_agent_shape_cache_total", kind="glb", result="miss")
+    positions, triangles = tessellate(load_step_cached(step_path), lod=lod, tolerance=tolerance)
+    if not triangles:
+        return None
+    data = mesh_to_glb(positions, triangles)
+
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            f.write(data)
+
+    _store(glb, write)
+    return glb
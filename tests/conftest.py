@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path[:0] = [REPO_DIR, TESTS_DIR]
+
+# Keep test runs away from the user's caches and learned examples; must be set before import
+_scratch = tempfile.mkdtemp(prefix="cad_agent_tests_")
+os.environ.setdefault("CAD_AGENT_CACHE_DIR", os.path.join(_scratch, "cache"))
+os.environ.setdefault("CAD_AGENT_SHAPE_CACHE_DIR", os.path.join(_scratch, "shapes"))
+os.environ.setdefault("CAD_AGENT_EXAMPLES", os.path.join(_scratch, "examples.jsonl"))
+os.environ["CAD_AGENT_FEW_SHOT_LEARN"] = "0"
+
+
+@pytest.fixture
+def mock_llm(tmp_path):
+    """A scripted stand-in model (mock_llama.MockLlama); set `.responses`."""
+    import llm_provider
+    from mock_llama import MockLlama
+
+    model_file = tmp_path / "mock.gguf"
+    model_file.write_bytes(b"mock model")
+    mock = MockLlama(str(model_file))
+    llm_provider.set_llm(mock)
+    return mock
@@ -0,0 +1,61 @@
+"""Scripted stand-in for llama_cpp.Llama, shared by the tests and the LLM benchmark."""
+import numpy as np
+
+# A valid program for PROMPT: a plate with four holes
+GOOD = (
+    "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+    "CREATE_CYLINDER id=holes radius=4 height=15\n"
+    "GRID_PATTERN id=holes nx=2 ny=2 dx=34 dy=34\n"
+    "SUBTRACT target=plate tool=holes\n"
+    'EXPORT filename="plate.step"\n'
+)
+PROMPT = "Create a 50x50x10 square plate with four corner holes, radius 4mm, inset 8mm from edges."
+
+
+class MockLlama:
+    """Stand-in for llama_cpp.Llama: one token per 4 prompt bytes, scripted completions
+    streamed in 4-character chunks (cut off after max_tokens chunks); an exception in
+    `responses` is raised instead. `prompts` records every prompt.
+    """
+
+    def __init__(self, model_path, n_ctx=4096):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.responses = []
+        self.prompts = []
+        self.reset()
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return [sum(text[i:i + 4]) for i in range(0, len(text), 4)]
+
+    def reset(self):
+        self.input_ids = np.zeros(0, dtype=np.intc)
+
+    @property
+    def n_tokens(self):
+        return len(self.input_ids)
+
+    def eval(self, tokens):
+        self.input_ids = np.concatenate([self.input_ids, np.asarray(tokens, dtype=np.intc)])
+
+    def save_state(self):
+        return self.input_ids.copy()
+
+    def load_state(self, state):
+        self.input_ids = state.copy()
+
+    def __call__(self, prompt, grammar=None, stream=False, max_tokens=None, **kwargs):
+        self.reset()
+        self.prompts.append(prompt)
+        self.eval(self.tokenize(prompt.encode("utf-8")))
+        text = self.responses.pop(0) if self.responses else ""
+        if isinstance(text, Exception):
+            raise text
+        chunks = [text[i:i + 4] for i in range(0, len(text), 4)]
+        reason = "length" if max_tokens and len(chunks) > max_tokens else "stop"
+        chunks = chunks[:max_tokens] if max_tokens else chunks
+        return ({"choices": [{"text": chunk, "finish_reason": reason if i == len(chunks) - 1 else None}]}
+                for i, chunk in enumerate(chunks))
@@ -0,0 +1,57 @@
+import json
+import os
+
+import tracing
+from batch_generate import run_batch, run_cad_stage
+from mock_llama import GOOD, PROMPT
+
+
+def test_run_batch_builds_decoded_items(tmp_path, mock_llm):
+    mock_llm.responses = [GOOD]
+    results = tmp_path / "results.jsonl"
+
+    ok = run_batch([("item1", PROMPT)], str(results), output_dir=str(tmp_path / "parts"), cad_workers=1,
+                   use_cache=False)
+
+    records = [json.loads(line) for line in results.read_text().splitlines()]
+    assert ok == 1
+    assert records[0]["id"] == "item1" and records[0]["status"] == "ok"
+    assert records[0]["step_file"].startswith(str(tmp_path / "parts" / "item1"))
+
+
+def test_cad_stage_without_exported_part_is_not_ok(tmp_path):
+    # valid, but the EXPORT comes before the part exists
+    dsl = 'EXPORT filename="part.step"\nCREATE_BOX id=plate width=10 height=10 depth=2'
+
+    result = run_cad_stage(dsl, str(tmp_path))
+
+    assert result["status"] == "no_export"
+
+
+def test_run_batch_reports_llm_errors_per_item(tmp_path, mock_llm):
+    mock_llm.responses = [GOOD, ValueError("Requested tokens exceed context window"), GOOD]
+    results = tmp_path / "results.jsonl"
+    items = [("first", PROMPT), ("broken", PROMPT), ("../../escape", PROMPT)]
+
+    ok = run_batch(items, str(results), output_dir=str(tmp_path / "parts"), cad_workers=1, use_cache=False)
+
+    records = {r["id"]: r for r in map(json.loads, results.read_text().splitlines())}
+    assert ok == 2
+    assert records["broken"]["status"] == "llm_error"
+    assert "context window" in records["broken"]["error"]
+    assert records["first"]["status"] == records["../../escape"]["status"] == "ok"
+    assert records["../../escape"]["step_file"].startswith(str(tmp_path / "parts") + os.sep)
+
+
+def test_cad_worker_metrics_reach_the_parent(tmp_path, mock_llm, monkeypatch):
+    # spawned CAD workers read the settings from the environment
+    monkeypatch.setenv("CAD_AGENT_TRACE", "1")
+    monkeypatch.setenv("CAD_AGENT_TRACE_LOG", str(tmp_path / "trace.jsonl"))
+    monkeypatch.setattr(tracing, "ENABLED", True)
+    monkeypatch.setattr(tracing, "TRACE_LOG", str(tmp_path / "trace.jsonl"))
+    mock_llm.responses = [GOOD.replace("depth=10", "depth=12")]  # a part no other test exported
+
+    run_batch([("item1", PROMPT)], str(tmp_path / "results.jsonl"), output_dir=str(tmp_path / "parts"),
+              cad_workers=1, use_cache=False)
+
+    assert 'cad_agent_exports_total{result="written"} 1' in tracing.render_metrics()
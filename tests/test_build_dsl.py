@@ -0,0 +1,121 @@
+import cadquery as cq
+import pytest
+
+import natural_languange_to_CAD
+from natural_languange_to_CAD import build_dsl, clear_solid_cache, compile_dsl, parse_dsl, pattern_solid
+from preview_mesh import as_shape
+
+EXPORT = 'EXPORT filename="part.step"'
+
+
+def build_sequential(program):
+    """Reference build: every command in order, one boolean per SUBTRACT, nothing folded or cached."""
+    solids = {}
+    main_part = None
+    for entry in parse_dsl(program):
+        cmd, args = entry["cmd"], entry["args"]
+        if cmd == "CREATE_BOX":
+            solids[args["id"]] = cq.Workplane("XY").box(args["width"], args["height"], args["depth"])
+        elif cmd == "CREATE_CYLINDER":
+            solids[args["id"]] = cq.Workplane("XY").cylinder(args["height"], args["radius"])
+        elif cmd == "TRANSLATE":
+            solids[args["id"]] = solids[args["id"]].translate((args["x"], args["y"], args["z"]))
+        elif cmd == "SUBTRACT":
+            solids[args["target"]] = solids[args["target"]].cut(solids[args["tool"]])
+        elif cmd == "FILLET":
+            solids[args["id"]] = solids[args["id"]].edges().fillet(args["radius"])
+        elif cmd == "EXPORT":
+            return solids[main_part]
+        else:
+            solids[args["id"]] = pattern_solid(solids[args["id"]], cmd, args)
+        if cmd.startswith("CREATE_") and main_part is None:
+            main_part = args["id"]
+
+
+def assert_same_part(part, reference):
+    part, reference = as_shape(part), as_shape(reference)
+    assert part.Volume() == pytest.approx(reference.Volume(), rel=1e-6)
+    assert len(part.Faces()) == len(reference.Faces())
+    box, ref_box = part.BoundingBox(), reference.BoundingBox()
+    assert (box.xmin, box.ymin, box.zmin, box.xmax, box.ymax, box.zmax) == pytest.approx(
+        (ref_box.xmin, ref_box.ymin, ref_box.zmin, ref_box.xmax, ref_box.ymax, ref_box.zmax))
+
+
+def nodes_of(program):
+    return compile_dsl(parse_dsl(program))[0]
+
+
+PLATE = "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+HOLES = "".join(
+    f"CREATE_CYLINDER id=h{i} radius=3 height=15\nTRANSLATE id=h{i} x={x} y={y} z=0\n"
+    for i, (x, y) in enumerate([(-15, -15), (15, -15), (-15, 15)])
+)
+
+FOLDED_TRANSLATE = (PLATE + "CREATE_CYLINDER id=pin radius=4 height=15\n"
+                    "TRANSLATE id=pin x=10 y=0 z=0\nTRANSLATE id=pin x=0 y=-12 z=0\nTRANSLATE id=pin x=2 y=0 z=0\n"
+                    "SUBTRACT target=plate tool=pin\n" + EXPORT)
+FUSED_CUTS = (PLATE + HOLES + "SUBTRACT target=plate tool=h0\nSUBTRACT target=plate tool=h1\n"
+              "SUBTRACT target=plate tool=h2\n" + EXPORT)
+# the cut plate is read (as a tool) between two cuts, so those cuts must not fuse
+READ_BETWEEN_CUTS = (PLATE + HOLES + "CREATE_BOX id=block width=60 height=60 depth=4\n"
+                     "SUBTRACT target=plate tool=h0\nSUBTRACT target=block tool=plate\n"
+                     "SUBTRACT target=plate tool=h1\nSUBTRACT target=plate tool=h2\n"
+                     "TRANSLATE id=block x=5 y=0 z=0\nSUBTRACT target=plate tool=block\n" + EXPORT)
+DEAD_SOLID = (PLATE + "CREATE_CYLINDER id=spare radius=5 height=5\nGRID_PATTERN id=spare nx=3 ny=3 dx=12 dy=12\n"
+              "CREATE_CYLINDER id=hole radius=4 height=15\nSUBTRACT target=plate tool=hole\n" + EXPORT)
+
+
+@pytest.mark.parametrize("program", [FOLDED_TRANSLATE, FUSED_CUTS, READ_BETWEEN_CUTS, DEAD_SOLID],
+                         ids=["folded-translate", "fused-cuts", "read-between-cuts", "dead-solid"])
+def test_dag_build_matches_sequential_build(program):
+    clear_solid_cache()
+    part, export = build_dsl(parse_dsl(program))
+
+    assert export == {"filename": "part.step"}
+    assert_same_part(part, build_sequential(program))
+
+
+def test_consecutive_translates_fold_into_one_node():
+    translates = [node for node in nodes_of(FOLDED_TRANSLATE) if node["cmd"] == "TRANSLATE"]
+
+    assert len(translates) == 1
+    assert (translates[0]["args"]["x"], translates[0]["args"]["y"], translates[0]["args"]["z"]) == (12, -12, 0)
+
+
+def test_subtract_fusion_stops_at_a_read_of_the_target():
+    fused = [node for node in nodes_of(FUSED_CUTS) if node["cmd"] == "SUBTRACT"]
+    split = [node for node in nodes_of(READ_BETWEEN_CUTS) if node["sid"] == "plate" and node["cmd"] == "SUBTRACT"]
+
+    assert len(fused) == 1 and len(fused[0]["inputs"]) == 4
+    # h0 alone (block reads that state), then h1, h2 and the block fused
+    assert [len(node["inputs"]) - 1 for node in split] == [1, 3]
+
+
+def test_dead_solids_are_not_built(monkeypatch):
+    built = []
+    evaluate_node = natural_languange_to_CAD.evaluate_node
+    monkeypatch.setattr(natural_languange_to_CAD, "evaluate_node",
+                        lambda node, inputs: built.append(node["sid"]) or evaluate_node(node, inputs))
+    clear_solid_cache()
+
+    build_dsl(parse_dsl(DEAD_SOLID))
+
+    assert "spare" not in built
+
+
+def test_memo_rebuilds_only_what_an_edit_changed(monkeypatch):
+    built = []
+    evaluate_node = natural_languange_to_CAD.evaluate_node
+    monkeypatch.setattr(natural_languange_to_CAD, "evaluate_node",
+                        lambda node, inputs: built.append(node["cmd"]) or evaluate_node(node, inputs))
+    clear_solid_cache()
+    memo = {}
+    build_dsl(parse_dsl(FUSED_CUTS), memo=memo)
+    edited = FUSED_CUTS.replace("TRANSLATE id=h2 x=-15 y=15", "TRANSLATE id=h2 x=-12 y=15")
+
+    built.clear()
+    part, _ = build_dsl(parse_dsl(edited), memo=memo)
+
+    # the moved hole and the fused cut it feeds; the plate and the other holes come from the memo
+    assert built == ["TRANSLATE", "SUBTRACT"]
+    assert_same_part(part, build_sequential(edited))
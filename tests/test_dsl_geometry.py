@@ -0,0 +1,36 @@
+import pytest
+
+from dsl_geometry import check_geometry
+from natural_languange_to_CAD import parse_dsl
+
+PLATE = "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+
+# (program, accepted, part of the message)
+CHECKS = [
+    (PLATE + "FILLET id=plate radius=4.9", True, "Valid geometry"),
+    (PLATE + "FILLET id=plate radius=5", False, "must be below 5"),
+    ("CREATE_CYLINDER id=pin radius=3 height=20\nFILLET id=pin radius=3", False, "must be below 3"),
+    (PLATE + "CREATE_CYLINDER id=hole radius=4 height=15\nTRANSLATE id=hole x=40 y=0 z=0\n"
+     "SUBTRACT target=plate tool=hole", False, "does not overlap target 'plate'"),
+    (PLATE + "CREATE_CYLINDER id=holes radius=4 height=15\n"
+     "GRID_PATTERN id=holes nx=2 ny=2 dx=60 dy=34\nSUBTRACT target=plate tool=holes",
+     False, "copy 1 of tool 'holes' does not overlap"),
+    # a hole shorter than the plate and centered in it leaves a closed void
+    (PLATE + "CREATE_CYLINDER id=hole radius=4 height=6\nSUBTRACT target=plate tool=hole",
+     False, "hidden cavity"),
+    (PLATE + "CREATE_CYLINDER id=hole radius=4 height=15\nSUBTRACT target=plate tool=hole", True, "Valid geometry"),
+    # a blind pocket breaks the top face only: it is open, so it is allowed
+    (PLATE + "CREATE_BOX id=pocket width=20 height=20 depth=6\nTRANSLATE id=pocket x=0 y=0 z=3\n"
+     "SUBTRACT target=plate tool=pocket", True, "Valid geometry"),
+    # an enclosed tool that meets an earlier through hole is open as well
+    (PLATE + "CREATE_CYLINDER id=hole radius=4 height=15\nSUBTRACT target=plate tool=hole\n"
+     "CREATE_BOX id=slot width=20 height=4 depth=4\nSUBTRACT target=plate tool=slot", True, "Valid geometry"),
+]
+
+
+@pytest.mark.parametrize("program, accepted, message", CHECKS)
+def test_check_geometry(program, accepted, message):
+    valid, msg = check_geometry(parse_dsl(program))
+
+    assert valid == accepted
+    assert message in msg
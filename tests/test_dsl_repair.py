@@ -0,0 +1,70 @@
+import pytest
+
+from dsl_repair import format_dsl, repair_dsl
+from natural_languange_to_CAD import parse_dsl
+
+EXPORT = 'EXPORT filename="part.step"'
+
+# (program, repaired program, the change reported for it)
+REPAIRS = [
+    (  # a duplicate id gets a suffix, later references follow the rename
+        "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+        "CREATE_CYLINDER id=hole radius=4 height=15\n"
+        "CREATE_CYLINDER id=hole radius=3 height=15\n"
+        "SUBTRACT target=plate tool=hole\n" + EXPORT,
+        "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+        "CREATE_CYLINDER id=hole radius=4 height=15\n"
+        "CREATE_CYLINDER id=hole_2 radius=3 height=15\n"
+        "SUBTRACT target=plate tool=hole_2\n" + EXPORT,
+        "renamed duplicate id 'hole' to 'hole_2'",
+    ),
+    (  # a reference to a solid that was never created drops the line
+        "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+        "SUBTRACT target=plate tool=missing\n" + EXPORT,
+        "CREATE_BOX id=plate width=50 height=50 depth=10\n" + EXPORT,
+        "dropped SUBTRACT with unknown tool 'missing'",
+    ),
+    (
+        "CREATE_BOX id=plate width=50 height=50 depth=10\n"
+        "CREATE_SPHERE id=ball radius=5\n" + EXPORT,
+        "CREATE_BOX id=plate width=50 height=50 depth=10\n" + EXPORT,
+        "dropped unknown command CREATE_SPHERE",
+    ),
+    (
+        "CREATE_BOX id=plate width=-50 height=50 depth=10\n" + EXPORT,
+        "CREATE_BOX id=plate width=50 height=50 depth=10\n" + EXPORT,
+        "CREATE_BOX width -50 -> 50",
+    ),
+    (
+        "CREATE_CYLINDER id=pin radius=2 height=10\n"
+        "LINEAR_PATTERN id=pin count=2.6 dx=5 dy=0 dz=0\n" + EXPORT,
+        "CREATE_CYLINDER id=pin radius=2 height=10\n"
+        "LINEAR_PATTERN id=pin count=3 dx=5 dy=0 dz=0\n" + EXPORT,
+        "LINEAR_PATTERN count 2.6 rounded to 3",
+    ),
+    (
+        "CREATE_BOX id=plate width=50 height=50 depth=10",
+        "CREATE_BOX id=plate width=50 height=50 depth=10\n" + EXPORT,
+        'appended EXPORT filename="part.step"',
+    ),
+]
+
+
+@pytest.mark.parametrize("program, repaired, change", REPAIRS)
+def test_repair_dsl(program, repaired, change):
+    commands, changes = repair_dsl(parse_dsl(program))
+
+    assert format_dsl(commands) == repaired
+    assert changes == [change]
+
+
+def test_valid_program_is_left_alone():
+    program = ("CREATE_BOX id=plate width=50 height=50 depth=10\n"
+               "CREATE_CYLINDER id=hole radius=4 height=15\n"
+               "TRANSLATE id=hole x=-10 y=0 z=0\n"
+               "SUBTRACT target=plate tool=hole\n" + EXPORT)
+
+    commands, changes = repair_dsl(parse_dsl(program))
+
+    assert format_dsl(commands) == program
+    assert changes == []
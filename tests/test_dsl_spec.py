@@ -0,0 +1,56 @@
+import math
+
+import pytest
+from llama_cpp import LlamaGrammar
+
+from dsl_spec import DSL_EDIT_GBNF, DSL_GBNF, pattern_offsets
+from natural_languange_to_CAD import build_dsl, clear_solid_cache, parse_dsl
+from preview_mesh import as_shape
+
+EXPORT = 'EXPORT filename="part.step"'
+PIN = "CREATE_CYLINDER id=pin radius=2 height=10\n"
+PIN_VOLUME = math.pi * 2 ** 2 * 10
+
+
+@pytest.mark.parametrize("cmd, args, offsets", [
+    ("LINEAR_PATTERN", {"count": 3.0, "dx": 10.0}, [(-10, 0, 0), (0, 0, 0), (10, 0, 0)]),
+    ("LINEAR_PATTERN", {"count": 2.0, "dx": 4.0, "dy": 0.0, "dz": 6.0}, [(-2, 0, -3), (2, 0, 3)]),
+    ("GRID_PATTERN", {"nx": 2.0, "ny": 3.0, "dx": 10.0, "dy": 8.0},
+     [(-5, -8, 0), (5, -8, 0), (-5, 0, 0), (5, 0, 0), (-5, 8, 0), (5, 8, 0)]),
+    ("POLAR_PATTERN", {"count": 4.0, "radius": 10.0}, [(10, 0, 0), (0, 10, 0), (-10, 0, 0), (0, -10, 0)]),
+])
+def test_pattern_offsets(cmd, args, offsets):
+    assert [pytest.approx(offset, abs=1e-9) for offset in offsets] == pattern_offsets(cmd, args)
+
+
+@pytest.mark.parametrize("pattern, copies", [
+    ("LINEAR_PATTERN id=pin count=4 dx=10 dy=0 dz=0", 4),
+    ("GRID_PATTERN id=pin nx=3 ny=2 dx=10 dy=10", 6),
+    ("POLAR_PATTERN id=pin count=5 radius=20", 5),
+])
+def test_pattern_builds_every_copy(pattern, copies):
+    clear_solid_cache()
+    part, _ = build_dsl(parse_dsl(PIN + pattern + "\n" + EXPORT))
+
+    assert as_shape(part).Volume() == pytest.approx(copies * PIN_VOLUME, rel=1e-6)
+
+
+@pytest.mark.parametrize("plane, axis", [("XY", 2), ("YZ", 0), ("XZ", 1)])
+def test_mirror_adds_the_image_across_the_plane(plane, axis):
+    clear_solid_cache()
+    program = PIN + f"TRANSLATE id=pin x=10 y=20 z=30\nMIRROR id=pin plane={plane}\n" + EXPORT
+
+    part, _ = build_dsl(parse_dsl(program))
+
+    box = as_shape(part).BoundingBox()
+    lo, hi = (box.xmin, box.ymin, box.zmin), (box.xmax, box.ymax, box.zmax)
+    assert as_shape(part).Volume() == pytest.approx(2 * PIN_VOLUME, rel=1e-6)
+    assert lo[axis] == pytest.approx(-hi[axis])  # symmetric across the plane
+    assert lo[axis] < 0 < hi[axis]
+
+
+@pytest.mark.parametrize("gbnf", [DSL_GBNF, DSL_EDIT_GBNF], ids=["program", "edit-script"])
+def test_grammars_compile(gbnf):
+    grammar = LlamaGrammar.from_string(gbnf, verbose=False)
+
+    assert grammar is not None
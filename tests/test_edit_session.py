@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from edit_session import EditSession, apply_edits, parse_edits
+from mock_llama import GOOD
+
+PROGRAM = [
+    "CREATE_BOX id=plate width=50 height=50 depth=10",
+    "CREATE_CYLINDER id=hole radius=4 height=15",
+    "SUBTRACT target=plate tool=hole",
+    'EXPORT filename="plate.step"',
+]
+
+
+def test_parse_edits():
+    script = ("SET 2: CREATE_CYLINDER id=hole radius=6 height=15\n"
+              "insert 0: CREATE_BOX id=base width=5 height=5 depth=5\n"
+              "DELETE 3\n"
+              "Sure, here are the edits\n")
+
+    assert parse_edits(script) == [
+        ("SET", 2, "CREATE_CYLINDER id=hole radius=6 height=15"),
+        ("INSERT", 0, "CREATE_BOX id=base width=5 height=5 depth=5"),
+        ("DELETE", 3, None),
+    ]
+
+
+@pytest.mark.parametrize("edits, expected", [
+    ([("SET", 2, "CREATE_CYLINDER id=hole radius=6 height=15")],
+     [PROGRAM[0], "CREATE_CYLINDER id=hole radius=6 height=15", PROGRAM[2], PROGRAM[3]]),
+    ([("DELETE", 3, None)], [PROGRAM[0], PROGRAM[1], PROGRAM[3]]),
+    # line numbers refer to the original program, whatever the order of the edits
+    ([("INSERT", 2, "TRANSLATE id=hole x=10 y=0 z=0"), ("INSERT", 0, "CREATE_BOX id=lug width=5 height=5 depth=5")],
+     ["CREATE_BOX id=lug width=5 height=5 depth=5", PROGRAM[0], PROGRAM[1], "TRANSLATE id=hole x=10 y=0 z=0",
+      PROGRAM[2], PROGRAM[3]]),
+    # commands inserted after the EXPORT end up before it
+    ([("INSERT", 4, "FILLET id=plate radius=1")], PROGRAM[:3] + ["FILLET id=plate radius=1", PROGRAM[3]]),
+    # with two EXPORTs the last one is kept
+    ([("INSERT", 4, 'EXPORT filename="renamed.stl"')], PROGRAM[:3] + ['EXPORT filename="renamed.stl"']),
+])
+def test_apply_edits(edits, expected):
+    assert apply_edits(PROGRAM, edits) == (expected, None)
+
+
+@pytest.mark.parametrize("edit", [("SET", 5, "FILLET id=plate radius=1"), ("DELETE", 0, None), ("SET", 1, None)])
+def test_apply_edits_rejects_edits_outside_the_program(edit):
+    lines, error = apply_edits(PROGRAM, [edit])
+
+    assert lines == PROGRAM
+    assert "does not match the 4-line program" in error
+
+
+def test_session_edits_the_current_part(tmp_path, mock_llm):
+    mock_llm.responses = [GOOD, "SET 1: CREATE_BOX id=plate width=60 height=50 depth=10\n"]
+    session = EditSession(output_dir=str(tmp_path))
+
+    first = session.submit("A 50 mm square plate with four holes, for the edit session test")
+    second = session.submit("make the plate 60 mm wide")
+
+    assert first["mode"] == "generate" and first["status"] == "ok"
+    assert second["mode"] == "edit" and second["status"] == "ok"
+    assert session.lines[0] == "CREATE_BOX id=plate width=60 height=50 depth=10"
+    assert second["step_file"] != first["step_file"] and os.path.exists(second["step_file"])
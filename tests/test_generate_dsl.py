@@ -0,0 +1,34 @@
+from natural_languange_to_CAD import generate_dsl, parse_dsl, validate_dsl
+
+PROMPT = "Create a 200x20x5 plate with a row of 15 holes of radius 1."
+HOLES = "".join(
+    f"CREATE_CYLINDER id=h{i} radius=1 height=10\nTRANSLATE id=h{i} x={i * 12 - 84} y=0 z=0\nSUBTRACT target=plate tool=h{i}\n"
+    for i in range(15)
+)
+PROGRAM = "CREATE_BOX id=plate width=200 height=20 depth=5\n" + HOLES + 'EXPORT filename="plate.step"\n'
+
+
+def test_cut_off_program_is_resumed_not_completed(mock_llm):
+    # 300 tokens of 4 characters: the scripted program stops in the middle of the holes
+    kept = PROGRAM[:1200].rsplit("\n", 1)[0].splitlines()
+    rest = "".join(line + "\n" for line in PROGRAM.splitlines()[len(kept):])
+    mock_llm.responses = [PROGRAM, rest]
+
+    dsl = generate_dsl(PROMPT, max_attempts=2, candidates=1)
+
+    assert len(mock_llm.prompts) == 2
+    assert mock_llm.prompts[1].rstrip().endswith(kept[-1])  # resumed after the last complete line
+    assert dsl.count("SUBTRACT") == 15
+
+
+def test_cut_off_program_is_not_accepted(mock_llm):
+    mock_llm.responses = [PROGRAM]
+
+    assert generate_dsl(PROMPT, max_attempts=1, candidates=1) is None
+
+
+def test_program_without_solids_is_invalid(mock_llm):
+    mock_llm.responses = ["", ""]
+
+    assert not validate_dsl(parse_dsl('EXPORT filename="part.step"'))[0]
+    assert generate_dsl(PROMPT, max_attempts=2, candidates=1) is None
@@ -0,0 +1,31 @@
+import parallel_build
+from natural_languange_to_CAD import build_dsl, clear_solid_cache, parse_dsl
+from parallel_build import build_dsl_parallel
+
+# twelve holes, each its own CREATE/TRANSLATE/SUBTRACT chain
+PLATE_WITH_HOLES = "\n".join(
+    ["CREATE_BOX id=plate width=50 height=40 depth=5"]
+    + [line
+       for i in range(12)
+       for line in (f"CREATE_CYLINDER id=h{i} radius=2 height=10",
+                    f"TRANSLATE id=h{i} x={(i % 4) * 10 - 15} y={(i // 4) * 10 - 10} z=0",
+                    f"SUBTRACT target=plate tool=h{i}")]
+    + ['EXPORT filename="plate.step"']
+)
+
+
+def test_parallel_build_matches_serial(monkeypatch):
+    monkeypatch.setattr(parallel_build, "PARALLEL_MIN_NODES", 1)
+    commands = parse_dsl(PLATE_WITH_HOLES)
+    clear_solid_cache()
+    serial, _ = build_dsl(commands)
+    clear_solid_cache()
+
+    parallel, export = build_dsl_parallel(commands, 2)
+
+    assert parallel_build._pool is not None  # the tool chains went to the process pool
+    assert export["filename"]
+    a, b = serial.val(), parallel.val()
+    assert abs(a.Volume() - b.Volume()) < 1e-6 * a.Volume()
+    assert len(a.Faces()) == len(b.Faces())
+    assert a.BoundingBox().DiagonalLength == b.BoundingBox().DiagonalLength
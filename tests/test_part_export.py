@@ -0,0 +1,44 @@
+import os
+
+from cadquery import exporters
+
+from mock_llama import GOOD
+from natural_languange_to_CAD import build_dsl, clear_solid_cache, execute_dsl_cached, parse_dsl
+from part_export import export_part, find_export, step_export
+from shape_cache import preview_cached
+
+
+def test_stl_matches_cadquery_export(tmp_path):
+    commands = parse_dsl(GOOD)
+    clear_solid_cache()
+    part, export = build_dsl(commands)
+    paths = export_part(part, commands, export["filename"], str(tmp_path / "out"))
+
+    clear_solid_cache()
+    reference = str(tmp_path / "reference.stl")
+    exporters.export(build_dsl(commands)[0], reference)
+
+    assert os.path.getsize(paths["stl"]) == os.path.getsize(reference)
+
+
+def test_equivalent_program_reuses_the_export(tmp_path):
+    commands = parse_dsl(GOOD)
+    part, export = build_dsl(commands)
+    paths = export_part(part, commands, export["filename"], str(tmp_path))
+    renamed = parse_dsl(GOOD.replace("plate", "base").replace('"plate.step"', '"base.stp"'))
+
+    alias = find_export(renamed, "base.stp", str(tmp_path))
+
+    assert os.path.dirname(alias) == os.path.dirname(paths["step"])
+    assert os.path.samefile(alias, paths["step"])
+
+
+def test_result_cache_hit_for_stl_export_keeps_a_step(tmp_path):
+    commands = parse_dsl(GOOD.replace('"plate.step"', '"plate.stl"'))
+    execute_dsl_cached(commands, output_dir=str(tmp_path / "first"))
+
+    path, part = execute_dsl_cached(commands, output_dir=str(tmp_path / "second"), return_part=True)
+
+    assert part is None  # served from the result cache
+    assert path.endswith("plate.stl") and os.path.exists(path)
+    assert preview_cached(step_export(path))
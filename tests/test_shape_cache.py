@@ -0,0 +1,15 @@
+import os
+
+import shape_cache
+from mock_llama import GOOD
+from natural_languange_to_CAD import execute_dsl, parse_dsl
+
+
+def test_exports_share_one_cache_per_output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(shape_cache, "SHAPE_CACHE_DIR", None)
+    first = execute_dsl(parse_dsl(GOOD), str(tmp_path))
+    second = execute_dsl(parse_dsl(GOOD.replace("radius=4", "radius=3")), str(tmp_path))
+
+    assert os.path.dirname(first) != os.path.dirname(second)
+    assert shape_cache.shape_cache_dir(first) == shape_cache.shape_cache_dir(second) == str(tmp_path / ".shape_cache")
+    assert shape_cache.shape_cache_dir(str(tmp_path / "plate.step")) == str(tmp_path / ".shape_cache")
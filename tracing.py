@@ -0,0 +1,228 @@
+import contextvars
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --------------------------
+# Tracing settings
+# --------------------------
+# Off by default: span() then returns a shared no-op context and count() returns at once.
+ENABLED = os.environ.get("CAD_AGENT_TRACE", "0") == "1"
+TRACE_LOG = os.environ.get("CAD_AGENT_TRACE_LOG", "")  # JSON lines file; empty: stderr
+METRICS_PORT = int(os.environ.get("CAD_AGENT_METRICS_PORT", "9464"))
+METRICS_HOST = os.environ.get("CAD_AGENT_METRICS_HOST", "127.0.0.1")  # 0.0.0.0 to let other hosts scrape
+
+# Histogram buckets for span durations, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NOOP = nullcontext({})
+_ids = itertools.count(1)
+_current = contextvars.ContextVar("cad_agent_span", default=None)
+_log_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _write(record):
+    line = json.dumps(record, default=str) + "\n"
+    with _log_lock:
+        if TRACE_LOG:
+            with open(TRACE_LOG, "a") as f:
+                f.write(line)
+        else:
+            sys.stderr.write(line)
+
+
+# --------------------------
+# Spans
+# --------------------------
+def span(name, **attrs):
+    """Time a pipeline stage: `with span("cad.export", format="step") as s: s["bytes"] = n`.
+
+    Each finished span is written as one JSON line (with its trace id and parent)
+    and its duration goes into the `cad_agent_stage_seconds` histogram.
+    """
+    if not ENABLED:
+        return _NOOP
+    return _span(name, attrs)
+
+
+@contextmanager
+def _span(name, attrs):
+    parent = _current.get()
+    span_id = next(_ids)
+    trace_id = parent["trace"] if parent else f"{os.getpid()}-{span_id}"
+    record = {"trace": trace_id, "span": span_id, "parent": parent["span"] if parent else None}
+    token = _current.set(record)
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current.reset(token)
+        record.update(name=name, ts=time.time(), duration_ms=round(duration * 1000, 3), pid=os.getpid(), **attrs)
+        _write(record)
+        observe("cad_agent_stage_seconds", duration, stage=name)
+
+
+def record_span(name, duration, **attrs):
+    """Log a span timed by the caller, e.g. across the yields of a generator where
+    a `with span()` block would leak into the consumer's context.
+    """
+    if not ENABLED:
+        return
+    parent = _current.get()
+    _write({"trace": parent["trace"] if parent else None, "span": next(_ids),
+            "parent": parent["span"] if parent else None, "name": name, "ts": time.time(),
+            "duration_ms": round(duration * 1000, 3), "pid": os.getpid(), **attrs})
+    observe("cad_agent_stage_seconds", duration, stage=name)
+
+
+def event(name, **attrs):
+    """Log a point-in-time record (e.g. a validation failure) in the current trace."""
+    if not ENABLED:
+        return
+    parent = _current.get()
+    _write({"trace": parent["trace"] if parent else None, "parent": parent["span"] if parent else None,
+            "name": name, "ts": time.time(), "pid": os.getpid(), **attrs})
+
+
+def reason_label(message):
+    """Low-cardinality form of a validation message for a metric label."""
+    message = message.split(" (line:", 1)[0]
+    message = re.sub(r"'[^']*'", "'*'", message)
+    message = re.sub(r"-?\d+(\.\d+)?", "N", message)
+    return message.split(":", 1)[0][:80]
+
+
+# --------------------------
+# Metrics
+# --------------------------
+def count(name, value=1, **labels):
+    """Add to a counter."""
+    if not ENABLED:
+        return
+    key = (name, _labels_key(labels))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record a value (usually seconds) in a histogram."""
+    if not ENABLED:
+        return
+    key = (name, _labels_key(labels))
+    with _metrics_lock:
+        hist = _histograms.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+def collect():
+    """Take this process's counters and histograms and reset them.
+
+    Worker processes return the result to the parent, which adds it with
+    merge(); /metrics is only served by the parent.
+    """
+    if not ENABLED:
+        return None
+    with _metrics_lock:
+        taken = {"counters": dict(_counters), "histograms": dict(_histograms)}
+        _counters.clear()
+        _histograms.clear()
+    return taken
+
+
+def merge(taken):
+    """Add metrics collected in another process (see collect())."""
+    if not ENABLED or not taken:
+        return
+    with _metrics_lock:
+        for key, value in taken["counters"].items():
+            _counters[key] = _counters.get(key, 0) + value
+        for key, other in taken["histograms"].items():
+            hist = _histograms.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            hist["buckets"] = [a + b for a, b in zip(hist["buckets"], other["buckets"])]
+            hist["sum"] += other["sum"]
+            hist["count"] += other["count"]
+
+
+def register_gauge(name, read, help_text=""):
+    """Expose the value returned by `read()` at scrape time."""
+    _gauges[name] = (read, help_text)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _metrics_lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, dict(hist, buckets=list(hist["buckets"]))) for key, hist in _histograms.items())
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        lines += [f"{n}{_format_labels(labels)} {value}" for (n, labels), value in counters if n == name]
+    for name in sorted({name for (name, _), _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (n, labels), hist in histograms:
+            if n != name:
+                continue
+            for bound, bucket in zip(BUCKETS, hist["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+    for name, (read, help_text) in sorted(_gauges.items()):
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {read()}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve /metrics from a daemon thread. Returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics at http://{host}:{server.server_port}/metrics")
+    return server
@@ -1,8 +1,10 @@
-from llama_cpp import Llama
+import os
+import sys
 
-model_path = "/home/bacchus/.cache/huggingface/hub/models--TheBloke--Mistral-7B-Instruct-v0.2-GGUF/snapshots/3a6fbf4a41a1d52e415a4958cde6856d34b2db93/mistral-7b-instruct-v0.2.Q4_K_M.gguf"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_provider import get_llm  # model path and runtime settings: config, host profile, env
 
-llm = Llama(model_path=model_path, n_ctx=2048, n_threads=8)
+llm = get_llm()
 
 prompt = "You are a helpful assistant. What is 3 + 4?"
 